@@ -0,0 +1,403 @@
+"""
+Almacén SQLite del historial de entrenamientos.
+
+La base guarda las series de todos los miembros en una tabla con índices
+por (miembro, fecha) y (miembro, ejercicio), así que las consultas (la
+mejor serie de Sentadillas del último trimestre, las series de un rango
+de fechas) no abren ningún libro. El libro y la base se sincronizan en los
+dos sentidos:
+
+- exportar: base → libro. Registro y Sesiones se reescriben con las series
+  no archivadas de la base (solo valores A-I, los estilos y J-M no cambian) y cada fila
+  lleva en la columna oculta I el id de su serie. El Dashboard se
+  recalcula con sus fórmulas o, con estatico=True, se escribe ya calculado
+  desde la base (ver analitica.calcular_metricas).
+- importar: libro → base. Una fila con id es esa serie: si se editó en el
+  libro se actualiza en la base, y una serie que ya no está en el libro
+  se borra de la base, salvo que sea de un mes que rotar_historial pasó al
+  archivo (hoja Historico): esa se queda marcada como archivada. Las filas
+  sin id (Excel, ingesta) son series nuevas; hasta que se exportan se
+  reconocen por sus valores, así que importar dos veces no las repite.
+- sincronizar: importar y exportar, en ese orden, cada miembro del roster.
+
+Las consultas cubren todas las series, también las archivadas.
+
+Los cambios hechos directamente en la base (INSERT, UPDATE o DELETE de
+otros programas) quedan pendientes de exportar y mandan sobre el libro: un
+trigger marca la serie como pendiente y los borrados se anotan en
+`borradas`. Con reemplazar=True el libro manda sobre todo.
+
+    python almacen_sqlite.py gym.db sincronizar roster.jsonl
+    python almacen_sqlite.py gym.db mejor m001 Sentadillas --desde 2026-07-01
+    python almacen_sqlite.py gym.db series m001 --desde 2026-10-01 --hasta 2026-10-31
+"""
+
+from collections import defaultdict
+import datetime
+import os
+import sqlite3
+
+import analitica
+import generar_excel
+import rotar_historial
+from generar_excel import (
+    COLUMNA_ID, FILA_INICIO_HISTORIAL, capacidad_libro, configuracion_libro,
+    escribir_sesiones, indice_sesiones, leer_sesiones,
+)
+
+DB_ALMACEN = "/home/user/gym/entrenamientos.db"
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS miembros (
+    id          TEXT PRIMARY KEY,
+    libro       TEXT
+);
+CREATE TABLE IF NOT EXISTS series (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,  -- nunca se reusa: va en el libro
+    miembro     TEXT NOT NULL REFERENCES miembros(id),
+    fecha       TEXT NOT NULL,          -- AAAA-MM-DD
+    rutina      TEXT NOT NULL,
+    ejercicio   TEXT NOT NULL,
+    serie       INTEGER,
+    reps        INTEGER,
+    peso        REAL,
+    descanso    INTEGER,
+    notas       TEXT NOT NULL DEFAULT '',
+    pendiente   INTEGER NOT NULL DEFAULT 1, -- 1: cambiada en la base, sin exportar
+    archivada   INTEGER NOT NULL DEFAULT 0  -- 1: rotada del libro a su archivo
+);
+CREATE TABLE IF NOT EXISTS borradas (
+    id          INTEGER PRIMARY KEY,    -- id de la serie borrada en la base
+    miembro     TEXT NOT NULL
+);
+"""
+
+# La sincronización escribe con INSERT OR REPLACE, que no dispara estos
+# triggers (recursive_triggers está desactivado); solo los demás escritores
+TRIGGERS = """
+CREATE INDEX IF NOT EXISTS series_miembro_fecha ON series (miembro, fecha);
+CREATE INDEX IF NOT EXISTS series_miembro_ejercicio ON series (miembro, ejercicio, fecha);
+CREATE TRIGGER IF NOT EXISTS series_editada
+AFTER UPDATE OF fecha, rutina, ejercicio, serie, reps, peso, descanso, notas ON series
+WHEN NEW.pendiente = 0
+BEGIN
+    UPDATE series SET pendiente = 1 WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS series_borrada AFTER DELETE ON series
+WHEN OLD.pendiente = 0
+BEGIN
+    INSERT OR REPLACE INTO borradas (id, miembro) VALUES (OLD.id, OLD.miembro);
+END;
+"""
+
+COLUMNAS = ("fecha", "rutina", "ejercicio", "serie", "reps", "peso", "descanso", "notas")
+
+
+def abrir(ruta=DB_ALMACEN):
+    """Conexión a la base (la crea con su esquema si no existe)."""
+    con = sqlite3.connect(ruta)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA foreign_keys=ON")
+    con.executescript(ESQUEMA)
+    columnas = {c[1] for c in con.execute("PRAGMA table_info(series)")}
+    # Bases anteriores a la sincronización por id: sus series vinieron del libro
+    if "pendiente" not in columnas:
+        with con:
+            con.execute("ALTER TABLE series ADD COLUMN pendiente INTEGER NOT NULL DEFAULT 1")
+            con.execute("UPDATE series SET pendiente = 0")
+    if "archivada" not in columnas:
+        with con:
+            con.execute("ALTER TABLE series ADD COLUMN archivada INTEGER NOT NULL DEFAULT 0")
+    con.executescript(TRIGGERS)
+    return con
+
+
+# ── Conversión fila de Registro ↔ fila de la base ─────────────────
+def _numero(valor):
+    if valor in (None, ""):
+        return None
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return int(valor) if float(valor).is_integer() else float(valor)
+    try:
+        return _numero(float(str(valor).replace(",", ".")))
+    except ValueError:
+        return None
+
+
+def fila_bd(fila):
+    """Fila A-H de Registro como tupla de la base (None si no tiene fecha)."""
+    fecha, rutina, ejercicio, serie, reps, peso, descanso, notas = fila
+    fecha = analitica._a_fecha(fecha)
+    if fecha is None:
+        return None
+    return (fecha.isoformat(), str(rutina or ""), str(ejercicio or ""),
+            _numero(serie), _numero(reps), _numero(peso), _numero(descanso),
+            str(notas or ""))
+
+
+def fila_registro(fila):
+    """Tupla de la base como fila A-H de Registro (vacías como "")."""
+    fecha, rutina, ejercicio, *numeros, notas = fila
+    fecha = datetime.datetime.fromisoformat(fecha)
+    return [fecha, rutina, ejercicio,
+            *("" if v is None else _numero(v) for v in numeros), notas]
+
+
+# ── Importar (libro → base) ───────────────────────────────────────
+def filas_libro(ruta):
+    """Pares (id, fila de la base) del Registro de `ruta`; id None si la fila no lo tiene."""
+    filas = []
+    for fila in analitica.iterar_registro(ruta, COLUMNA_ID):
+        datos = fila_bd(fila[:8])
+        if datos is not None:
+            id_serie = _numero(fila[8]) if len(fila) > 8 else None
+            filas.append((id_serie if isinstance(id_serie, int) else None, datos))
+    return filas
+
+
+def importar(con, miembro, ruta, reemplazar=False):
+    """
+    Lleva a la base los cambios del Registro de `ruta` desde la última sincronización.
+
+    Devuelve {"nuevas", "actualizadas", "borradas", "archivadas"}. Las series
+    pendientes (cambiadas en la base) no se tocan, salvo con `reemplazar`:
+    entonces el libro manda también sobre ellas y sobre los borrados de la
+    base. Las que faltan en el libro y son de un mes archivado (ver
+    rotar_historial.meses_archivados) no se borran: se marcan archivadas.
+    """
+    libro = filas_libro(ruta)
+    archivados = rotar_historial.meses_archivados(ruta)
+    with con:
+        con.execute("INSERT INTO miembros (id, libro) VALUES (?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET libro = excluded.libro",
+                    (miembro, os.path.abspath(ruta)))
+        if reemplazar:
+            con.execute("UPDATE series SET pendiente = 0 WHERE miembro = ?", (miembro,))
+            con.execute("DELETE FROM borradas WHERE miembro = ?", (miembro,))
+        base, en_archivo = {}, set()
+        for fila in con.execute(
+                f"SELECT id, {', '.join(COLUMNAS)}, pendiente, archivada FROM series "
+                "WHERE miembro = ?", (miembro,)):
+            base[fila[0]] = (tuple(fila[1:-2]), fila[-2])
+            if fila[-1]:
+                en_archivo.add(fila[0])
+        borradas = {id_serie for (id_serie,) in con.execute(
+            "SELECT id FROM borradas WHERE miembro = ?", (miembro,))}
+
+        vistas, sin_id, actualizadas = set(), [], []
+        for id_serie, fila in libro:
+            if id_serie in borradas:
+                continue
+            if id_serie in base and id_serie not in vistas:
+                vistas.add(id_serie)
+                guardada, pendiente = base[id_serie]
+                # Una serie archivada que vuelve al libro deja de estarlo
+                if not pendiente and (guardada != fila or id_serie in en_archivo):
+                    actualizadas.append((id_serie, fila))
+            else:
+                sin_id.append(fila)
+        # Series importadas sin id que aún no se exportaron: mismas filas del libro
+        por_valor = defaultdict(list)
+        for id_serie, (guardada, pendiente) in base.items():
+            if id_serie not in vistas and not pendiente and id_serie not in en_archivo:
+                por_valor[guardada].append(id_serie)
+        nuevas = []
+        for fila in sin_id:
+            if por_valor[fila]:
+                vistas.add(por_valor[fila].pop())
+            else:
+                nuevas.append(fila)
+        # Lo que el libro ya no tiene se borró allí o, si es de un mes
+        # archivado, lo sacó rotar_historial: sigue en la base
+        archivar, borrar = [], []
+        for id_serie, (guardada, pendiente) in base.items():
+            if id_serie in vistas or pendiente or id_serie in en_archivo:
+                continue
+            if guardada[0][:7] in archivados:
+                archivar.append((id_serie,))
+            else:
+                borrar.append((id_serie,))
+
+        columnas = ", ".join(COLUMNAS)
+        marcas = ", ".join("?" * len(COLUMNAS))
+        con.executemany(
+            f"INSERT OR REPLACE INTO series (id, miembro, {columnas}, pendiente) "
+            f"VALUES (?, ?, {marcas}, 0)",
+            [(id_serie, miembro, *fila) for id_serie, fila in actualizadas])
+        con.executemany(
+            f"INSERT INTO series (miembro, {columnas}, pendiente) VALUES (?, {marcas}, 0)",
+            [(miembro, *fila) for fila in nuevas])
+        con.executemany("UPDATE series SET archivada = 1 WHERE id = ?", archivar)
+        con.executemany("DELETE FROM series WHERE id = ?", borrar)
+        con.executemany("DELETE FROM borradas WHERE id = ?", borrar)
+    return {"nuevas": len(nuevas), "actualizadas": len(actualizadas),
+            "borradas": len(borrar), "archivadas": len(archivar)}
+
+
+# ── Exportar (base → libro) ───────────────────────────────────────
+def registro_columnar(filas):
+    """RegistroColumnar (ver analitica) a partir de filas de la base."""
+    datos = analitica.RegistroColumnar()
+    for fecha, rutina, ejercicio, serie, reps, peso, descanso, _notas in filas:
+        datos.agregar(datetime.date.fromisoformat(fecha), rutina, ejercicio,
+                      serie, reps, peso, descanso)
+    return datos
+
+
+def exportar(con, miembro, ruta, estatico=False, hoy=None):
+    """
+    Reescribe Registro y Sesiones de `ruta` con las series de la base.
+
+    La base manda: las filas del libro que no se importaron antes se
+    pierden (sincronizar importa primero). Las series archivadas se quedan
+    en el archivo y no vuelven al libro. Con `estatico` el Dashboard se
+    vuelve a crear con las métricas calculadas desde la base en lugar de
+    fórmulas. Lanza ValueError si las series no caben en la capacidad del
+    libro. Devuelve cuántas se escribieron.
+    """
+    series = con.execute(
+        f"SELECT id, {', '.join(COLUMNAS)} FROM series "
+        "WHERE miembro = ? AND archivada = 0 ORDER BY fecha, id", (miembro,)).fetchall()
+    filas = [tuple(s[1:]) for s in series]
+    wb = generar_excel.cargar_libro(ruta)
+    if "Registro" not in wb.sheetnames:
+        raise ValueError(f"{ruta} no tiene hoja Registro; no es un libro de entrenamiento")
+    capacidad = capacidad_libro(wb)
+    if len(filas) > capacidad:
+        raise ValueError(
+            f"El historial está lleno ({capacidad} registros) para las {len(filas)} "
+            "series de la base. Genera el libro con más capacidad.")
+
+    ws = wb["Registro"]
+    previas = len(generar_excel.filas_registro(ws))
+    registro = [fila_registro(f) for f in filas]
+    for i in range(max(previas, len(registro))):
+        if i < len(registro):
+            valores = [*registro[i], series[i][0]]
+        else:
+            valores = [""] * 8 + [None]
+        for c, valor in enumerate(valores, start=1):
+            ws.cell(row=FILA_INICIO_HISTORIAL + i, column=c).value = valor
+    if "Sesiones" in wb.sheetnames:
+        ws_ses = wb["Sesiones"]
+        escribir_sesiones(ws_ses, indice_sesiones(registro),
+                          previas=len(leer_sesiones(ws_ses)))
+
+    if estatico:
+        config = configuracion_libro(wb)
+        metricas = analitica.calcular_metricas(registro_columnar(filas), hoy, config)
+        posicion = wb.sheetnames.index("Dashboard")
+        del wb["Dashboard"]
+        generar_excel.crear_hoja_dashboard(wb, capacidad, metricas, config)
+        wb.move_sheet("Dashboard", offset=posicion - wb.sheetnames.index("Dashboard"))
+
+    temporal = f"{ruta}.tmp"
+    try:
+        wb.save(temporal)
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    # Libro y base vuelven a coincidir
+    with con:
+        con.execute("UPDATE series SET pendiente = 0 WHERE miembro = ?", (miembro,))
+        con.execute("DELETE FROM borradas WHERE miembro = ?", (miembro,))
+    return len(filas)
+
+
+def sincronizar(con, miembros, estatico=False):
+    """
+    Importa y exporta cada miembro del roster con libro.
+
+    Devuelve {id: (cambios de importar, series en el libro)}.
+    """
+    resultado = {}
+    for miembro in miembros:
+        ruta = miembro["salida"]
+        if not os.path.exists(ruta):
+            continue
+        cambios = importar(con, miembro["id"], ruta)
+        resultado[miembro["id"]] = (cambios, exportar(con, miembro["id"], ruta, estatico))
+    return resultado
+
+
+# ── Consultas ─────────────────────────────────────────────────────
+def _rango(desde, hasta):
+    return ((desde or datetime.date.min).isoformat(),
+            (hasta or datetime.date.max).isoformat())
+
+
+def series_rango(con, miembro, desde=None, hasta=None):
+    """Series de un miembro entre dos fechas (incluidas), en orden."""
+    return [fila_registro(f) for f in con.execute(
+        f"SELECT {', '.join(COLUMNAS)} FROM series "
+        "WHERE miembro = ? AND fecha BETWEEN ? AND ? ORDER BY fecha, id",
+        (miembro, *_rango(desde, hasta)))]
+
+
+def mejor_serie(con, miembro, ejercicio, desde=None, hasta=None):
+    """Serie con más peso (y, a igual peso, más reps) de un ejercicio, o None."""
+    fila = con.execute(
+        f"SELECT {', '.join(COLUMNAS)} FROM series "
+        "WHERE miembro = ? AND ejercicio = ? AND fecha BETWEEN ? AND ? "
+        "ORDER BY COALESCE(peso, 0) DESC, COALESCE(reps, 0) DESC, fecha DESC LIMIT 1",
+        (miembro, ejercicio, *_rango(desde, hasta))).fetchone()
+    return None if fila is None else fila_registro(fila)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import generar_lote
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db", help="base SQLite (se crea si no existe)")
+    ordenes = parser.add_subparsers(dest="orden", required=True)
+
+    p = ordenes.add_parser("importar", help="llevar a la base los cambios del Registro de un libro")
+    p.add_argument("miembro")
+    p.add_argument("libro")
+    p.add_argument("--reemplazar", action="store_true",
+                   help="el libro manda también sobre los cambios pendientes de la base")
+    p = ordenes.add_parser("exportar", help="reescribir el Registro de un libro desde la base")
+    p.add_argument("miembro")
+    p.add_argument("libro")
+    p.add_argument("--estatico", action="store_true",
+                   help="Dashboard con valores calculados desde la base")
+    p = ordenes.add_parser("sincronizar", help="importar y exportar todo un roster")
+    p.add_argument("roster")
+    p.add_argument("--estatico", action="store_true")
+    p = ordenes.add_parser("series", help="series de un miembro en un rango de fechas")
+    p.add_argument("miembro")
+    p = ordenes.add_parser("mejor", help="mejor serie de un ejercicio")
+    p.add_argument("miembro")
+    p.add_argument("ejercicio")
+    for p in (ordenes.choices["series"], ordenes.choices["mejor"]):
+        p.add_argument("--desde", type=datetime.date.fromisoformat)
+        p.add_argument("--hasta", type=datetime.date.fromisoformat)
+    args = parser.parse_args()
+
+    con = abrir(args.db)
+    if args.orden == "importar":
+        cambios = importar(con, args.miembro, args.libro, args.reemplazar)
+        print(f"{args.libro}: {cambios['nuevas']} nuevas, {cambios['actualizadas']} "
+              f"actualizadas, {cambios['borradas']} borradas y {cambios['archivadas']} "
+              "archivadas en la base")
+    elif args.orden == "exportar":
+        n = exportar(con, args.miembro, args.libro, args.estatico)
+        print(f"{args.libro}: {n} series escritas en Registro")
+    elif args.orden == "sincronizar":
+        resultado = sincronizar(con, generar_lote.leer_roster(args.roster), args.estatico)
+        for miembro, (cambios, total) in resultado.items():
+            print(f"{miembro}: {cambios['nuevas']} nuevas, {cambios['actualizadas']} "
+                  f"actualizadas, {cambios['borradas']} borradas y "
+                  f"{cambios['archivadas']} archivadas; {total} en el libro")
+    elif args.orden == "series":
+        for fila in series_rango(con, args.miembro, args.desde, args.hasta):
+            print(f"{fila[0]:%d/%m/%Y}  " + "  ".join(str(v) for v in fila[1:]))
+    else:
+        fila = mejor_serie(con, args.miembro, args.ejercicio, args.desde, args.hasta)
+        print("Sin series" if fila is None else
+              f"{fila[0]:%d/%m/%Y}  {fila[2]}: {fila[5]} kg x {fila[4]} reps")
+    con.close()
@@ -0,0 +1,370 @@
+"""
+Lectura rápida del historial de Registro para analítica.
+
+Abre Entrenamiento_Casa.xlsx en modo read-only, recorre el historial fila a
+fila desde la fila 12 y lo carga en columnas compactas (array): fechas como
+ordinales, rutinas y ejercicios como ids enteros pequeños, y reps/peso como
+flotantes. Así se evita crear un objeto Cell por celda al leer cientos de
+libros.
+
+Sobre esas columnas, calcular_metricas obtiene con NumPy las mismas métricas
+del Dashboard y precalcular_dashboard las escribe como valores estáticos.
+"""
+
+from array import array
+import datetime
+import math
+import os
+
+import numpy as np
+import openpyxl
+from openpyxl.utils.datetime import from_excel
+
+import generar_excel
+from generar_excel import FILA_INICIO_HISTORIAL
+
+
+def _a_fecha(valor):
+    if isinstance(valor, datetime.datetime):
+        return valor.date()
+    if isinstance(valor, datetime.date):
+        return valor
+    if isinstance(valor, (int, float)):
+        return from_excel(valor).date()
+    return None
+
+
+def _a_float(valor):
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return float(valor)
+    try:
+        return float(str(valor).replace(",", "."))
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def iterar_registro(ruta, columnas=8):
+    """
+    Genera las filas del historial (A-H, o las primeras `columnas`) de un
+    libro, sin cargarlo entero.
+
+    El historial es contiguo: la lectura termina en la primera fila sin
+    fecha, así que las filas pre-formateadas vacías no se recorren.
+    """
+    wb = openpyxl.load_workbook(ruta, read_only=True, data_only=True,
+                                keep_links=False)
+    try:
+        ws = wb["Registro"]
+        for fila in ws.iter_rows(min_row=FILA_INICIO_HISTORIAL, max_col=columnas,
+                                 values_only=True):
+            if fila[0] in (None, ""):
+                return
+            yield fila
+    finally:
+        wb.close()
+
+
+class RegistroColumnar:
+    """
+    Historial en columnas: un array por campo y tablas de nombres internados.
+
+    fecha         array("i")  ordinal de la fecha (date.toordinal())
+    rutina        array("H")  id en `rutinas`
+    ejercicio     array("H")  id en `ejercicios`
+    serie, reps, peso, descanso
+                  array("d")  NaN cuando la celda está vacía
+    """
+
+    def __init__(self):
+        self.fecha = array("i")
+        self.rutina = array("H")
+        self.ejercicio = array("H")
+        self.serie = array("d")
+        self.reps = array("d")
+        self.peso = array("d")
+        self.descanso = array("d")
+        self.rutinas = []
+        self.ejercicios = []
+        self._id_rutina = {}
+        self._id_ejercicio = {}
+
+    def __len__(self):
+        return len(self.fecha)
+
+    @staticmethod
+    def _internar(nombre, ids, nombres):
+        nombre = "" if nombre is None else str(nombre)
+        idx = ids.get(nombre)
+        if idx is None:
+            idx = ids[nombre] = len(nombres)
+            nombres.append(nombre)
+        return idx
+
+    def agregar(self, fecha, rutina, ejercicio, serie, reps, peso, descanso=None):
+        """Agrega una serie; devuelve False si la fecha no es válida."""
+        fecha = _a_fecha(fecha)
+        if fecha is None:
+            return False
+        self.fecha.append(fecha.toordinal())
+        self.rutina.append(self._internar(rutina, self._id_rutina, self.rutinas))
+        self.ejercicio.append(
+            self._internar(ejercicio, self._id_ejercicio, self.ejercicios))
+        self.serie.append(_a_float(serie))
+        self.reps.append(_a_float(reps))
+        self.peso.append(_a_float(peso))
+        self.descanso.append(_a_float(descanso))
+        return True
+
+    def id_rutina(self, nombre):
+        return self._id_rutina.get(nombre)
+
+    def id_ejercicio(self, nombre):
+        return self._id_ejercicio.get(nombre)
+
+    def fila(self, i):
+        """Fila i reconstruida con nombres y fecha (útil para depurar)."""
+        return (datetime.date.fromordinal(self.fecha[i]),
+                self.rutinas[self.rutina[i]],
+                self.ejercicios[self.ejercicio[i]],
+                self.serie[i], self.reps[i], self.peso[i], self.descanso[i])
+
+
+def cargar_registro(ruta):
+    """Carga el historial de un libro en un RegistroColumnar."""
+    datos = RegistroColumnar()
+    for fecha, rutina, ejercicio, serie, reps, peso, descanso, _notas in iterar_registro(ruta):
+        datos.agregar(fecha, rutina, ejercicio, serie, reps, peso, descanso)
+    return datos
+
+
+# ── Métricas del Dashboard ────────────────────────────────────────
+def _columna(arr, dtype):
+    return np.frombuffer(arr, dtype=dtype) if len(arr) else np.empty(0, dtype)
+
+
+def _numero(x):
+    """float/int de Python para escribir en celdas (enteros sin decimales)."""
+    x = float(x)
+    return int(x) if x.is_integer() else x
+
+
+def lttb(x, y, puntos):
+    """
+    Índices de los `puntos` puntos de (x, y) que elige Largest-Triangle-
+    Three-Buckets.
+
+    Conserva el primero y el último; el resto de la serie se reparte en
+    puntos-2 tramos y de cada uno se queda el punto que forma el triángulo
+    de mayor área con el elegido en el tramo anterior y la media del
+    siguiente. Así se mantienen picos y caídas que un promedio borraría.
+    """
+    n = len(x)
+    if n <= puntos:
+        return np.arange(n)
+    if puntos < 3:
+        return np.array([0, n - 1][:puntos], dtype=np.int64)
+    limites = np.linspace(1, n - 1, puntos - 1).astype(np.int64)
+    elegidos = np.empty(puntos, dtype=np.int64)
+    elegidos[0], elegidos[-1] = 0, n - 1
+    a = 0
+    for i in range(puntos - 2):
+        ini, fin = limites[i], limites[i + 1]
+        sig_fin = limites[i + 2] if i + 2 < len(limites) else n
+        sig_ini = fin if i + 2 < len(limites) else n - 1
+        mx, my = x[sig_ini:sig_fin].mean(), y[sig_ini:sig_fin].mean()
+        areas = np.abs((x[a] - mx) * (y[ini:fin] - y[a])
+                       - (x[a] - x[ini:fin]) * (my - y[a]))
+        a = ini + int(areas.argmax())
+        elegidos[i + 1] = a
+    return elegidos
+
+
+def serie_peso(fecha, peso, puntos):
+    """
+    Serie del gráfico de peso: (fecha, peso máx., peso medio) por fecha.
+
+    Si hay más fechas que `puntos` se reduce con lttb() sobre el peso
+    máximo. Se completa con filas vacías hasta `puntos` filas.
+    """
+    filas = []
+    if len(fecha):
+        hay_peso = ~np.isnan(peso)
+        fechas, inversa = np.unique(fecha, return_inverse=True)
+        maximo = np.zeros(len(fechas))
+        np.maximum.at(maximo, inversa, np.where(hay_peso, peso, 0.0))
+        suma = np.bincount(inversa, weights=np.where(hay_peso, peso, 0.0))
+        cuenta = np.bincount(inversa, weights=hay_peso)
+        for j in lttb(fechas.astype(np.float64), maximo, puntos):
+            filas.append((
+                datetime.date.fromordinal(int(fechas[j])),
+                _numero(maximo[j]),
+                _numero(suma[j] / cuenta[j]) if cuenta[j] else None,
+            ))
+    filas += [(None, None, None)] * (puntos - len(filas))
+    return filas
+
+
+def calcular_metricas(datos, hoy=None, config=None):
+    """
+    Calcula en una pasada vectorizada las métricas del Dashboard.
+
+    Reproduce las fórmulas de crear_hoja_dashboard: KPIs, volumen por día de
+    la configuración, insights, alertas de rango y últimos 10 registros. La
+    serie del gráfico de peso tiene un punto por fecha reducido con LTTB en
+    lugar de los tramos de fechas de las fórmulas.
+    Devuelve el dict que acepta crear_hoja_dashboard(metricas=...).
+    """
+    hoy = hoy or datetime.date.today()
+    config = config or generar_excel.configuracion()
+    n = len(datos)
+    fecha = _columna(datos.fecha, np.int32)
+    rutina = _columna(datos.rutina, np.uint16)
+    ejercicio = _columna(datos.ejercicio, np.uint16)
+    reps = _columna(datos.reps, np.float64)
+    peso = _columna(datos.peso, np.float64)
+
+    hay_reps = ~np.isnan(reps)
+    hay_peso = ~np.isnan(peso)
+    reps0 = np.where(hay_reps, reps, 0.0)
+    peso0 = np.where(hay_peso, peso, 0.0)
+
+    # Sesiones: pares (fecha, rutina) distintos, como la hoja Sesiones
+    clave_sesion = fecha.astype(np.int64) * 65536 + rutina
+    sesiones = np.unique(clave_sesion)
+    fecha_sesion = sesiones // 65536
+    rutina_sesion = sesiones % 65536
+
+    # KPIs
+    peso_max = peso0.max() if n else 0.0
+    kpis = [
+        len(sesiones),
+        datetime.date.fromordinal(int(fecha.max())) if n else "-",
+        _numero(peso_max) if peso_max > 0 else "-",
+        round(float(reps[hay_reps].mean()), 1) if hay_reps.any() else "-",
+        n,
+    ]
+
+    # Volumen por día: group-by sobre los ids de rutina
+    k = len(datos.rutinas)
+    n_sesiones = np.bincount(rutina_sesion, minlength=k)
+    sets = np.bincount(rutina, minlength=k)
+    suma_reps = np.bincount(rutina, weights=reps0, minlength=k)
+    volumen = np.bincount(rutina, weights=reps0 * peso0, minlength=k)
+    por_dia = {}
+    for dia in config["dias"]:
+        i = datos.id_rutina(dia)
+        if i is None:
+            por_dia[dia] = (0, 0, 0, 0)
+            continue
+        por_dia[dia] = (
+            int(n_sesiones[i]),
+            int(sets[i]),
+            _numero(suma_reps[i]),
+            _numero(volumen[i]),
+        )
+
+    # Insights
+    o_hoy = hoy.toordinal()
+    lunes = o_hoy - hoy.weekday()
+    inicio_mes = hoy.replace(day=1).toordinal()
+    # Mismo orden que Ej_Nombres: a igual frecuencia gana el primero de la tabla
+    catalogo = config["catalogo"]
+    frecuencia = np.bincount(ejercicio, minlength=len(datos.ejercicios))
+    frec_catalogo = np.array(
+        [frecuencia[datos.id_ejercicio(ej)] if datos.id_ejercicio(ej) is not None else 0
+         for ej in catalogo], dtype=np.int64)
+    insights = [
+        o_hoy - int(fecha.max()) if n else "-",
+        int(((fecha_sesion >= lunes) & (fecha_sesion <= o_hoy)).sum()),
+        int(((fecha_sesion >= inicio_mes) & (fecha_sesion <= o_hoy)).sum()),
+        catalogo[int(frec_catalogo.argmax())]
+        if len(catalogo) and frec_catalogo.max() > 0 else "-",
+        _numero(reps0.sum()),
+        _numero(reps[hay_reps].max()) if hay_reps.any() else 0,
+    ]
+    if config["no_volatil"]:
+        insights.append(hoy)
+
+    # Alertas: rango de cada ejercicio por id (NaN si no está en el catálogo)
+    r_min = np.full(len(datos.ejercicios), np.nan)
+    r_max = np.full(len(datos.ejercicios), np.nan)
+    for ej in catalogo:
+        i = datos.id_ejercicio(ej)
+        if i is not None:
+            r_min[i], r_max[i] = config["reps_ranges"].get(ej, (8, 15))
+    with np.errstate(invalid="ignore"):
+        sobre = int((hay_reps & (reps > r_max[ejercicio])).sum())
+        bajo = int((hay_reps & (reps < r_min[ejercicio])).sum())
+    en_rango = 1 - (sobre + bajo) / max(n, 1)
+    alertas = [sobre, bajo, f"{en_rango:.0%}"]
+
+    # Últimos 10 registros (del más reciente al más antiguo)
+    def _valor(x):
+        return "" if math.isnan(x) else _numero(x)
+
+    ultimos = []
+    for i in range(10):
+        j = n - 1 - i
+        if j < 0:
+            ultimos.append(("", "", "", "", ""))
+            continue
+        ultimos.append((
+            datetime.date.fromordinal(int(fecha[j])),
+            datos.rutinas[rutina[j]],
+            datos.ejercicios[ejercicio[j]],
+            _valor(reps[j]),
+            _valor(peso[j]),
+        ))
+
+    return {
+        "calculado": datetime.datetime.now(),
+        "kpis": kpis,
+        "por_dia": por_dia,
+        "insights": insights,
+        "alertas": alertas,
+        "ultimos": ultimos,
+        "serie_peso": serie_peso(fecha, peso, config["puntos_grafico"]),
+    }
+
+
+def precalcular_dashboard(ruta, hoy=None):
+    """
+    Reemplaza el Dashboard de un libro por su versión precalculada.
+
+    Lee Registro en modo read-only, calcula las métricas y vuelve a crear
+    solo la hoja Dashboard con valores estáticos y la fecha de cálculo. Días
+    y rangos de reps salen de la hoja Datos del propio libro.
+    """
+    datos = cargar_registro(ruta)
+
+    wb = generar_excel.cargar_libro(ruta)
+    config = generar_excel.configuracion_libro(wb)
+    metricas = calcular_metricas(datos, hoy, config)
+    posicion = wb.sheetnames.index("Dashboard")
+    del wb["Dashboard"]
+    generar_excel.crear_hoja_dashboard(
+        wb, generar_excel.capacidad_libro(wb), metricas, config)
+    wb.move_sheet("Dashboard", offset=posicion - wb.sheetnames.index("Dashboard"))
+    # Temporal y reemplazo: un corte a mitad de camino no daña el libro
+    temporal = f"{ruta}.tmp"
+    try:
+        wb.save(temporal)
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return metricas
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Precalcula el Dashboard de uno o más libros.")
+    parser.add_argument("libros", nargs="+", help="rutas a Entrenamiento_Casa.xlsx")
+    args = parser.parse_args()
+    for ruta in args.libros:
+        metricas = precalcular_dashboard(ruta)
+        print(f"{ruta}: {metricas['kpis'][4]} registros en "
+              f"{metricas['kpis'][0]} sesiones, "
+              f"calculado {metricas['calculado']:%d/%m/%Y %H:%M}")
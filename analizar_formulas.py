@@ -0,0 +1,317 @@
+"""
+Análisis estático del costo de las fórmulas de un libro de entrenamiento.
+
+Recorre las fórmulas de todas las hojas, las reglas de formato condicional
+y las validaciones de datos, y estima para cada una cuántas celdas recorre
+al recalcularse. Marca las funciones volátiles (se recalculan en cada
+edición) y los patrones cuadráticos como COUNTIF(rango, rango). Las fórmulas
+copiadas a lo largo de una columna se agrupan en una sola entrada.
+
+El modelo de costo es aproximado:
+  - una referencia recorre todas sus celdas, salvo los argumentos de
+    INDEX/OFFSET/ROWS/COLUMNS/ROW/COLUMN que solo usan la referencia;
+  - MATCH/VLOOKUP/HLOOKUP con coincidencia aproximada y LOOKUP hacen una
+    búsqueda binaria: log2 de las celdas del rango buscado;
+  - un nombre definido cuesta lo que cuesta evaluar su fórmula cada vez que
+    se usa, más sus celdas si se recorre;
+  - los rangos dinámicos X:INDEX(...) miden `filas` filas (por defecto, la
+    capacidad del historial: el peor caso con el historial lleno);
+  - una regla de formato condicional se evalúa una vez por celda de su rango.
+
+    python analizar_formulas.py Entrenamiento_Casa.xlsx --top 15
+"""
+
+import json
+import math
+import re
+
+import openpyxl
+from openpyxl.formula.tokenizer import Token, Tokenizer
+from openpyxl.utils.cell import range_boundaries
+from openpyxl.worksheet.formula import ArrayFormula
+
+import generar_excel
+
+VOLATILES = {"TODAY", "NOW", "RAND", "RANDBETWEEN", "RANDARRAY", "INDIRECT",
+             "OFFSET", "CELL", "INFO"}
+
+# Argumentos (por posición) que se usan como referencia sin recorrerla;
+# None = todos los argumentos
+SIN_RECORRIDO = {"INDEX": {0}, "OFFSET": {0}, "ROWS": None, "COLUMNS": None,
+                 "ROW": None, "COLUMN": None, "ISREF": None}
+
+# Funciones *IF(S): posiciones de los argumentos de criterio; el rango que
+# filtra cada criterio es el argumento anterior. Un criterio que es un rango
+# multiplica el recorrido (patrón cuadrático).
+CRITERIOS = {
+    "COUNTIF": (1,), "SUMIF": (1,), "AVERAGEIF": (1,),
+    "COUNTIFS": (1, 3, 5, 7), "SUMIFS": (2, 4, 6, 8), "AVERAGEIFS": (2, 4, 6, 8),
+    "MAXIFS": (2, 4, 6, 8), "MINIFS": (2, 4, 6, 8),
+}
+
+# Búsquedas binarias: función → (argumento del rango buscado, argumento del
+# tipo de coincidencia o None si siempre es aproximada). El tipo por defecto
+# es aproximado; 0/FALSE es exacto (recorrido lineal).
+BUSQUEDA_BINARIA = {"MATCH": (1, 2), "VLOOKUP": (1, 3), "HLOOKUP": (1, 3),
+                    "LOOKUP": (1, None)}
+EXACTA = {"0", "FALSE"}
+
+MAX_FILAS, MAX_COLUMNAS = 1048576, 16384
+
+_RE_REF_RELATIVA = re.compile(r"(\$?[A-Z]{1,3})(\$?)(\d+)")
+
+
+def _forma(formula):
+    """Fórmula con las filas relativas reemplazadas por # (para agrupar)."""
+    return _RE_REF_RELATIVA.sub(
+        lambda m: m.group(0) if m.group(2) else m.group(1) + "#", formula)
+
+
+class Analizador:
+    """Estimador de costo con los nombres definidos de un libro."""
+
+    def __init__(self, wb, filas=None):
+        self.nombres = {n: d.attr_text for n, d in wb.defined_names.items()}
+        self.filas = filas or generar_excel.capacidad_libro(wb)
+        self._cache_nombres = {}
+
+    # ── Referencias y nombres ─────────────────────────────────────
+    def tamano_ref(self, ref):
+        """Celdas de una referencia A1 (con o sin hoja); None si no es una."""
+        if "!" in ref:
+            ref = ref.rsplit("!", 1)[1]
+        ref = ref.replace("$", "")
+        if ref.isdigit():
+            return None  # constante ("189"), no la fila entera 189:189
+        try:
+            min_col, min_row, max_col, max_row = range_boundaries(ref)
+        except (ValueError, TypeError):
+            return None
+        min_col, max_col = min_col or 1, max_col or MAX_COLUMNAS
+        min_row, max_row = min_row or 1, max_row or MAX_FILAS
+        return (max_col - min_col + 1) * (max_row - min_row + 1)
+
+    def info_nombre(self, nombre):
+        """(celdas que representa, costo de evaluarlo) de un nombre definido."""
+        if nombre in self._cache_nombres:
+            return self._cache_nombres[nombre]
+        self._cache_nombres[nombre] = (1, 0)  # corta ciclos
+        texto = self.nombres[nombre]
+        tamano = self.tamano_ref(texto)
+        if tamano is not None:
+            info = (tamano, 0)
+        else:
+            resultado = self.analizar("=" + texto)
+            info = (resultado["tamano"], resultado["costo"])
+        self._cache_nombres[nombre] = info
+        return info
+
+    def columnas_ref(self, ref):
+        """Columnas de una referencia A1; 1 si no se puede determinar."""
+        if "!" in ref:
+            ref = ref.rsplit("!", 1)[1]
+        try:
+            min_col, _, max_col, _ = range_boundaries(ref.replace("$", ""))
+        except (ValueError, TypeError):
+            return 1
+        return (max_col or MAX_COLUMNAS) - (min_col or 1) + 1
+
+    # ── Fórmulas ──────────────────────────────────────────────────
+    def analizar(self, formula):
+        """
+        Costo estimado de evaluar una fórmula una vez.
+
+        Devuelve dict con costo (celdas recorridas), tamano (celdas del
+        resultado si es una referencia), volatiles y cuadraticos.
+        """
+        try:
+            tokens = Tokenizer(formula).items
+        except Exception:
+            return {"costo": 0, "tamano": 1, "volatiles": set(),
+                    "cuadraticos": [], "error": True}
+
+        costo = 0
+        tamano = 1
+        volatiles = set()
+        cuadraticos = []
+        # Pila de funciones abiertas: [nombre, argumento actual, {arg: celdas},
+        # {arg: celdas recorridas}, {arg: literal}]
+        pila = []
+        dinamico = False  # la fórmula es un rango X:INDEX(ref, ...)
+        ancho = 1         # columnas de `ref` en ese caso
+
+        for tok in tokens:
+            if tok.type == Token.FUNC and tok.subtype == Token.OPEN:
+                nombre = tok.value[:-1].upper()
+                if ":" in nombre:
+                    # El tokenizador junta "X:INDEX(" en un solo token
+                    nombre = nombre.rsplit(":", 1)[1]
+                    dinamico = True
+                if nombre in VOLATILES:
+                    volatiles.add(nombre)
+                pila.append([nombre, 0, {}, {}, {}])
+            elif tok.type == Token.SEP and tok.subtype == Token.ARG and pila:
+                pila[-1][1] += 1
+            elif tok.type == Token.FUNC and tok.subtype == Token.CLOSE and pila:
+                nombre, _, args, recorridos, literales = pila.pop()
+                if nombre in BUSQUEDA_BINARIA:
+                    pos, tipo = BUSQUEDA_BINARIA[nombre]
+                    if tipo is None or literales.get(tipo, "1") not in EXACTA:
+                        lineal = recorridos.get(pos, 0)
+                        costo -= lineal - math.ceil(math.log2(lineal + 1))
+                for pos in CRITERIOS.get(nombre, ()):
+                    if args.get(pos, 1) > 1:
+                        costo += args.get(pos - 1, 1) * args[pos]
+                        cuadraticos.append(
+                            f"{nombre} con criterio de {args[pos]} celdas")
+            elif (tok.type == Token.OPERAND and tok.subtype != Token.RANGE
+                  and pila):
+                pila[-1][4][pila[-1][1]] = tok.value.upper()
+            elif tok.type == Token.OPERAND and tok.subtype == Token.RANGE:
+                valor = tok.value
+                if valor in self.nombres:
+                    celdas, evaluar = self.info_nombre(valor)
+                    costo += evaluar
+                else:
+                    celdas = self.tamano_ref(valor) or 1
+                if pila:
+                    nombre, arg, args, recorridos, _ = pila[-1]
+                    # Tamaño del mayor operando: dos escalares no son un rango
+                    args[arg] = max(args.get(arg, 0), celdas)
+                    sin = SIN_RECORRIDO.get(nombre, set())
+                    if sin is not None and arg not in sin:
+                        costo += celdas
+                        recorridos[arg] = recorridos.get(arg, 0) + celdas
+                    if dinamico and len(pila) == 1 and arg == 0:
+                        ancho = self.columnas_ref(valor)
+                else:
+                    costo += celdas
+                    tamano = celdas
+
+        if dinamico:
+            tamano = ancho * self.filas
+        return {"costo": costo, "tamano": tamano, "volatiles": volatiles,
+                "cuadraticos": cuadraticos}
+
+
+# ── Recorrido del libro ───────────────────────────────────────────
+def _entrada(grupos, clave, origen, celda, formula, resultado, veces=1):
+    g = grupos.get(clave)
+    if g is None:
+        g = grupos[clave] = {
+            "origen": origen, "celdas": [], "formula": formula, "costo": 0,
+            "volatiles": set(), "cuadraticos": set(),
+        }
+    g["celdas"].append(celda)
+    g["costo"] += resultado["costo"] * veces
+    g["volatiles"] |= resultado["volatiles"]
+    g["cuadraticos"].update(resultado["cuadraticos"])
+
+
+def analizar_libro(ruta, filas=None):
+    """
+    Analiza todas las fórmulas de un libro y devuelve el informe.
+
+    El informe trae `grupos` (ordenados de mayor a menor costo), el costo
+    total de un recálculo completo y el de las fórmulas volátiles, que se
+    recalculan en cada edición.
+    """
+    wb = openpyxl.load_workbook(ruta)
+    analizador = Analizador(wb, filas)
+    grupos = {}
+
+    for ws in wb.worksheets:
+        for fila in ws.iter_rows():
+            for cell in fila:
+                formula = cell.value
+                if isinstance(formula, ArrayFormula):
+                    # Fórmula matricial: se evalúa una vez para todo su rango
+                    formula = formula.text
+                if cell.data_type != "f" or not isinstance(formula, str):
+                    continue
+                clave = (ws.title, cell.column_letter, _forma(formula))
+                _entrada(grupos, clave, "celda", f"{ws.title}!{cell.coordinate}",
+                         formula, analizador.analizar(formula))
+
+        for rango, reglas in ws.conditional_formatting._cf_rules.items():
+            celdas = sum(analizador.tamano_ref(r.coord) or 1 for r in rango.sqref.ranges)
+            for regla in reglas:
+                for formula in regla.formula or ():
+                    clave = (ws.title, str(rango.sqref), "CF " + formula)
+                    _entrada(grupos, clave, "formato condicional",
+                             f"{ws.title}!{rango.sqref}", "=" + formula,
+                             analizador.analizar("=" + formula), veces=celdas)
+
+        for dv in ws.data_validations.dataValidation:
+            formula = dv.formula1 or ""
+            if formula.startswith('"') or not formula:
+                continue
+            formula = formula if formula.startswith("=") else "=" + formula
+            clave = (ws.title, str(dv.sqref), "DV " + formula)
+            _entrada(grupos, clave, "validación", f"{ws.title}!{dv.sqref}",
+                     formula, analizador.analizar(formula))
+
+    ordenados = sorted(grupos.values(), key=lambda g: g["costo"], reverse=True)
+    for g in ordenados:
+        g["volatiles"] = sorted(g["volatiles"])
+        g["cuadraticos"] = sorted(g["cuadraticos"])
+    return {
+        "libro": ruta,
+        "filas_supuestas": analizador.filas,
+        "formulas": sum(len(g["celdas"]) for g in ordenados),
+        "costo_total": sum(g["costo"] for g in ordenados),
+        "costo_volatil": sum(g["costo"] for g in ordenados if g["volatiles"]),
+        "grupos": ordenados,
+    }
+
+
+def imprimir_informe(informe, top=20):
+    """Reporte legible: ranking de grupos por costo y totales."""
+    print(f"Libro: {informe['libro']}")
+    print(f"Filas supuestas en el historial: {informe['filas_supuestas']:,}")
+    print()
+    print(f"{'#':>3} {'Costo':>12} {'Celdas':>6}  Origen / fórmula")
+    print("-" * 78)
+    for i, g in enumerate(informe["grupos"][:top], start=1):
+        celdas = g["celdas"]
+        donde = celdas[0] if len(celdas) == 1 else f"{celdas[0]} … ({len(celdas)})"
+        marcas = []
+        if g["volatiles"]:
+            marcas.append("VOLÁTIL " + ",".join(g["volatiles"]))
+        if g["cuadraticos"]:
+            marcas.append("CUADRÁTICO")
+        print(f"{i:>3} {g['costo']:>12,} {len(celdas):>6}  {donde} [{g['origen']}]"
+              + (f"  ⚠ {'; '.join(marcas)}" if marcas else ""))
+        formula = g["formula"]
+        print(f"{'':>24}{formula[:70] + ('…' if len(formula) > 70 else '')}")
+    print("-" * 78)
+    total = informe["costo_total"]
+    print(f"Fórmulas y reglas analizadas: {informe['formulas']:,}")
+    print(f"Costo estimado de un recálculo completo: {total:,} celdas recorridas")
+    print(f"Costo volátil (se recalcula en cada edición): "
+          f"{informe['costo_volatil']:,} celdas"
+          + (f" ({informe['costo_volatil'] / total:.0%})" if total else ""))
+    cuadraticos = [g for g in informe["grupos"] if g["cuadraticos"]]
+    if cuadraticos:
+        print(f"Patrones cuadráticos: {len(cuadraticos)} grupos")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("libro", nargs="?", default=generar_excel.SALIDA_XLSX)
+    parser.add_argument("--filas", type=int, default=None,
+                        help="filas del historial a suponer (por defecto, la capacidad)")
+    parser.add_argument("--top", type=int, default=20,
+                        help="grupos a mostrar en el ranking")
+    parser.add_argument("--json", action="store_true",
+                        help="imprimir el informe completo como JSON")
+    args = parser.parse_args()
+
+    informe = analizar_libro(args.libro, args.filas)
+    if args.json:
+        print(json.dumps(informe, ensure_ascii=False, indent=2))
+    else:
+        imprimir_informe(informe, args.top)
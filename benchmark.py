@@ -0,0 +1,242 @@
+"""
+Benchmark de generación: tiempo, memoria pico y tamaño según la capacidad.
+
+Recorre una matriz de capacidades del historial, tamaños de catálogo de
+rutinas y modos de generación (normal, streaming, directo). Para cada
+combinación registra el tiempo total, el tiempo de cada crear_hoja_*, la
+memoria pico (tracemalloc, en una segunda pasada para no inflar el tiempo),
+el tamaño del .xlsx y las celdas con fórmula y con estilo.
+
+    python benchmark.py --salida bench.json
+    python benchmark.py --salida nuevo.json --comparar bench.json
+"""
+
+from contextlib import contextmanager
+import datetime
+import functools
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+import openpyxl
+
+import generar_excel
+import xlsx_directo
+
+CAPACIDADES = (200, 2000, 20000, 200000)
+
+# Catálogos: None = RUTINAS del módulo; (días, ejercicios por día) = sintético
+CATALOGOS = {
+    "base": None,
+    "7x12": (7, 12),
+    "7x40": (7, 40),
+    "7x430": (7, 430),      # biblioteca de ~3.000 ejercicios
+}
+
+MODOS = ("normal", "streaming", "directo")
+
+# El modo normal guarda todo el libro en memoria; por encima de esto se omite
+MAX_CAPACIDAD_NORMAL = 20000
+
+# Tolerancias de --comparar: relativa y mínimo absoluto para no marcar ruido
+TOLERANCIA = 0.15
+MIN_SEGUNDOS = 0.05
+
+BUILDERS = ("crear_hoja_datos", "crear_hoja_registro", "crear_hoja_rutinas",
+            "crear_hoja_dashboard", "crear_hoja_instrucciones",
+            "crear_hoja_sesiones")
+
+
+def catalogo_sintetico(dias, por_dia):
+    """Configuración con `dias` días y `por_dia` ejercicios distintos cada uno."""
+    nombres = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado",
+               "Domingo"]
+    rutinas = {}
+    for d in range(dias):
+        dia = nombres[d] if d < len(nombres) else f"Día {d + 1}"
+        rutinas[f"{dia} - Rutina {d + 1}"] = [
+            f"Ejercicio {d + 1}.{e + 1}" for e in range(por_dia)]
+    return generar_excel.configuracion(rutinas, {})
+
+
+@contextmanager
+def cronometrar_builders(tiempos):
+    """Acumula en `tiempos` los segundos de cada crear_hoja_* mientras dure."""
+    originales = {nombre: getattr(generar_excel, nombre) for nombre in BUILDERS}
+
+    def envolver(nombre, funcion):
+        @functools.wraps(funcion)
+        def medida(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                tiempos[nombre] = tiempos.get(nombre, 0.0) + time.perf_counter() - inicio
+        return medida
+
+    for nombre, funcion in originales.items():
+        setattr(generar_excel, nombre, envolver(nombre, funcion))
+    try:
+        yield tiempos
+    finally:
+        for nombre, funcion in originales.items():
+            setattr(generar_excel, nombre, funcion)
+
+
+def generar(modo, ruta, capacidad, config):
+    """Genera un libro en `ruta` con el modo indicado."""
+    if modo == "directo":
+        xlsx_directo.construir_directo(ruta, capacidad, config=config, procesos=1)
+    else:
+        generar_excel.construir_libro(
+            streaming=(modo == "streaming"), capacidad=capacidad,
+            config=config).save(ruta)
+
+
+def contar_celdas(ruta):
+    """(celdas con fórmula, celdas con estilo) de todas las hojas del .xlsx."""
+    formulas = estilos = 0
+    with zipfile.ZipFile(ruta) as z:
+        for nombre in z.namelist():
+            if nombre.startswith("xl/worksheets/") and nombre.endswith(".xml"):
+                xml = z.read(nombre)
+                formulas += xml.count(b"<f>") + xml.count(b"<f ")
+                estilos += len(re.findall(rb'<c [^>]*\bs="[1-9]', xml))
+    return formulas, estilos
+
+
+def medir(modo, capacidad, catalogo, memoria=True):
+    """Un punto de la matriz: dict con tiempos, memoria, tamaño y conteos."""
+    config = (generar_excel.configuracion() if CATALOGOS[catalogo] is None
+              else catalogo_sintetico(*CATALOGOS[catalogo]))
+    fd, ruta = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        builders = {}
+        with cronometrar_builders(builders):
+            inicio = time.perf_counter()
+            generar(modo, ruta, capacidad, config)
+            segundos = time.perf_counter() - inicio
+
+        pico = None
+        if memoria:
+            tracemalloc.start()
+            try:
+                generar(modo, ruta, capacidad, config)
+                pico = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        formulas, estilos = contar_celdas(ruta)
+        return {
+            "modo": modo,
+            "capacidad": capacidad,
+            "catalogo": catalogo,
+            "segundos": round(segundos, 4),
+            # En streaming/directo las filas se escriben al guardar, fuera de
+            # los builders: la diferencia con el total es volcado + guardado
+            "builders": {nombre: round(t, 4) for nombre, t in builders.items()},
+            "pico_bytes": pico,
+            "bytes": os.path.getsize(ruta),
+            "celdas_formula": formulas,
+            "celdas_estilo": estilos,
+        }
+    finally:
+        os.remove(ruta)
+
+
+def ejecutar(capacidades=CAPACIDADES, catalogos=tuple(CATALOGOS), modos=MODOS,
+             memoria=True, progreso=print):
+    """Recorre la matriz y devuelve el informe completo (serializable a JSON)."""
+    resultados = []
+    for catalogo in catalogos:
+        for capacidad in capacidades:
+            for modo in modos:
+                if modo == "normal" and capacidad > MAX_CAPACIDAD_NORMAL:
+                    continue
+                r = medir(modo, capacidad, catalogo, memoria)
+                resultados.append(r)
+                pico = ("-" if r["pico_bytes"] is None
+                        else f"{r['pico_bytes'] / 2**20:.1f} MiB")
+                progreso(f"{catalogo:>6} {capacidad:>7} {modo:<9} "
+                         f"{r['segundos']:8.2f} s  {pico:>10}  "
+                         f"{r['bytes'] / 2**10:9.0f} KiB")
+    return {
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "openpyxl": openpyxl.__version__,
+        "plataforma": platform.platform(),
+        "resultados": resultados,
+    }
+
+
+def _clave(r):
+    return r["catalogo"], r["capacidad"], r["modo"]
+
+
+def comparar(actual, base, tolerancia=TOLERANCIA):
+    """
+    Regresiones de `actual` frente a `base` (informes de ejecutar()).
+
+    Se marca un punto si el tiempo, la memoria pico o el tamaño crecen más
+    de `tolerancia`, o si cambia el número de celdas con fórmula o estilo
+    (eso es un cambio de salida, no de rendimiento, pero conviene verlo).
+    """
+    previos = {_clave(r): r for r in base["resultados"]}
+    regresiones = []
+    for r in actual["resultados"]:
+        p = previos.get(_clave(r))
+        if p is None:
+            continue
+        nombre = "/".join(str(x) for x in _clave(r))
+        if (r["segundos"] - p["segundos"] > MIN_SEGUNDOS
+                and r["segundos"] > p["segundos"] * (1 + tolerancia)):
+            regresiones.append(
+                f"{nombre}: tiempo {p['segundos']:.2f} s → {r['segundos']:.2f} s")
+        for campo in ("pico_bytes", "bytes"):
+            if r[campo] and p[campo] and r[campo] > p[campo] * (1 + tolerancia):
+                regresiones.append(f"{nombre}: {campo} {p[campo]} → {r[campo]}")
+        for campo in ("celdas_formula", "celdas_estilo"):
+            if r[campo] != p[campo]:
+                regresiones.append(f"{nombre}: {campo} {p[campo]} → {r[campo]}")
+    return regresiones
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--capacidades", type=int, nargs="+", default=CAPACIDADES)
+    parser.add_argument("--catalogos", nargs="+", choices=list(CATALOGOS),
+                        default=list(CATALOGOS))
+    parser.add_argument("--modos", nargs="+", choices=MODOS, default=list(MODOS))
+    parser.add_argument("--sin-memoria", action="store_true",
+                        help="omitir la pasada con tracemalloc")
+    parser.add_argument("--salida", default="benchmark.json",
+                        help="archivo JSON de resultados")
+    parser.add_argument("--comparar", metavar="BASE",
+                        help="JSON de una ejecución anterior contra el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA)
+    args = parser.parse_args()
+
+    informe = ejecutar(args.capacidades, args.catalogos, args.modos,
+                       memoria=not args.sin_memoria)
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, ensure_ascii=False, indent=2)
+    print(f"Resultados: {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        regresiones = comparar(informe, base, args.tolerancia)
+        for regresion in regresiones:
+            print(f"  REGRESIÓN {regresion}")
+        print(f"{len(regresiones)} regresiones frente a {args.comparar}")
+        sys.exit(1 if regresiones else 0)
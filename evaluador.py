@@ -0,0 +1,1068 @@
+"""
+Evaluador de fórmulas: guarda en el .xlsx el resultado de cada fórmula.
+
+openpyxl guarda las fórmulas sin resultado: los visores que no recalculan
+(vistas previas, apps móviles, miniaturas) muestran celdas vacías y Excel
+tiene que recalcular el libro entero al abrirlo. Este módulo evalúa en
+Python las fórmulas del libro contra los datos de Registro y escribe cada
+resultado como valor en caché (<v>) de su celda; si calculó todas, quita
+fullCalcOnLoad para que el libro se abra con los números ya puestos.
+
+Cubre el subconjunto que emite generar_excel: operadores (+ - * / ^ & y
+comparaciones), IF, IFERROR, AND, OR, NA, SUM, AVERAGE, MAX, MIN, COUNTA,
+COUNTIF(S), SUMIF(S), AVERAGEIF(S), SUMPRODUCT, AGGREGATE, FREQUENCY,
+INDEX, MATCH, VLOOKUP, ROW, INDIRECT, TODAY, DATE, YEAR, MONTH, DAY,
+WEEKDAY, ROUND, ROUNDUP, TEXT y los nombres definidos (también los rangos
+dinámicos X:INDEX(...)). Una celda con algo fuera del subconjunto se deja
+sin valor en caché y el libro conserva fullCalcOnLoad: Excel la calcula
+al abrir.
+
+generar_excel.py, generar_lote.py y plantillas.py lo aplican a los libros
+que generan con --valores.
+
+    python evaluador.py Entrenamiento_Casa.xlsx
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+import datetime
+from decimal import Decimal, ROUND_HALF_UP, ROUND_UP
+import functools
+import io
+import operator
+import os
+import re
+import zipfile
+from xml.sax.saxutils import escape, unescape
+
+import openpyxl
+from openpyxl.formula.tokenizer import Token, Tokenizer
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.cell import range_boundaries
+from openpyxl.utils.datetime import from_excel, to_excel
+from openpyxl.worksheet.formula import ArrayFormula
+
+from generar_excel import clave_orden
+
+
+# ── Valores ───────────────────────────────────────────────────────
+class ErrorExcel:
+    """Error de Excel (#N/A, #DIV/0!...): se propaga como un valor más."""
+
+    def __init__(self, codigo):
+        self.codigo = codigo
+
+    def __repr__(self):
+        return self.codigo
+
+
+ERRORES = {codigo: ErrorExcel(codigo) for codigo in
+           ("#N/A", "#DIV/0!", "#VALUE!", "#REF!", "#NUM!", "#NAME?", "#NULL!")}
+NA, DIV0, VALOR, REF, NUM = (ERRORES[c] for c in
+                             ("#N/A", "#DIV/0!", "#VALUE!", "#REF!", "#NUM!"))
+
+
+class NoSoportada(Exception):
+    """La fórmula usa algo fuera del subconjunto: su celda queda sin caché."""
+
+
+# Referencia a un rango de celdas (filas y columnas desde 1, inclusivas)
+Ref = namedtuple("Ref", "hoja fila1 col1 fila2 col2")
+
+# Precedencia de los operadores binarios (mayor = se aplica antes)
+PRECEDENCIA = {"=": 1, "<>": 1, "<": 1, ">": 1, "<=": 1, ">=": 1,
+               "&": 2, "+": 3, "-": 3, "*": 4, "/": 4, "^": 5}
+PRECEDENCIA_NEGACION = 6
+
+# Operadores que entre dos números son los de Python (sin errores posibles)
+_DIRECTOS = {"=": operator.eq, "<>": operator.ne, "<": operator.lt,
+             ">": operator.gt, "<=": operator.le, ">=": operator.ge}
+# En la aritmética los lógicos cuentan como 0/1, igual que en Python
+_ARITMETICOS = (int, float, bool)
+_DIRECTOS_ARITMETICOS = {"+": operator.add, "-": operator.sub, "*": operator.mul}
+
+_RE_NUMERO = re.compile(r"\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$")
+_RE_CRITERIO = re.compile(r"(<=|>=|<>|<|>|=)?(.*)$", re.S)
+
+
+# Las fórmulas por fila (J-M de Registro...) solo cambian en su propia fila:
+# se analizan una vez con la fila sustituida por esta marca
+_FILA_PROPIA = "@"
+_RE_REFERENCIA = re.compile(
+    r'("(?:[^"]|"")*")|(?<![\w.])(\$?[A-Z]{1,3}\$?)(\d+)(?![\w(.!])')
+
+
+def _plantilla(formula, fila):
+    """`formula` con las referencias a su propia fila cambiadas por la marca."""
+    propia = str(fila)
+
+    def cambiar(m):
+        if m.group(1) or m.group(3) != propia:
+            return m.group(0)
+        return m.group(2) + _FILA_PROPIA
+    return _RE_REFERENCIA.sub(cambiar, formula)
+
+
+_NUMERICOS = (int, float)
+
+
+def _es_numero(v):
+    return type(v) in _NUMERICOS
+
+
+def _a_numero(v):
+    """Número de un valor escalar como lo convierte la aritmética de Excel."""
+    if isinstance(v, ErrorExcel) or _es_numero(v):
+        return v
+    if v is None:
+        return 0
+    if isinstance(v, bool):
+        return int(v)
+    if isinstance(v, str) and _RE_NUMERO.match(v):
+        return float(v)
+    return VALOR
+
+
+def _a_texto(v):
+    """Texto de un valor escalar para & (formato General de Excel)."""
+    if v is None:
+        return ""
+    if isinstance(v, bool):
+        return "TRUE" if v else "FALSE"
+    if _es_numero(v):
+        if float(v).is_integer() and abs(v) < 1e15:
+            return str(int(v))
+        return format(v, ".15g")
+    return str(v)
+
+
+def _tipo(v):
+    """Rango del tipo en las comparaciones de Excel: números < texto < lógicos."""
+    tipo = type(v)
+    if tipo is bool:
+        return 2
+    return 0 if tipo in _NUMERICOS else 1
+
+
+def _orden(v):
+    """Clave de comparación de Excel: números < texto < lógicos."""
+    tipo = _tipo(v)
+    return (tipo, clave_orden(v) if tipo == 1 else v)
+
+
+def _comparar(op, a, b):
+    if a is None:
+        a = "" if isinstance(b, str) else 0
+    if b is None:
+        b = "" if isinstance(a, str) else 0
+    ta, tb = _tipo(a), _tipo(b)
+    if op in ("=", "<>"):
+        igual = ta == tb and (a.casefold() == b.casefold() if ta == 1 else a == b)
+        return igual if op == "=" else not igual
+    ka, kb = (ta, a), (tb, b)
+    if ta == tb == 1:
+        ka, kb = _orden(a), _orden(b)
+    return {"<": ka < kb, ">": ka > kb, "<=": ka <= kb, ">=": ka >= kb}[op]
+
+
+def _operar(op, a, b):
+    """Operador binario sobre dos escalares."""
+    if op in _DIRECTOS:
+        if type(a) in _NUMERICOS and type(b) in _NUMERICOS:
+            return _DIRECTOS[op](a, b)
+    elif type(a) in _ARITMETICOS and type(b) in _ARITMETICOS and op != "^":
+        if op == "/":
+            return DIV0 if b == 0 else a / b
+        return _DIRECTOS_ARITMETICOS[op](a, b)
+    for v in (a, b):
+        if isinstance(v, ErrorExcel):
+            return v
+    if op == "&":
+        return _a_texto(a) + _a_texto(b)
+    if op in ("=", "<>", "<", ">", "<=", ">="):
+        return _comparar(op, a, b)
+    x, y = _a_numero(a), _a_numero(b)
+    for v in (x, y):
+        if isinstance(v, ErrorExcel):
+            return v
+    if op == "+":
+        return x + y
+    if op == "-":
+        return x - y
+    if op == "*":
+        return x * y
+    if op == "/":
+        return DIV0 if y == 0 else x / y
+    try:
+        return float(x) ** y
+    except (OverflowError, ZeroDivisionError, ValueError):
+        return NUM
+
+
+def _difundir(funcion, a, b):
+    """Aplica `funcion` elemento a elemento con la expansión de Excel."""
+    if not isinstance(a, list) and not isinstance(b, list):
+        return funcion(a, b)
+    if not isinstance(b, list):
+        return [[funcion(x, b) for x in fila] for fila in a]
+    if not isinstance(a, list):
+        return [[funcion(a, y) for y in fila] for fila in b]
+    filas = max(len(a), len(b))
+    cols = max(len(a[0]), len(b[0]))
+
+    def columnas(m):
+        # Índice en `m` de cada fila/columna del resultado (None = fuera: #N/A)
+        alto, ancho = len(m), len(m[0])
+        return ([0 if alto == 1 else i if i < alto else None for i in range(filas)],
+                [0 if ancho == 1 else j if j < ancho else None for j in range(cols)])
+
+    (fa, ca), (fb, cb) = columnas(a), columnas(b)
+    return [[funcion(NA if i is None or j is None else a[i][j],
+                     NA if k is None or l is None else b[k][l])
+             for j, l in zip(ca, cb)]
+            for i, k in zip(fa, fb)]
+
+
+def _plano(x):
+    """Lista de valores de una matriz o un escalar."""
+    if isinstance(x, list):
+        return [v for fila in x for v in fila]
+    return [x]
+
+
+def _primer_error(valores):
+    return next((v for v in valores if isinstance(v, ErrorExcel)), None)
+
+
+def _redondear(x, digitos, modo):
+    cuanto = Decimal(1).scaleb(-int(digitos))
+    return float(Decimal(repr(float(x))).quantize(cuanto, rounding=modo))
+
+
+def _criterio(criterio):
+    """Predicado de un criterio de COUNTIF/SUMIF ("Lunes", ">=46000", 1...)."""
+    if isinstance(criterio, ErrorExcel):
+        return lambda v: False
+    if not isinstance(criterio, str):
+        return lambda v: not isinstance(v, ErrorExcel) and v is not None and \
+            _tipo(v) == _tipo(criterio) and _comparar("=", v, criterio)
+    op, resto = _RE_CRITERIO.match(criterio).groups()
+    op = op or "="
+    if _RE_NUMERO.match(resto):
+        numero = float(resto)
+        return lambda v: _es_numero(v) and _comparar(op, v, numero)
+    if resto == "":
+        if op == "=":
+            return lambda v: v is None or v == ""
+        return lambda v: not (v is None or v == "")
+    if op in ("=", "<>") and any(c in resto for c in "*?"):
+        patron = re.compile(
+            "".join(".*" if c == "*" else "." if c == "?" else re.escape(c)
+                    for c in resto) + r"\Z", re.I | re.S)
+        coincide = lambda v: isinstance(v, str) and bool(patron.match(v))
+        return coincide if op == "=" else (lambda v: not coincide(v))
+    if op == "<>":
+        return lambda v: not (isinstance(v, str) and _comparar("=", v, resto))
+    return lambda v: isinstance(v, str) and _comparar(op, v, resto)
+
+
+def _texto_formato(v, formato):
+    """TEXT(v, formato) para los formatos que usa el libro."""
+    if isinstance(v, ErrorExcel):
+        return v
+    x = _a_numero(v)
+    if isinstance(x, ErrorExcel):
+        return _a_texto(v)
+    f = formato.upper()
+    if f.endswith("%"):
+        decimales = len(f.split(".")[1]) - 1 if "." in f else 0
+        return f"{_redondear(x * 100, decimales, ROUND_HALF_UP):.{decimales}f}%"
+    if "D" in f or "Y" in f:
+        fecha = from_excel(x)
+        return (f.replace("YYYY", f"{fecha:%Y}").replace("MM", f"{fecha:%m}")
+                .replace("DD", f"{fecha:%d}"))
+    decimales = len(f.split(".")[1]) if "." in f else 0
+    redondeado = _redondear(x, decimales, ROUND_HALF_UP)
+    return f"{redondeado:,.{decimales}f}" if "," in f else f"{redondeado:.{decimales}f}"
+
+
+# ── Árbol de una fórmula ──────────────────────────────────────────
+def analizar(formula):
+    """
+    Árbol de una fórmula ("=..."): tuplas ("num", x), ("str", s),
+    ("bool", b), ("err", código), ("ref", texto), ("vacio",),
+    ("neg", nodo), ("op", operador, izq, der) y ("func", NOMBRE, [args]).
+    """
+    tokens = [t for t in Tokenizer(formula).items if t.type != Token.WSPACE]
+    nodo, pos = _expresion(tokens, 0, 0)
+    if pos != len(tokens):
+        raise NoSoportada(formula)
+    return nodo
+
+
+def _expresion(tokens, pos, minimo):
+    izq, pos = _primario(tokens, pos)
+    while pos < len(tokens):
+        tok = tokens[pos]
+        if tok.type == Token.OP_POST and tok.value == "%":
+            izq, pos = ("op", "/", izq, ("num", 100)), pos + 1
+            continue
+        if tok.type != Token.OP_IN or tok.value not in PRECEDENCIA:
+            break
+        precedencia = PRECEDENCIA[tok.value]
+        if precedencia < minimo:
+            break
+        der, pos = _expresion(tokens, pos + 1, precedencia + 1)
+        izq = ("op", tok.value, izq, der)
+    return izq, pos
+
+
+def _primario(tokens, pos):
+    if pos >= len(tokens):
+        raise NoSoportada("fórmula incompleta")
+    tok = tokens[pos]
+    if tok.type == Token.OPERAND:
+        if tok.subtype == Token.NUMBER:
+            numero = float(tok.value)
+            return ("num", int(numero) if numero.is_integer() else numero), pos + 1
+        if tok.subtype == Token.TEXT:
+            return ("str", tok.value[1:-1].replace('""', '"')), pos + 1
+        if tok.subtype == Token.LOGICAL:
+            return ("bool", tok.value.upper() == "TRUE"), pos + 1
+        if tok.subtype == Token.ERROR:
+            return ("err", tok.value.upper()), pos + 1
+        return ("ref", tok.value), pos + 1
+    if tok.type == Token.OP_PRE:
+        operando, pos = _expresion(tokens, pos + 1, PRECEDENCIA_NEGACION)
+        return (("neg", operando) if tok.value == "-" else operando), pos
+    if tok.type == Token.PAREN and tok.subtype == Token.OPEN:
+        nodo, pos = _expresion(tokens, pos + 1, 0)
+        if pos >= len(tokens) or tokens[pos].type != Token.PAREN:
+            raise NoSoportada("paréntesis sin cerrar")
+        return nodo, pos + 1
+    if tok.type == Token.FUNC and tok.subtype == Token.OPEN:
+        nombre = tok.value[:-1]
+        args, pos = _argumentos(tokens, pos + 1)
+        if ":" in nombre:
+            # El tokenizador junta "Hoja!$A$12:INDEX(" en un solo token
+            inicio, nombre = nombre.rsplit(":", 1)
+            return ("op", ":", ("ref", inicio), ("func", nombre.upper(), args)), pos
+        return ("func", nombre.upper(), args), pos
+    raise NoSoportada(f"token {tok.value!r}")
+
+
+def _argumentos(tokens, pos):
+    """Argumentos de una función hasta su cierre; uno omitido es ("vacio",)."""
+    def es(tok, tipo, subtipo):
+        return tok.type == tipo and tok.subtype == subtipo
+
+    if pos < len(tokens) and es(tokens[pos], Token.FUNC, Token.CLOSE):
+        return [], pos + 1
+    args = []
+    while pos < len(tokens):
+        tok = tokens[pos]
+        if es(tok, Token.SEP, Token.ARG) or es(tok, Token.FUNC, Token.CLOSE):
+            nodo = ("vacio",)
+        else:
+            nodo, pos = _expresion(tokens, pos, 0)
+        args.append(nodo)
+        if pos >= len(tokens):
+            break
+        if es(tokens[pos], Token.FUNC, Token.CLOSE):
+            return args, pos + 1
+        if not es(tokens[pos], Token.SEP, Token.ARG):
+            raise NoSoportada("argumento mal formado")
+        pos += 1
+    raise NoSoportada("función sin cerrar")
+
+
+# ── Evaluación ────────────────────────────────────────────────────
+class Evaluador:
+    """
+    Evalúa las fórmulas de un libro cargado con openpyxl.
+
+    Cada celda se calcula la primera vez que se necesita (al pedirla o al
+    leerla otra fórmula) y su valor se memoriza; los nombres definidos y los
+    rangos leídos también, así que un rango dinámico como Reg_Fecha se
+    resuelve una sola vez aunque lo usen cientos de fórmulas.
+    """
+
+    def __init__(self, wb, hoy=None):
+        self.wb = wb
+        self.hoy = to_excel(hoy or datetime.date.today())
+        self.nombres = {n: d.attr_text for n, d in wb.defined_names.items()}
+        self.valores = {}       # (hoja, fila, col) → valor
+        self._arboles = {}      # fórmula → árbol
+        self._nombres = {}      # nombre → valor o Ref
+        self._matrices = {}     # Ref → matriz de valores
+        self._claves = {}       # Ref → claves _orden (para búsqueda binaria)
+        self._en_curso = set()
+        self._celda = None      # (hoja, fila, col) que se está evaluando
+        # Celdas cubiertas por una fórmula matricial → celda que la tiene
+        self._matriciales = {}
+        for ws in wb.worksheets:
+            for (fila, col), cell in ws._cells.items():
+                if isinstance(cell.value, ArrayFormula):
+                    c1, f1, c2, f2 = range_boundaries(cell.value.ref)
+                    for r in range(f1, f2 + 1):
+                        for c in range(c1, c2 + 1):
+                            self._matriciales[(ws.title, r, c)] = (ws.title, fila, col)
+
+    # ── Celdas ────────────────────────────────────────────────────
+    def valor_celda(self, hoja, fila, col):
+        """Valor (calculado si es una fórmula) de una celda."""
+        clave = (hoja, fila, col)
+        if clave in self.valores:
+            return self.valores[clave]
+        if clave in self._matriciales and self._matriciales[clave] != clave:
+            self.valor_celda(*self._matriciales[clave])
+            return self.valores.get(clave)
+        if clave in self._en_curso:
+            return 0    # referencia circular: Excel también da 0
+        cell = self.wb[hoja]._cells.get((fila, col))
+        valor = None if cell is None else cell.value
+        if isinstance(valor, ArrayFormula) or (
+                isinstance(valor, str) and valor.startswith("=")):
+            self._en_curso.add(clave)
+            anterior, self._celda = self._celda, clave
+            try:
+                valor = self._calcular(hoja, fila, col, valor)
+            finally:
+                self._en_curso.discard(clave)
+                self._celda = anterior
+        elif isinstance(valor, (datetime.datetime, datetime.date)):
+            valor = to_excel(valor)
+        self.valores[clave] = valor
+        return valor
+
+    def _calcular(self, hoja, fila, col, valor):
+        if not isinstance(valor, ArrayFormula):
+            return self.escalar(self.evaluar(self.arbol(_plantilla(valor, fila)), hoja))
+        # Fórmula matricial: el resultado se reparte por su rango
+        resultado = self.matriz(self.evaluar(self.arbol(valor.text), hoja))
+        c1, f1, c2, f2 = range_boundaries(valor.ref)
+        for r in range(f1, f2 + 1):
+            for c in range(c1, c2 + 1):
+                i, j = r - f1, c - c1
+                v = (resultado[i][j] if i < len(resultado) and j < len(resultado[i])
+                     else NA)
+                self.valores[(hoja, r, c)] = v
+        return self.valores[(hoja, fila, col)]
+
+    def arbol(self, formula):
+        if formula not in self._arboles:
+            self._arboles[formula] = analizar(formula)
+        return self._arboles[formula]
+
+    # ── Referencias ───────────────────────────────────────────────
+    def referencia(self, texto, hoja):
+        """Ref de un nombre definido que es un rango o de una referencia A1."""
+        if texto in self.nombres:
+            return self.nombre(texto)
+        if _FILA_PROPIA in texto:
+            texto = texto.replace(_FILA_PROPIA, str(self._celda[1]))
+        if "!" in texto:
+            hoja, texto = texto.rsplit("!", 1)
+            hoja = hoja.strip("'").replace("''", "'")
+        if hoja not in self.wb.sheetnames:
+            return REF
+        try:
+            c1, f1, c2, f2 = range_boundaries(texto.replace("$", ""))
+        except (ValueError, TypeError):
+            raise NoSoportada(f"referencia {texto!r}")
+        if None in (c1, f1, c2, f2):
+            raise NoSoportada(f"fila o columna completa {texto!r}")
+        return Ref(hoja, f1, c1, f2, c2)
+
+    def nombre(self, nombre):
+        """Valor o Ref de un nombre definido (se evalúa una vez)."""
+        if nombre not in self._nombres:
+            texto = self.nombres[nombre]
+            self._nombres[nombre] = self.evaluar(self.arbol("=" + texto), None)
+        return self._nombres[nombre]
+
+    def matriz(self, x):
+        """Matriz de valores de una Ref, matriz o escalar."""
+        if isinstance(x, Ref):
+            if x not in self._matrices:
+                self._matrices[x] = [
+                    [self.valor_celda(x.hoja, r, c) for c in range(x.col1, x.col2 + 1)]
+                    for r in range(x.fila1, x.fila2 + 1)]
+            return self._matrices[x]
+        if isinstance(x, list):
+            return x
+        return [[x]]
+
+    def valor(self, x):
+        """Una Ref de una celda pasa a su valor y una de varias a su matriz."""
+        if isinstance(x, Ref):
+            if x.fila1 == x.fila2 and x.col1 == x.col2:
+                return self.valor_celda(x.hoja, x.fila1, x.col1)
+            return self.matriz(x)
+        return x
+
+    def escalar(self, x):
+        """Resultado de una fórmula de celda: la esquina de un rango o matriz."""
+        x = self.valor(x)
+        if isinstance(x, list):
+            x = x[0][0] if x and x[0] else None
+        return 0 if x is None else x
+
+    # ── Nodos ─────────────────────────────────────────────────────
+    def evaluar(self, nodo, hoja):
+        tipo = nodo[0]
+        if tipo in ("num", "str", "bool"):
+            return nodo[1]
+        if tipo == "err":
+            return ERRORES.get(nodo[1], VALOR)
+        if tipo == "vacio":
+            return None
+        if tipo == "ref":
+            return self.referencia(nodo[1], hoja)
+        if tipo == "neg":
+            return _difundir(lambda a, _: _operar("-", 0, a),
+                             self.valor(self.evaluar(nodo[1], hoja)), 0)
+        if tipo == "op":
+            _, op, izq, der = nodo
+            a, b = self.evaluar(izq, hoja), self.evaluar(der, hoja)
+            if op == ":":
+                return self._union(a, b)
+            return _difundir(functools.partial(_operar, op),
+                             self.valor(a), self.valor(b))
+        _, nombre, args = nodo
+        if nombre in _PEREZOSAS:
+            return _PEREZOSAS[nombre](self, args, hoja)
+        funcion = FUNCIONES.get(nombre)
+        if funcion is None:
+            raise NoSoportada(f"función {nombre}")
+        return funcion(self, *(self.evaluar(a, hoja) for a in args))
+
+    @staticmethod
+    def _union(a, b):
+        if isinstance(a, ErrorExcel) or isinstance(b, ErrorExcel):
+            return a if isinstance(a, ErrorExcel) else b
+        if not (isinstance(a, Ref) and isinstance(b, Ref)) or a.hoja != b.hoja:
+            return VALOR
+        return Ref(a.hoja, min(a.fila1, b.fila1), min(a.col1, b.col1),
+                   max(a.fila2, b.fila2), max(a.col2, b.col2))
+
+    # ── Ayudas de las funciones ───────────────────────────────────
+    def numeros(self, args):
+        """Números de los argumentos como los leen SUM/MAX/AVERAGE..."""
+        numeros = []
+        for x in args:
+            if isinstance(x, (Ref, list)):
+                for v in _plano(self.valor(x) if isinstance(x, Ref) else x):
+                    if isinstance(v, ErrorExcel):
+                        return v
+                    if _es_numero(v):
+                        numeros.append(v)
+            elif x is not None:
+                v = _a_numero(x)
+                if isinstance(v, ErrorExcel):
+                    return v
+                numeros.append(v)
+        return numeros
+
+    def plano(self, x):
+        return _plano(self.matriz(x))
+
+    def claves(self, x):
+        """Claves _orden de un rango, memorizadas para la búsqueda binaria."""
+        if not isinstance(x, Ref):
+            return [_orden(v) for v in self.plano(x)]
+        if x not in self._claves:
+            self._claves[x] = [_orden(v) for v in self.plano(x)]
+        return self._claves[x]
+
+    def filtrar(self, pares):
+        """Posiciones que cumplen todos los (rango, criterio) de un *IFS."""
+        if not pares:
+            return []
+        rangos = [self.plano(rango) for rango, _ in pares]
+        if len({len(r) for r in rangos}) > 1:
+            return None
+        posiciones = range(len(rangos[0]))
+        for rango, (_, criterio) in zip(rangos, pares):
+            predicado = _criterio(self.escalar(criterio))
+            posiciones = [i for i in posiciones if predicado(rango[i])]
+        return posiciones
+
+
+# ── Funciones ─────────────────────────────────────────────────────
+def _if(ev, args, hoja):
+    condicion = ev.escalar(ev.evaluar(args[0], hoja))
+    if isinstance(condicion, ErrorExcel):
+        return condicion
+    if isinstance(condicion, str):
+        return VALOR
+    if condicion:
+        return ev.evaluar(args[1], hoja) if len(args) > 1 else True
+    if len(args) > 2:
+        return ev.evaluar(args[2], hoja)
+    return False
+
+
+def _iferror(ev, args, hoja):
+    valor = ev.valor(ev.evaluar(args[0], hoja))
+    if isinstance(valor, ErrorExcel):
+        return ev.evaluar(args[1], hoja)
+    if isinstance(valor, list):
+        alternativa = ev.escalar(ev.evaluar(args[1], hoja))
+        return [[alternativa if isinstance(v, ErrorExcel) else v for v in fila]
+                for fila in valor]
+    return valor
+
+
+def _logica(reduccion):
+    def funcion(ev, *args):
+        valores = []
+        for x in args:
+            for v in _plano(ev.valor(x)):
+                if isinstance(v, ErrorExcel):
+                    return v
+                if _es_numero(v) or isinstance(v, bool):
+                    valores.append(bool(v))
+        return reduccion(valores) if valores else VALOR
+    return funcion
+
+
+def _sum(ev, *args):
+    numeros = ev.numeros(args)
+    return numeros if isinstance(numeros, ErrorExcel) else sum(numeros)
+
+
+def _average(ev, *args):
+    numeros = ev.numeros(args)
+    if isinstance(numeros, ErrorExcel):
+        return numeros
+    return sum(numeros) / len(numeros) if numeros else DIV0
+
+
+def _extremo(funcion):
+    def extremo(ev, *args):
+        numeros = ev.numeros(args)
+        if isinstance(numeros, ErrorExcel):
+            return numeros
+        return funcion(numeros) if numeros else 0
+    return extremo
+
+
+def _counta(ev, *args):
+    total = 0
+    for x in args:
+        if isinstance(x, (Ref, list)):
+            total += sum(v is not None for v in ev.plano(x))
+        elif x is not None:
+            total += 1
+    return total
+
+
+def _countifs(ev, *args):
+    posiciones = ev.filtrar(list(zip(args[::2], args[1::2])))
+    return VALOR if posiciones is None else len(posiciones)
+
+
+def _sumifs(ev, suma, *args):
+    posiciones = ev.filtrar(list(zip(args[::2], args[1::2])))
+    if posiciones is None:
+        return VALOR
+    valores = ev.plano(suma)
+    return sum(valores[i] for i in posiciones if _es_numero(valores[i]))
+
+
+def _averageifs(ev, promedio, *args):
+    posiciones = ev.filtrar(list(zip(args[::2], args[1::2])))
+    if posiciones is None:
+        return VALOR
+    valores = ev.plano(promedio)
+    numeros = [valores[i] for i in posiciones if _es_numero(valores[i])]
+    return sum(numeros) / len(numeros) if numeros else DIV0
+
+
+def _sumif(ev, rango, criterio, suma=None):
+    return _sumifs(ev, rango if suma is None else suma, rango, criterio)
+
+
+def _averageif(ev, rango, criterio, promedio=None):
+    return _averageifs(ev, rango if promedio is None else promedio, rango, criterio)
+
+
+def _sumproduct(ev, *args):
+    matrices = [ev.plano(x) for x in args]
+    if len({len(m) for m in matrices}) > 1:
+        return VALOR
+    total = 0
+    for valores in zip(*matrices):
+        error = _primer_error(valores)
+        if error is not None:
+            return error
+        producto = 1
+        for v in valores:
+            producto *= v if _es_numero(v) else 0
+        total += producto
+    return total
+
+
+# AGGREGATE: función → cálculo sobre los números; opciones que ignoran errores
+_AGREGADOS = {1: "AVERAGE", 4: "MAX", 5: "MIN", 9: "SUM", 14: "LARGE", 15: "SMALL"}
+_IGNORAN_ERRORES = {2, 3, 6, 7}
+
+
+def _aggregate(ev, funcion, opciones, datos, k=None):
+    funcion, opciones = int(ev.escalar(funcion)), int(ev.escalar(opciones))
+    if funcion not in _AGREGADOS:
+        raise NoSoportada(f"AGGREGATE({funcion})")
+    numeros = []
+    for v in ev.plano(datos):
+        if isinstance(v, ErrorExcel):
+            if opciones in _IGNORAN_ERRORES:
+                continue
+            return v
+        if _es_numero(v):
+            numeros.append(v)
+    nombre = _AGREGADOS[funcion]
+    if nombre in ("LARGE", "SMALL"):
+        k = int(ev.escalar(k))
+        if not 1 <= k <= len(numeros):
+            return NUM
+        return sorted(numeros, reverse=(nombre == "LARGE"))[k - 1]
+    if nombre == "SUM":
+        return sum(numeros)
+    if not numeros:
+        return DIV0 if nombre == "AVERAGE" else 0
+    return {"AVERAGE": lambda n: sum(n) / len(n), "MAX": max, "MIN": min}[nombre](numeros)
+
+
+def _frequency(ev, datos, limites):
+    limites = [v for v in ev.plano(limites) if _es_numero(v)]
+    cuentas = [0] * (len(limites) + 1)
+    orden = sorted(range(len(limites)), key=lambda i: limites[i])
+    ordenados = [limites[i] for i in orden]
+    for v in ev.plano(datos):
+        if _es_numero(v):
+            # Intervalo del primer límite >= v; el último cuenta los mayores
+            i = bisect_left(ordenados, v)
+            cuentas[orden[i] if i < len(ordenados) else len(limites)] += 1
+    return [[c] for c in cuentas]
+
+
+def _index(ev, rango, fila=None, col=None):
+    fila = 0 if fila is None else ev.escalar(fila)
+    col = 0 if col is None else ev.escalar(col)
+    for v in (rango, fila, col):
+        if isinstance(v, ErrorExcel):
+            return v
+    fila, col = int(_a_numero(fila)), int(_a_numero(col))
+    if isinstance(rango, Ref):
+        alto, ancho = rango.fila2 - rango.fila1 + 1, rango.col2 - rango.col1 + 1
+    else:
+        rango = ev.matriz(rango)
+        alto, ancho = len(rango), len(rango[0])
+    if ancho == 1 and col == 0 or alto == 1 and ancho > 1 and col == 0:
+        # Un solo índice en un rango de una fila o una columna
+        if alto == 1 and ancho > 1:
+            fila, col = 1, fila
+        else:
+            col = 1
+    if fila < 0 or col < 0 or fila > alto or col > ancho:
+        return REF
+    if isinstance(rango, Ref):
+        f1, f2 = (rango.fila1, rango.fila2) if fila == 0 else (rango.fila1 + fila - 1,) * 2
+        c1, c2 = (rango.col1, rango.col2) if col == 0 else (rango.col1 + col - 1,) * 2
+        return Ref(rango.hoja, f1, c1, f2, c2)
+    filas = rango if fila == 0 else [rango[fila - 1]]
+    matriz = [f if col == 0 else [f[col - 1]] for f in filas]
+    return matriz if len(matriz) > 1 or len(matriz[0]) > 1 else matriz[0][0]
+
+
+def _match(ev, buscado, rango, tipo=None):
+    buscado = ev.escalar(buscado)
+    tipo = 1 if tipo is None else int(_a_numero(ev.escalar(tipo)))
+    if isinstance(buscado, ErrorExcel):
+        return buscado
+    if tipo == 0:
+        for i, v in enumerate(ev.plano(rango), start=1):
+            if v is not None and _tipo(v) == _tipo(buscado) \
+                    and _comparar("=", v, buscado):
+                return i
+        return NA
+    claves = ev.claves(rango)
+    if tipo < 0:
+        raise NoSoportada("MATCH(...,-1)")
+    # Búsqueda binaria: la última posición con valor <= buscado
+    posicion = bisect_right(claves, _orden(buscado))
+    return posicion if posicion > 0 else NA
+
+
+def _vlookup(ev, buscado, tabla, columna, aproximado=True):
+    matriz = ev.matriz(tabla)
+    columna = int(_a_numero(ev.escalar(columna)))
+    if not 1 <= columna <= len(matriz[0]):
+        return REF
+    primera = Ref(tabla.hoja, tabla.fila1, tabla.col1, tabla.fila2, tabla.col1) \
+        if isinstance(tabla, Ref) else [[f[0]] for f in matriz]
+    aproximado = ev.escalar(aproximado) if aproximado is not None else True
+    posicion = _match(ev, buscado, primera, 1 if aproximado else 0)
+    if isinstance(posicion, ErrorExcel):
+        return posicion
+    return matriz[posicion - 1][columna - 1]
+
+
+def _row(ev, rango=None):
+    if rango is None:
+        return ev._celda[1]
+    if not isinstance(rango, Ref):
+        return VALOR
+    if rango.fila1 == rango.fila2:
+        return rango.fila1
+    return [[r] for r in range(rango.fila1, rango.fila2 + 1)]
+
+
+def _indirect(ev, texto):
+    texto = ev.escalar(texto)
+    if isinstance(texto, ErrorExcel) or not isinstance(texto, str) or not texto:
+        return REF
+    return ev.referencia(texto, ev._celda[0] if ev._celda else None)
+
+
+def _fecha(ev, x):
+    x = _a_numero(ev.escalar(x))
+    return x if isinstance(x, ErrorExcel) else from_excel(x)
+
+
+def _parte_fecha(parte):
+    def funcion(ev, x):
+        fecha = _fecha(ev, x)
+        return fecha if isinstance(fecha, ErrorExcel) else getattr(fecha, parte)
+    return funcion
+
+
+def _weekday(ev, x, tipo=None):
+    fecha = _fecha(ev, x)
+    if isinstance(fecha, ErrorExcel):
+        return fecha
+    tipo = 1 if tipo is None else int(_a_numero(ev.escalar(tipo)))
+    if tipo == 2:
+        return fecha.weekday() + 1
+    if tipo == 3:
+        return fecha.weekday()
+    return (fecha.weekday() + 1) % 7 + 1
+
+
+def _date(ev, anio, mes, dia):
+    anio, mes, dia = (int(_a_numero(ev.escalar(x))) for x in (anio, mes, dia))
+    anio += (mes - 1) // 12
+    mes = (mes - 1) % 12 + 1
+    return to_excel(datetime.date(anio, mes, 1)) + dia - 1
+
+
+def _round(modo):
+    def funcion(ev, x, digitos=0):
+        x = _a_numero(ev.escalar(x))
+        digitos = _a_numero(ev.escalar(digitos)) if digitos is not None else 0
+        for v in (x, digitos):
+            if isinstance(v, ErrorExcel):
+                return v
+        return _redondear(x, digitos, modo)
+    return funcion
+
+
+def _text(ev, x, formato):
+    return _texto_formato(ev.escalar(x), _a_texto(ev.escalar(formato)))
+
+
+_PEREZOSAS = {"IF": _if, "IFERROR": _iferror}
+
+FUNCIONES = {
+    "AND": _logica(all),
+    "OR": _logica(any),
+    "NA": lambda ev: NA,
+    "SUM": _sum,
+    "AVERAGE": _average,
+    "MAX": _extremo(max),
+    "MIN": _extremo(min),
+    "COUNTA": _counta,
+    "COUNTIF": _countifs,
+    "COUNTIFS": _countifs,
+    "SUMIF": _sumif,
+    "SUMIFS": _sumifs,
+    "AVERAGEIF": _averageif,
+    "AVERAGEIFS": _averageifs,
+    "SUMPRODUCT": _sumproduct,
+    "AGGREGATE": _aggregate,
+    "FREQUENCY": _frequency,
+    "INDEX": _index,
+    "MATCH": _match,
+    "VLOOKUP": _vlookup,
+    "ROW": _row,
+    "INDIRECT": _indirect,
+    "TODAY": lambda ev: ev.hoy,
+    "DATE": _date,
+    "YEAR": _parte_fecha("year"),
+    "MONTH": _parte_fecha("month"),
+    "DAY": _parte_fecha("day"),
+    "WEEKDAY": _weekday,
+    "ROUND": _round(ROUND_HALF_UP),
+    "ROUNDUP": _round(ROUND_UP),
+    "TEXT": _text,
+}
+
+
+# ── Libro ─────────────────────────────────────────────────────────
+def calcular_libro(wb, hoy=None):
+    """
+    {(hoja, coordenada): valor} de cada celda con fórmula del libro.
+
+    Las celdas que dependen de algo fuera del subconjunto no aparecen.
+    Devuelve también cuántas fórmulas quedaron sin calcular.
+    """
+    ev = Evaluador(wb, hoy)
+    valores, sin_calcular = {}, 0
+    for ws in wb.worksheets:
+        for (fila, col), cell in sorted(ws._cells.items()):
+            formula = cell.value
+            if isinstance(formula, ArrayFormula):
+                c1, f1, c2, f2 = range_boundaries(formula.ref)
+                celdas = [(r, c) for r in range(f1, f2 + 1) for c in range(c1, c2 + 1)]
+            elif isinstance(formula, str) and formula.startswith("="):
+                celdas = [(fila, col)]
+            else:
+                continue
+            try:
+                ev.valor_celda(ws.title, fila, col)
+            except (NoSoportada, RecursionError, ValueError, OverflowError):
+                sin_calcular += 1
+                continue
+            for r, c in celdas:
+                valores[(ws.title, f"{get_column_letter(c)}{r}")] = \
+                    ev.valores.get((ws.title, r, c))
+    return valores, sin_calcular
+
+
+def _v(valor):
+    """Atributo t y contenido de <v> para un valor en caché."""
+    if valor is None:
+        return "", "0"
+    if isinstance(valor, ErrorExcel):
+        return ' t="e"', valor.codigo
+    if isinstance(valor, bool):
+        return ' t="b"', "1" if valor else "0"
+    if _es_numero(valor):
+        if float(valor).is_integer() and abs(valor) < 1e15:
+            return "", str(int(valor))
+        return "", repr(float(valor))
+    return ' t="str"', escape(str(valor))
+
+
+_RE_FILA = re.compile(r'<row r="(\d+)"([^>]*?)(?:/>|>(.*?)</row>)', re.S)
+_RE_CELDA = re.compile(r'<c r="([A-Z]+)(\d+)"([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+_RE_FORMULA = re.compile(r"<f\b[^>]*?(?:/>|>.*?</f>)", re.S)
+_RE_TIPO = re.compile(r'\s+t="[^"]*"')
+
+
+def _hoja_con_valores(xml, valores):
+    """XML de una hoja con los valores ({(fila, col): valor}) en caché."""
+    por_fila = {}
+    for (fila, col), valor in valores.items():
+        por_fila.setdefault(fila, {})[col] = valor
+
+    def celda(m, pendientes):
+        col = column_index_from_string(m.group(1))
+        if col not in pendientes:
+            return m.group(0)
+        t, v = _v(pendientes.pop(col))
+        formula = _RE_FORMULA.search(m.group(4) or "")
+        atributos = _RE_TIPO.sub("", m.group(3))
+        return (f'<c r="{m.group(1)}{m.group(2)}"{atributos}{t}>'
+                f'{formula.group(0) if formula else ""}<v>{v}</v></c>')
+
+    def fila(m):
+        numero = int(m.group(1))
+        if numero not in por_fila:
+            return m.group(0)
+        pendientes = dict(por_fila[numero])
+        celdas = [(column_index_from_string(c.group(1)), celda(c, pendientes))
+                  for c in _RE_CELDA.finditer(m.group(3) or "")]
+        # Celdas de una fórmula matricial que no estaban escritas
+        for col, valor in pendientes.items():
+            t, v = _v(valor)
+            celdas.append((col, f'<c r="{get_column_letter(col)}{numero}"{t}>'
+                                f'<v>{v}</v></c>'))
+        celdas.sort(key=lambda c: c[0])
+        return (f'<row r="{numero}"{m.group(2)}>'
+                + "".join(texto for _, texto in celdas) + "</row>")
+
+    return _RE_FILA.sub(fila, xml)
+
+
+def _partes_hojas(origen):
+    """{nombre de hoja: parte xl/worksheets/...} de un .xlsx abierto."""
+    libro = origen.read("xl/workbook.xml").decode("utf-8")
+    rels = origen.read("xl/_rels/workbook.xml.rels").decode("utf-8")
+    destinos = {}
+    for m in re.finditer(r"<Relationship\b[^>]*>", rels):
+        id_ = re.search(r'Id="([^"]+)"', m.group(0)).group(1)
+        destino = re.search(r'Target="([^"]+)"', m.group(0)).group(1)
+        destinos[id_] = destino.lstrip("/") if destino.startswith("/") else f"xl/{destino}"
+    partes = {}
+    for m in re.finditer(r"<sheet\b[^>]*>", libro):
+        nombre = unescape(re.search(r'name="([^"]*)"', m.group(0)).group(1),
+                          {"&quot;": '"', "&apos;": "'"})
+        id_ = re.search(r'r:id="([^"]+)"', m.group(0)).group(1)
+        partes[nombre] = destinos[id_]
+    return partes
+
+
+def escribir_valores(ruta, valores, destino=None, recalcular=False):
+    """
+    Copia el .xlsx `ruta` en `destino` (por defecto, encima) con los valores
+    de calcular_libro en caché y sin fullCalcOnLoad; con `recalcular` (hay
+    fórmulas sin valor) lo conserva. Las entradas del zip mantienen su orden
+    y su fecha, así que una salida reproducible lo sigue siendo.
+    """
+    destino = destino or ruta
+    por_parte = {}
+    with open(ruta, "rb") as f:
+        datos_libro = f.read()
+    origen = zipfile.ZipFile(io.BytesIO(datos_libro))
+    partes = _partes_hojas(origen)
+    for (hoja, coordenada), valor in valores.items():
+        col, fila = re.match(r"([A-Z]+)(\d+)$", coordenada).groups()
+        por_parte.setdefault(partes[hoja], {})[
+            (int(fila), column_index_from_string(col))] = valor
+
+    temporal = f"{destino}.tmp"
+    with origen, zipfile.ZipFile(temporal, "w", zipfile.ZIP_DEFLATED) as salida:
+        for info in origen.infolist():
+            datos = origen.read(info)
+            if info.filename in por_parte:
+                datos = _hoja_con_valores(datos.decode("utf-8"),
+                                          por_parte[info.filename]).encode("utf-8")
+            elif info.filename == "xl/workbook.xml" and not recalcular:
+                datos = re.sub(rb'\s+fullCalcOnLoad="(?:1|true)"', b"", datos)
+            salida.writestr(info, datos)
+    os.replace(temporal, destino)
+    return destino
+
+
+def guardar_con_valores(ruta, destino=None, hoy=None):
+    """Calcula las fórmulas de `ruta` y las guarda con sus valores en caché."""
+    wb = openpyxl.load_workbook(ruta)
+    valores, sin_calcular = calcular_libro(wb, hoy)
+    escribir_valores(ruta, valores, destino, recalcular=sin_calcular > 0)
+    return {"calculadas": len(valores), "sin_calcular": sin_calcular}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("libros", nargs="+", help="libros a calcular (se reescriben)")
+    args = parser.parse_args()
+
+    for ruta in args.libros:
+        resumen = guardar_con_valores(ruta)
+        print(f"{ruta}: {resumen['calculadas']} celdas con valor en caché, "
+              f"{resumen['sin_calcular']} sin calcular")
@@ -5,16 +5,33 @@ entrenamientos en casa: rutinas por día, series, repeticiones y peso.
 
 import openpyxl
 from openpyxl.styles import (
-    Font, PatternFill, Alignment, Border, Side, numbers
+    Font, PatternFill, Alignment, Border, Side, NamedStyle, numbers
 )
-from openpyxl.utils import get_column_letter
+from openpyxl.utils import get_column_letter, column_index_from_string
+from openpyxl.utils.cell import coordinate_from_string
+from openpyxl.worksheet.cell_range import CellRange
 from openpyxl.worksheet.datavalidation import DataValidation
+from openpyxl.worksheet.formula import ArrayFormula
 from openpyxl.workbook.defined_name import DefinedName
 from openpyxl.chart import BarChart, PieChart, LineChart, Reference
 from openpyxl.chart.label import DataLabelList
 from openpyxl.chart.series import DataPoint
 from openpyxl.formatting.rule import FormulaRule
+from openpyxl.formula.tokenizer import Tokenizer, Token
+from openpyxl.cell import Cell, WriteOnlyCell
+from collections import Counter
 from copy import copy
+from itertools import islice
+import csv
+import datetime
+import functools
+import hashlib
+import json
+import os
+import re
+import unicodedata
+import weakref
+import zipfile
 
 # ── Colores y estilos ─────────────────────────────────────────────
 AZUL_OSCURO  = "1B2A4A"
@@ -58,31 +75,239 @@ thin_border = Border(
 )
 
 
-def set_cell(ws, row, col, value, font=font_normal, fill=None, alignment=align_center, border=thin_border):
-    cell = ws.cell(row=row, column=col, value=value)
-    cell.font = font
-    if fill:
-        cell.fill = fill
-    cell.alignment = alignment
-    cell.border = border
+font_kpi_label = Font(name="Calibri", size=9, bold=True, color=BLANCO)
+font_kpi_value = Font(name="Calibri", size=22, bold=True, color=BLANCO)
+
+
+# ── Registro de estilos con nombre ────────────────────────────────
+# Cada celda referencia uno de estos estilos por nombre. El NamedStyle se
+# registra una sola vez por libro y luego cada asignación solo copia su
+# arreglo de índices, sin volver a comparar Font/Fill/Border.
+def _spec(font=font_normal, fill=None, alignment=align_center,
+          border=thin_border, number_format="General"):
+    return dict(font=font, fill=fill or PatternFill(), alignment=alignment,
+                border=border, number_format=number_format)
+
+
+ESTILOS = {
+    "celda":              _spec(),
+    "titulo":             _spec(font_titulo, fill_titulo),
+    "subtitulo":          _spec(font_subtit, fill_header),
+    "subtitulo_oscuro":   _spec(font_subtit, fill_titulo),
+    "subtitulo_alerta":   _spec(font_subtit, fill_rojo),
+    "nota_azul":          _spec(font_small, fill_input),
+    "nota_verde":         _spec(font_small, fill_verde_cl),
+    "nota_naranja":       _spec(font_small, fill_naranja_cl),
+    "encabezado":         _spec(font_header, fill_header),
+    "encabezado_verde":   _spec(font_header, fill_verde),
+    "etiqueta":           _spec(font_bold, fill_naranja_cl),
+    "entrada":            _spec(font_normal, fill_input),
+    "entrada_fecha":      _spec(font_normal, fill_input, number_format="DD/MM/YYYY"),
+    "auxiliar":           _spec(Font(color=BLANCO, size=1), border=Border(),
+                                alignment=Alignment()),
+    "rango_objetivo":     _spec(Font(name="Calibri", size=10, italic=True, color="555555"),
+                                fill_input),
+    "estado_rango":       _spec(Font(name="Calibri", size=10, bold=True, color="333333"),
+                                fill_input),
+    "boton_verde":        _spec(font_btn, fill_verde),
+    "boton_naranja":      _spec(font_btn, fill_naranja),
+    "boton_rojo":         _spec(font_btn, fill_rojo),
+}
+
+# Filas en bandas: "fila_par" (blanco) y "fila_impar" (gris), con variantes
+for _banda, _fill in (("par", fill_alt1), ("impar", fill_alt2)):
+    ESTILOS[f"fila_{_banda}"]            = _spec(font_normal, _fill)
+    ESTILOS[f"fila_{_banda}_fecha"]      = _spec(font_normal, _fill, number_format="DD/MM/YYYY")
+    ESTILOS[f"fila_{_banda}_izq"]        = _spec(font_normal, _fill, align_left)
+    ESTILOS[f"fila_{_banda}_negrita"]    = _spec(font_bold, _fill)
+    ESTILOS[f"fila_{_banda}_negrita_izq"] = _spec(font_bold, _fill, align_left)
+
+# Tarjetas KPI del Dashboard, una por color
+COLORES_KPI = {"verde": VERDE, "azul": AZUL_MEDIO, "naranja": NARANJA,
+               "oscuro": AZUL_OSCURO, "rojo": ROJO}
+for _nombre, _color in COLORES_KPI.items():
+    _fill = PatternFill("solid", fgColor=_color)
+    ESTILOS[f"kpi_etiqueta_{_nombre}"] = _spec(font_kpi_label, _fill)
+    ESTILOS[f"kpi_valor_{_nombre}"]    = _spec(font_kpi_value, _fill)
+
+_estilos_compilados = weakref.WeakKeyDictionary()
+
+
+def estilo_banda(i, variante=""):
+    """Nombre del estilo de banda para la fila i (par/impar)."""
+    banda = "par" if i % 2 == 0 else "impar"
+    return f"fila_{banda}_{variante}" if variante else f"fila_{banda}"
+
+
+def aplicar_estilo(cell, nombre):
+    """Asigna a la celda el estilo con nombre, registrándolo si hace falta."""
+    wb = cell.parent.parent
+    compilados = _estilos_compilados.setdefault(wb, {})
+    arreglo = compilados.get(nombre)
+    if arreglo is None:
+        if nombre not in wb.named_styles:
+            wb.add_named_style(NamedStyle(name=nombre, **ESTILOS[nombre]))
+        # Libros ya existentes traen el estilo registrado: se resuelve igual
+        cell.style = nombre
+        arreglo = compilados[nombre] = copy(cell._style)
+        return cell
+    cell._style = copy(arreglo)
     return cell
 
 
-def merge_and_set(ws, start_row, start_col, end_row, end_col, value, font, fill, alignment=align_center):
+# ── Archivos de salida ────────────────────────────────────────────
+SALIDA_XLSX = "/home/user/gym/Entrenamiento_Casa.xlsx"
+SALIDA_VBA  = "/home/user/gym/macros_entrenamiento.bas"
+
+
+# ── Historial ─────────────────────────────────────────────────────
+FILA_INICIO_HISTORIAL = 12
+CAPACIDAD_HISTORIAL   = 189     # filas 12-200 por defecto
+
+# Gráfico de peso del Dashboard: puntos máximos de la serie agregada por
+# fecha (el coste de dibujarlo no crece con el historial)
+PUNTOS_GRAFICO = 60
+
+# Hoja Historico (rotar_historial.py): resumen por mes en B-F desde la fila 6.
+# Su gráfico de peso máximo por mes va en el Dashboard, bajo el de peso
+# (fila de 5 días; con más días baja igual que el resto del Dashboard)
+FILA_INICIO_HISTORICO = 6
+FILA_GRAFICO_HISTORICO = 66
+
+# Rangos dinámicos del historial: cada nombre cubre solo las filas con datos
+COLUMNAS_REGISTRO = {
+    "Reg_Fecha":     "A",
+    "Reg_Rutina":    "B",
+    "Reg_Ejercicio": "C",
+    "Reg_Serie":     "D",
+    "Reg_Reps":      "E",
+    "Reg_Peso":      "F",
+    "Reg_Descanso":  "G",
+    "Reg_Notas":     "H",
+}
+
+# Columnas auxiliares ocultas (J-M): el ejercicio de cada fila se busca una
+# sola vez y el formato condicional y las alertas leen estos resultados.
+COLUMNAS_AUXILIARES = {
+    "Reg_EjIdx":   "J",     # posición del ejercicio en Ej_Nombres
+    "Reg_RepsMin": "K",
+    "Reg_RepsMax": "L",
+    "Reg_Estado":  "M",     # 1 = sobre rango, -1 = bajo rango, 0 = en rango
+}
+
+# Columna oculta I del historial: id de la serie en el almacén SQLite (ver
+# almacen_sqlite). Va con su fila: al vaciar o reusar una fila se borra
+COLUMNA_ID = 9
+
+# Celda oculta con el número de registros (nombre N_Registros): la columna A
+# del historial se cuenta una sola vez aquí y los rangos Reg_* y el
+# Dashboard leen la celda en lugar de volver a contarla en cada uso
+CELDA_N_REGISTROS = "J10"
+
+
+# Índice de sesiones (hoja Sesiones): una fila por (fecha, rutina) desde la
+# fila 2, con los totales de sus series
+COLUMNAS_SESIONES = {
+    "Ses_Fecha":    "A",
+    "Ses_Rutina":   "B",
+    "Ses_Sets":     "C",
+    "Ses_Reps":     "D",
+    "Ses_Volumen":  "E",     # suma de reps × peso
+    "Ses_Duracion": "F",     # minutos: suma de los descansos registrados
+}
+FILA_INICIO_SESIONES = 2
+
+
+def set_cell(ws, row, col, value, estilo="celda"):
+    cell = ws.cell(row=row, column=col, value=value)
+    return aplicar_estilo(cell, estilo)
+
+
+def merge_and_set(ws, start_row, start_col, end_row, end_col, value, estilo):
     ws.merge_cells(
         start_row=start_row, start_column=start_col,
         end_row=end_row, end_column=end_col,
     )
-    cell = ws.cell(row=start_row, column=start_col, value=value)
-    cell.font = font
-    cell.fill = fill
-    cell.alignment = alignment
-    cell.border = thin_border
-    # Apply border/fill to all merged cells
+    ws.cell(row=start_row, column=start_col, value=value)
+    # Aplicar el estilo a todas las celdas combinadas (borde y relleno)
     for r in range(start_row, end_row + 1):
         for c in range(start_col, end_col + 1):
-            ws.cell(row=r, column=c).border = thin_border
-            ws.cell(row=r, column=c).fill = fill
+            aplicar_estilo(ws.cell(row=r, column=c), estilo)
+
+
+class HojaStreaming:
+    """
+    Envoltorio de una hoja write-only con la misma API que usan los
+    constructores (ws.cell, ws.merge_cells, ws["B6"], atributos de la hoja).
+
+    Las celdas sueltas (títulos, cabeceras, entrada rápida) se guardan en
+    memoria; las filas del historial llegan desde un generador y se escriben
+    al volcar, sin crear nunca el historial completo en memoria.
+    """
+
+    def __init__(self, ws):
+        object.__setattr__(self, "hoja", ws)
+        object.__setattr__(self, "_celdas", {})
+        object.__setattr__(self, "filas_generadas", None)
+
+    def __getattr__(self, nombre):
+        return getattr(self.hoja, nombre)
+
+    def __setattr__(self, nombre, valor):
+        if nombre == "filas_generadas":
+            object.__setattr__(self, nombre, valor)
+        else:
+            setattr(self.hoja, nombre, valor)
+
+    def __getitem__(self, coordenada):
+        col, row = coordinate_from_string(coordenada)
+        return self.cell(row=row, column=column_index_from_string(col))
+
+    def cell(self, row, column, value=None):
+        cell = self._celdas.get((row, column))
+        if cell is None:
+            cell = Cell(self.hoja, row=row, column=column)
+            self._celdas[(row, column)] = cell
+        if value is not None:
+            cell.value = value
+        return cell
+
+    def add_data_validation(self, dv):
+        self.hoja.data_validations.append(dv)
+
+    def merge_cells(self, start_row, start_column, end_row, end_column):
+        self.hoja.merged_cells.add(CellRange(
+            min_row=start_row, min_col=start_column,
+            max_row=end_row, max_col=end_column))
+
+    def volcar(self):
+        """Escribe las filas en orden: primero las sueltas, luego las generadas."""
+        filas = {}
+        for (r, c), cell in self._celdas.items():
+            filas.setdefault(r, {})[c] = cell
+
+        ultima = max(filas, default=0)
+        if self.filas_generadas is not None:
+            fila_inicio, generador = self.filas_generadas
+            ultima = min(ultima, fila_inicio - 1)
+
+        for r in range(1, ultima + 1):
+            fila = filas.get(r, {})
+            self.hoja.append([fila.get(c) for c in range(1, max(fila, default=0) + 1)])
+
+        if self.filas_generadas is not None:
+            for fila in generador:
+                self.hoja.append(fila)
+
+        self._celdas.clear()
+
+
+def crear_hoja(wb, titulo):
+    """Crea una hoja; en libros write-only la envuelve en HojaStreaming."""
+    ws = wb.create_sheet(titulo)
+    if wb.write_only:
+        return HojaStreaming(ws)
+    return ws
 
 
 # ── Rutinas predefinidas para casa ────────────────────────────────
@@ -174,15 +399,162 @@ REPS_RANGES = {
 }
 
 
-def crear_hoja_datos(wb):
-    """Hoja oculta con ejercicios en columnas para rangos con nombre."""
-    ws = wb.create_sheet("Datos")
+def ejercicios_unicos(rutinas=None):
+    """Ejercicios de todas las rutinas, deduplicados manteniendo el orden."""
+    seen = set()
+    unique_exercises = []
+    for ejercicios in (RUTINAS if rutinas is None else rutinas).values():
+        for ej in ejercicios:
+            if ej not in seen:
+                seen.add(ej)
+                unique_exercises.append(ej)
+    return unique_exercises
+
+
+# ── Configuración por miembro ─────────────────────────────────────
+def clave_orden(nombre):
+    """
+    Clave con la que se ordena el catálogo de ejercicios en Datos.
+
+    Imita la comparación de texto de Excel (sin distinguir mayúsculas ni
+    acentos, ignorando guiones y apóstrofos), que es la que usa MATCH con
+    coincidencia aproximada para su búsqueda binaria; a igualdad deciden
+    los acentos y luego las mayúsculas, como en Excel.
+    """
+    texto = str(nombre)
+    sin_acentos = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode()
+    return re.sub(r"[-']", "", sin_acentos).casefold(), texto.casefold(), texto
+
+
+def asignar_ids(ejercicios, ids=None):
+    """
+    Id estable de cada ejercicio: conserva los de `ids` ({ejercicio: id},
+    p. ej. los leídos de un libro) y numera los nuevos a continuación.
+    """
+    ids = {ej: ids[ej] for ej in ejercicios if ids and ej in ids}
+    siguiente = max(ids.values(), default=0) + 1
+    for ej in ejercicios:
+        if ej not in ids:
+            ids[ej] = siguiente
+            siguiente += 1
+    return ids
+
+
+def clave_dia(dia):
+    """Clave de rango con nombre para un día: "Miércoles - Piernas" → "Dia_Miercoles"."""
+    corto = dia.split(" - ")[0]
+    sin_acentos = unicodedata.normalize("NFKD", corto).encode("ascii", "ignore").decode()
+    return "Dia_" + (re.sub(r"\W", "", sin_acentos) or "X")
+
+
+def configuracion(rutinas=None, reps_ranges=None, no_volatil=False,
+                  fecha_ref=None, puntos_grafico=PUNTOS_GRAFICO, ids=None):
+    """
+    Configuración de plantilla que reciben los crear_hoja_*.
+
+    Sin argumentos usa RUTINAS y REPS_RANGES del módulo (leídos al llamar,
+    no al importar). Las claves de día salen de CLAVES_DIA o de clave_dia()
+    y se desambiguan con un sufijo si dos días producen la misma.
+
+    Con no_volatil=True el libro no usa TODAY() ni INDIRECT: las fechas se
+    calculan contra la celda Fecha_Ref (valor `fecha_ref`, hoy por defecto,
+    que la macro Auto_Open actualiza al abrir) y el desplegable de
+    ejercicios usa INDEX/MATCH sobre las columnas de Datos.
+
+    `puntos_grafico` es el número de puntos de la serie del gráfico de peso
+    del Dashboard.
+
+    "catalogo" son los ejercicios en el orden de la tabla de Datos
+    (clave_orden, para buscarlos con MATCH aproximado) e "ids" su id estable
+    (ver asignar_ids).
+    """
+    rutinas = RUTINAS if rutinas is None else rutinas
+    reps_ranges = REPS_RANGES if reps_ranges is None else reps_ranges
+    claves = {}
+    for dia in rutinas:
+        base = CLAVES_DIA.get(dia) or clave_dia(dia)
+        clave, n = base, 2
+        while clave in claves.values():
+            clave, n = f"{base}_{n}", n + 1
+        claves[dia] = clave
+    ejercicios = ejercicios_unicos(rutinas)
+    return {
+        "rutinas": rutinas,
+        "dias": list(rutinas),
+        "claves_dia": claves,
+        "reps_ranges": reps_ranges,
+        "ejercicios": ejercicios,
+        "catalogo": sorted(ejercicios, key=clave_orden),
+        "ids": asignar_ids(ejercicios, ids),
+        "no_volatil": no_volatil,
+        "fecha_ref": fecha_ref,
+        "puntos_grafico": puntos_grafico,
+    }
+
+
+def configuracion_libro(wb):
+    """Reconstruye la configuración de un libro generado a partir de su hoja Datos."""
+    ws = wb["Datos"]
+    rutinas = {}
+    for col in range(1, ws.max_column + 1):
+        dia = ws.cell(row=1, column=col).value
+        if dia in (None, ""):
+            break
+        ejercicios = []
+        for row in range(2, ws.max_row + 1):
+            ej = ws.cell(row=row, column=col).value
+            if ej in (None, ""):
+                break
+            ejercicios.append(ej)
+        rutinas[dia] = ejercicios
+
+    col_tabla = len(rutinas) + 3
+    # Libros anteriores al catálogo ordenado no tienen columna Id
+    con_ids = ws.cell(row=1, column=col_tabla + 4).value == "Id"
+    reps_ranges, ids = {}, {}
+    for row in range(2, ws.max_row + 1):
+        ej, rmin, rmax = (ws.cell(row=row, column=col_tabla + i).value for i in range(3))
+        if ej in (None, ""):
+            break
+        reps_ranges[ej] = (rmin, rmax)
+        if con_ids:
+            ids[ej] = ws.cell(row=row, column=col_tabla + 4).value
+    return configuracion(rutinas, reps_ranges,
+                         no_volatil="Fecha_Ref" in wb.defined_names,
+                         puntos_grafico=puntos_grafico_libro(wb), ids=ids)
+
+
+def formula_hoy(config):
+    """Expresión de la fecha de hoy: TODAY() o la celda Fecha_Ref (no volátil)."""
+    return "Fecha_Ref" if config["no_volatil"] else "TODAY()"
+
+
+def formula_lista_ejercicios(config):
+    """Origen del desplegable de ejercicios (C6)."""
+    return "=Ejercicios_Dia" if config["no_volatil"] else "=INDIRECT(I6)"
+
+
+def crear_hoja_datos(wb, config=None):
+    """
+    Hoja oculta con ejercicios en columnas para rangos con nombre.
+
+    Con n días: columnas 1..n con los ejercicios de cada día, tabla de
+    ejercicios en n+3..n+7 (H-L con 5 días), tabla día → clave en n+9..n+10
+    y, en modo no volátil, la fecha de referencia en n+12.
+
+    La tabla de ejercicios sigue config["catalogo"] (ordenada con
+    clave_orden): Registro la consulta con MATCH aproximado, una búsqueda
+    binaria, y comprueba que el nombre encontrado sea el buscado.
+    """
+    config = config or configuracion()
+    ws = crear_hoja(wb, "Datos")
     ws.sheet_state = "hidden"
+    n_dias = len(config["dias"])
 
     # Fila 1: claves de día (para MATCH/INDEX desde Registro)
     # Fila 2+: ejercicios de cada día en su columna
-    for col_idx, (dia, ejercicios) in enumerate(RUTINAS.items(), start=1):
-        clave = CLAVES_DIA[dia]
+    for col_idx, (dia, ejercicios) in enumerate(config["rutinas"].items(), start=1):
+        clave = config["claves_dia"][dia]
         # Fila 1: nombre completo del día
         ws.cell(row=1, column=col_idx, value=dia)
         # Fila 2 en adelante: ejercicios
@@ -196,45 +568,301 @@ def crear_hoja_datos(wb):
         wb.defined_names.add(defn)
 
     # Fila 1 también se usa para el lookup: rango "Dias_Lookup"
-    col_end = get_column_letter(len(RUTINAS))
+    col_end = get_column_letter(n_dias)
     defn_lookup = DefinedName("Dias_Lookup", attr_text=f"Datos!$A$1:${col_end}$1")
     wb.defined_names.add(defn_lookup)
 
-    # ── Tabla de ejercicios con rangos de repeticiones (cols H-J) ──
-    # H: Nombre ejercicio, I: Reps Min, J: Reps Max
-    ws.cell(row=1, column=8, value="Ejercicio")
-    ws.cell(row=1, column=9, value="Reps Min")
-    ws.cell(row=1, column=10, value="Reps Max")
+    # ── Tabla de ejercicios con rangos de repeticiones (H-L con 5 días) ──
+    # Nombre ejercicio, Reps Min, Reps Max, Frecuencia en Registro, Id
+    c0 = n_dias + 3
+    nombre_col, min_col, max_col, frec_col = (
+        get_column_letter(c0 + i) for i in range(4))
+    for i, h in enumerate(["Ejercicio", "Reps Min", "Reps Max", "Frecuencia", "Id"]):
+        ws.cell(row=1, column=c0 + i, value=h)
+
+    catalogo = config["catalogo"]
+    last_ex_row = 1 + len(catalogo)
+
+    for i, ej in enumerate(catalogo, start=2):
+        rmin, rmax = config["reps_ranges"].get(ej, (8, 15))
+        ws.cell(row=i, column=c0, value=ej)
+        ws.cell(row=i, column=c0 + 1, value=rmin)
+        ws.cell(row=i, column=c0 + 2, value=rmax)
+        ws.cell(row=i, column=c0 + 4, value=config["ids"][ej])
+
+    # Frecuencia: una sola pasada por las posiciones ya buscadas en Registro
+    # (Reg_EjIdx) para todo el catálogo, en lugar de un COUNTIF por ejercicio
+    if catalogo:
+        rango_frec = f"{frec_col}2:{frec_col}{last_ex_row}"
+        ws.cell(row=2, column=c0 + 3, value=ArrayFormula(
+            rango_frec, "=FREQUENCY(Reg_EjIdx,ROW(Ej_Nombres)-1)"))
 
-    # Deduplicar ejercicios manteniendo orden
-    seen = set()
-    unique_exercises = []
-    for ejercicios in RUTINAS.values():
-        for ej in ejercicios:
-            if ej not in seen:
-                seen.add(ej)
-                unique_exercises.append(ej)
-
-    for i, ej in enumerate(unique_exercises, start=2):
-        rmin, rmax = REPS_RANGES.get(ej, (8, 15))
-        ws.cell(row=i, column=8, value=ej)
-        ws.cell(row=i, column=9, value=rmin)
-        ws.cell(row=i, column=10, value=rmax)
-
-    last_ex_row = 1 + len(unique_exercises)
     defn_tabla = DefinedName(
         "TablaEjercicios",
-        attr_text=f"Datos!$H$1:$J${last_ex_row}")
+        attr_text=f"Datos!${nombre_col}$1:${max_col}${last_ex_row}")
     wb.defined_names.add(defn_tabla)
 
+    # Columnas sueltas de la tabla para INDEX/MATCH desde Registro
+    for nombre, col in (("Ej_Nombres", nombre_col), ("Ej_RepsMin", min_col),
+                        ("Ej_RepsMax", max_col), ("Ej_Frecuencia", frec_col)):
+        wb.defined_names.add(DefinedName(
+            nombre, attr_text=f"Datos!${col}$2:${col}${last_ex_row}"))
+
+    # ── Tabla día → clave de rango (para I6 y la lista de B6) ─────
+    c1 = c0 + 6
+    ws.cell(row=1, column=c1, value="D\u00eda")
+    ws.cell(row=1, column=c1 + 1, value="Clave")
+    for i, dia in enumerate(config["dias"], start=2):
+        ws.cell(row=i, column=c1, value=dia)
+        ws.cell(row=i, column=c1 + 1, value=config["claves_dia"][dia])
+    for nombre, col in (("Dias_Nombres", get_column_letter(c1)),
+                        ("Dias_Claves", get_column_letter(c1 + 1))):
+        wb.defined_names.add(DefinedName(
+            nombre, attr_text=f"Datos!${col}$2:${col}${1 + n_dias}"))
+
+    if config["no_volatil"]:
+        # ── Fecha de referencia (la fija Auto_Open al abrir el libro) ──
+        c2 = c1 + 3
+        ws.cell(row=1, column=c2, value="Fecha ref.")
+        celda = ws.cell(row=2, column=c2,
+                        value=config["fecha_ref"] or datetime.date.today())
+        celda.number_format = "DD/MM/YYYY"
+        col_fecha = get_column_letter(c2)
+        wb.defined_names.add(DefinedName(
+            "Fecha_Ref", attr_text=f"Datos!${col_fecha}$2"))
+
+        # Ejercicios del día de B6: rango Datos de esa columna hasta el último
+        # ejercicio, con INDEX:INDEX en lugar de INDIRECT (no volátil)
+        max_ej = max((len(ej) for ej in config["rutinas"].values()), default=0)
+        bloque = f"Datos!$A$2:${col_end}${1 + max(max_ej, 1)}"
+        col = "MATCH(Registro!$B$6,Dias_Lookup,0)"
+        wb.defined_names.add(DefinedName(
+            "Ejercicios_Dia",
+            attr_text=(f"INDEX({bloque},1,{col}):INDEX({bloque},"
+                       f"MAX(COUNTA(INDEX({bloque},0,{col})),1),{col})")))
+
     return ws
 
 
-def crear_hoja_registro(wb):
-    """Hoja principal donde se registra cada sesión de entrenamiento."""
-    ws = wb.create_sheet("Registro")
+def formulas_auxiliares(r):
+    """
+    Fórmulas de las columnas auxiliares J-M para la fila r.
+
+    J busca el ejercicio con MATCH aproximado (búsqueda binaria sobre el
+    catálogo ordenado) y solo acepta la posición si el nombre coincide.
+    """
+    pos = f"MATCH($C{r},Ej_Nombres,1)"
+    return [
+        f'=IF($C{r}="","",IFERROR(IF(INDEX(Ej_Nombres,{pos})=$C{r},{pos},""),""))',
+        f'=IF($J{r}="","",INDEX(Ej_RepsMin,$J{r}))',
+        f'=IF($J{r}="","",INDEX(Ej_RepsMax,$J{r}))',
+        f'=IF(OR($J{r}="",$E{r}=""),"",IF($E{r}>$L{r},1,IF($E{r}<$K{r},-1,0)))',
+    ]
+
+
+def filas_historial(ws, capacidad=CAPACIDAD_HISTORIAL, historial=None):
+    """
+    Genera, fila a fila, las celdas con formato del historial.
+
+    Si se pasa `historial` (iterable de filas A-H), sus valores llenan las
+    primeras filas a medida que se consumen; el resto queda vacío.
+    Los estilos con nombre se resuelven una sola vez por columna y paridad
+    de fila; cada celda nueva solo copia el arreglo de estilo ya resuelto.
+    """
+    datos = iter(historial or ())
+    modelos = {}
+    for paridad in (0, 1):
+        estilos = [estilo_banda(paridad, "fecha")] + [estilo_banda(paridad)] * 7
+        modelos[paridad] = [aplicar_estilo(WriteOnlyCell(ws, ""), e)._style
+                            for e in estilos]
+
+    for r in range(FILA_INICIO_HISTORIAL, FILA_INICIO_HISTORIAL + capacidad):
+        valores = next(datos, None) or [""] * 8
+        fila = []
+        for estilo, valor in zip(modelos[r % 2], valores):
+            # Estilo antes que valor: una fecha en celda General registraría
+            # un formato de número que luego no se usa
+            cell = WriteOnlyCell(ws)
+            cell._style = copy(estilo)
+            cell.value = valor
+            fila.append(cell)
+        # Columna I vacía; J-M auxiliares
+        yield fila + [None] + formulas_auxiliares(r)
+
+
+def definir_rangos_registro(wb, capacidad=CAPACIDAD_HISTORIAL):
+    """
+    Rangos con nombre del historial que se ajustan a las filas con datos.
+
+    N_Registros es la celda CELDA_N_REGISTROS, que cuenta las fechas
+    registradas (ver formula_n_registros), y cada Reg_<columna> termina en
+    esa fila mediante INDEX (no volátil), así que COUNTIF/SUMIF/SUMPRODUCT
+    solo recorren filas llenas, sin importar la capacidad pre-formateada.
+    Reg_N queda como sinónimo de N_Registros.
+    """
+    fila_fin = FILA_INICIO_HISTORIAL + capacidad - 1
+    ini = FILA_INICIO_HISTORIAL
+    col_n, fila_n = coordinate_from_string(CELDA_N_REGISTROS)
+    celda_n = f"Registro!${col_n}${fila_n}"
+    wb.defined_names.add(DefinedName("Reg_Capacidad", attr_text=str(capacidad)))
+    wb.defined_names.add(DefinedName("N_Registros", attr_text=celda_n))
+    wb.defined_names.add(DefinedName("Reg_N", attr_text=celda_n))
+    for nombre, col in {**COLUMNAS_REGISTRO, **COLUMNAS_AUXILIARES}.items():
+        wb.defined_names.add(DefinedName(
+            nombre,
+            attr_text=(f"Registro!${col}${ini}:INDEX(Registro!${col}${ini}:"
+                       f"${col}${fila_fin},MAX(N_Registros,1))")))
+
+
+def formula_n_registros(capacidad=CAPACIDAD_HISTORIAL):
+    """Fórmula de CELDA_N_REGISTROS: fechas registradas en el historial."""
+    fila_fin = FILA_INICIO_HISTORIAL + capacidad - 1
+    return f"=COUNTA($A${FILA_INICIO_HISTORIAL}:$A${fila_fin})"
+
+
+# ── Índice de sesiones ────────────────────────────────────────────
+def _cantidad(valor):
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return valor
+    return 0
+
+
+def sumar_serie(sesiones, fila, signo=1):
+    """
+    Suma (o resta, con signo=-1) una fila A-H del historial a su sesión.
+
+    `sesiones` es {(fecha, rutina): [sets, reps, volumen, minutos]} en orden
+    de aparición; una sesión que se queda sin sets se elimina.
+    """
+    fecha, rutina = fila[0], fila[1]
+    if isinstance(fecha, datetime.datetime):
+        fecha = fecha.date()
+    if not isinstance(fecha, datetime.date):
+        return
+    reps, peso, descanso = (_cantidad(v) for v in fila[4:7])
+    totales = sesiones.setdefault((fecha, rutina or ""), [0, 0, 0, 0])
+    totales[0] += signo
+    totales[1] += signo * reps
+    totales[2] += signo * reps * peso
+    totales[3] = round(totales[3] + signo * descanso / 60, 2)
+    if totales[0] <= 0:
+        del sesiones[(fecha, rutina or "")]
+
+
+def indice_sesiones(filas):
+    """Índice de sesiones de unas filas A-H del historial."""
+    sesiones = {}
+    for fila in filas:
+        sumar_serie(sesiones, fila)
+    return sesiones
+
+
+def acumular_sesiones(sesiones, filas):
+    """Devuelve las filas del historial tal cual, sumándolas a `sesiones`."""
+    for fila in filas:
+        sumar_serie(sesiones, fila)
+        yield fila
+
+
+def filas_registro(ws):
+    """Filas A-H del historial de Registro, hasta la primera fila sin fecha."""
+    filas = []
+    for fila in ws.iter_rows(min_row=FILA_INICIO_HISTORIAL, max_col=8,
+                             values_only=True):
+        if fila[0] in (None, ""):
+            break
+        filas.append(list(fila))
+    return filas
+
+
+def leer_sesiones(ws):
+    """Índice guardado en una hoja Sesiones, con la forma de sumar_serie()."""
+    sesiones = {}
+    for fila in ws.iter_rows(min_row=FILA_INICIO_SESIONES, max_col=6,
+                             values_only=True):
+        if fila[0] in (None, ""):
+            break
+        fecha = fila[0].date() if isinstance(fila[0], datetime.datetime) else fila[0]
+        # Una celda de rutina vacía se lee como None; sumar_serie usa ""
+        sesiones[(fecha, fila[1] or "")] = [_cantidad(v) for v in fila[2:6]]
+    return sesiones
+
+
+def escribir_sesion(ws, i, clave, totales):
+    """Escribe la sesión i (0 = primera) en su fila de la hoja Sesiones."""
+    r = FILA_INICIO_SESIONES + i
+    set_cell(ws, r, 1, clave[0], estilo_banda(i, "fecha"))
+    for c, valor in enumerate([clave[1], *totales], start=2):
+        set_cell(ws, r, c, valor, estilo_banda(i))
+
+
+def escribir_sesiones(ws, sesiones, previas=0):
+    """Reescribe el índice completo y vacía las filas de `previas` sesiones que sobran."""
+    for i, (clave, totales) in enumerate(sesiones.items()):
+        escribir_sesion(ws, i, clave, totales)
+    for i in range(len(sesiones), previas):
+        for c in range(1, 7):
+            ws.cell(row=FILA_INICIO_SESIONES + i, column=c).value = None
+
+
+def filas_sesiones(ws, sesiones):
+    """Filas con estilo de la hoja Sesiones para un libro write-only."""
+    for i, (clave, totales) in enumerate(sesiones.items()):
+        fila = []
+        for c, valor in enumerate([clave[0], clave[1], *totales]):
+            # Estilo antes que valor, como en filas_historial
+            cell = aplicar_estilo(WriteOnlyCell(ws), estilo_banda(i, "fecha")
+                                  if c == 0 else estilo_banda(i))
+            cell.value = valor
+            fila.append(cell)
+        yield fila
+
+
+def definir_rangos_sesiones(wb, capacidad=CAPACIDAD_HISTORIAL):
+    """
+    Ses_N y los rangos Ses_<columna> del índice de sesiones.
+
+    Igual que los Reg_*: terminan en la fila Ses_N mediante INDEX. Nunca hay
+    más sesiones que series, así que la capacidad es la del historial.
+    """
+    ini = FILA_INICIO_SESIONES
+    fila_fin = ini + capacidad - 1
+    wb.defined_names.add(DefinedName(
+        "Ses_N", attr_text=f"COUNTA(Sesiones!$A${ini}:$A${fila_fin})"))
+    for nombre, col in COLUMNAS_SESIONES.items():
+        wb.defined_names.add(DefinedName(
+            nombre,
+            attr_text=(f"Sesiones!${col}${ini}:INDEX(Sesiones!${col}${ini}:"
+                       f"${col}${fila_fin},MAX(Ses_N,1))")))
+
+
+def lista_dias():
+    """
+    Origen de la validación de Día/Rutina (B6): la columna de días de Datos,
+    no una lista en línea (que Excel limita a 255 caracteres).
+    """
+    return "=Dias_Nombres"
+
+
+def formula_clave_dia():
+    """Fórmula de I6: convierte "Lunes - Pecho y Tríceps" → "Dia_Lunes"."""
+    return '=IF(B6="","",IFERROR(INDEX(Dias_Claves,MATCH(B6,Dias_Lookup,0)),""))'
+
+
+def crear_hoja_registro(wb, capacidad=CAPACIDAD_HISTORIAL, historial=None,
+                        config=None):
+    """
+    Hoja principal donde se registra cada sesión de entrenamiento.
+
+    `historial` es un iterable opcional de filas A-H con las que se llena
+    el historial al generarlo.
+    """
+    config = config or configuracion()
+    ws = crear_hoja(wb, "Registro")
+    fila_fin = FILA_INICIO_HISTORIAL + capacidad - 1
     # Move Registro to be the first visible sheet (index 0)
-    wb.move_sheet(ws, offset=-wb.sheetnames.index("Registro"))
+    wb.move_sheet("Registro", offset=-wb.sheetnames.index("Registro"))
+    definir_rangos_registro(wb, capacidad)
     ws.sheet_properties.tabColor = AZUL_MEDIO
 
     # Column widths
@@ -244,34 +872,31 @@ def crear_hoja_registro(wb):
 
     # ── Título ────────────────────────────────────────────────────
     merge_and_set(ws, 1, 1, 1, 8,
-                  "REGISTRO DE ENTRENAMIENTO EN CASA",
-                  font_titulo, fill_titulo)
+                  "REGISTRO DE ENTRENAMIENTO EN CASA", "titulo")
 
     merge_and_set(ws, 2, 1, 2, 8,
                   "Ingresa tus datos de cada sesión. Usa los botones o escribe directamente.",
-                  font_small, PatternFill("solid", fgColor=AZUL_CLARO))
+                  "nota_azul")
 
     # ── Zona de entrada rápida ────────────────────────────────────
     merge_and_set(ws, 4, 1, 4, 8,
-                  "ENTRADA RÁPIDA",
-                  font_subtit, fill_header)
+                  "ENTRADA RÁPIDA", "subtitulo")
 
     labels = ["Fecha:", "Día/Rutina:", "Ejercicio:", "Serie #:", "Reps:", "Peso (kg):", "Descanso (seg):", "Notas:"]
     for i, label in enumerate(labels, start=1):
-        set_cell(ws, 5, i, label, font_bold, fill_naranja_cl)
+        set_cell(ws, 5, i, label, "etiqueta")
 
     # Input row (row 6)
     for i in range(1, 9):
-        set_cell(ws, 6, i, "", font_normal, fill_input)
+        set_cell(ws, 6, i, "", "entrada")
 
     # Default date formula
-    ws.cell(row=6, column=1).value = '=TODAY()'
-    ws.cell(row=6, column=1).number_format = "DD/MM/YYYY"
+    set_cell(ws, 6, 1, f"={formula_hoy(config)}", "entrada_fecha")
 
     # ── Validación desplegable para Día/Rutina ────────────────────
     dv_dia = DataValidation(
         type="list",
-        formula1='"' + ",".join(DIAS_SEMANA) + '"',
+        formula1=lista_dias(),
         allow_blank=True,
     )
     dv_dia.error = "Selecciona un día válido"
@@ -285,20 +910,12 @@ def crear_hoja_registro(wb):
     # Fórmula: convierte "Lunes - Pecho y Tríceps" → "Dia_Lunes"
     ws.column_dimensions["I"].width = 0.5  # casi invisible
     ws.column_dimensions["I"].hidden = True
-    lookup_formula = (
-        '=IF(B6="","",IF(LEFT(B6,5)="Lunes","Dia_Lunes",'
-        'IF(LEFT(B6,6)="Martes","Dia_Martes",'
-        'IF(LEFT(B6,4)="Mi' + chr(233) + 'r","Dia_Miercoles",'
-        'IF(LEFT(B6,6)="Jueves","Dia_Jueves",'
-        'IF(LEFT(B6,7)="Viernes","Dia_Viernes",""))))))'
-    )
-    ws.cell(row=6, column=9, value=lookup_formula)
-    ws.cell(row=6, column=9).font = Font(color=BLANCO, size=1)
+    set_cell(ws, 6, 9, formula_clave_dia(), "auxiliar")
 
     # ── Validación desplegable dinámica para Ejercicio (C6) ──────
     dv_ejercicio = DataValidation(
         type="list",
-        formula1='=INDIRECT(I6)',
+        formula1=formula_lista_ejercicios(config),
         allow_blank=True,
     )
     dv_ejercicio.error = "Selecciona un ejercicio de la rutina"
@@ -320,63 +937,62 @@ def crear_hoja_registro(wb):
     ws.add_data_validation(dv_serie)
     dv_serie.add(ws["D6"])
 
+    # ── Columnas auxiliares ocultas (J-M) ─────────────────────────
+    # Fila 6 y cada fila del historial buscan su ejercicio una sola vez
+    for col in COLUMNAS_AUXILIARES.values():
+        ws.column_dimensions[col].hidden = True
+    for c, h in enumerate(["Idx", "Min", "Max", "Estado"], start=10):
+        ws.cell(row=11, column=c, value=h)
+    for c, formula in enumerate(formulas_auxiliares(6), start=10):
+        ws.cell(row=6, column=c, value=formula)
+    col_n, fila_n = coordinate_from_string(CELDA_N_REGISTROS)
+    ws.cell(row=fila_n, column=column_index_from_string(col_n),
+            value=formula_n_registros(capacidad))
+
     # ── Indicador de rango de reps en fila 7 ──────────────────────
     status_formula = (
-        '=IF(OR(C6="",E6=""),"",IF(ISERROR(VLOOKUP(C6,TablaEjercicios,2,FALSE)),'
-        '"",IF(E6>VLOOKUP(C6,TablaEjercicios,3,FALSE),'
+        '=IF(M6="","",IF(M6=1,'
         '"\u2B06 SUPERA RANGO - SUBE PESO",'
-        'IF(E6<VLOOKUP(C6,TablaEjercicios,2,FALSE),'
+        'IF(M6=-1,'
         '"\u2B07 BAJO RANGO - BAJA PESO",'
-        '"\u2714 EN RANGO \u00d3PTIMO"))))'
+        '"\u2714 EN RANGO \u00d3PTIMO")))'
     )
-    merge_and_set(ws, 7, 4, 7, 7, "", font_small,
-                  PatternFill("solid", fgColor=AZUL_CLARO))
-    cell_status = ws.cell(row=7, column=4)
-    cell_status.value = status_formula
-    cell_status.font = Font(name="Calibri", size=10, bold=True, color="333333")
-    cell_status.alignment = align_center
+    merge_and_set(ws, 7, 4, 7, 7, status_formula, "estado_rango")
 
     # Mostrar rango objetivo del ejercicio seleccionado
-    range_formula = (
-        '=IF(C6="","",IF(ISERROR(VLOOKUP(C6,TablaEjercicios,2,FALSE)),'
-        '"","Rango: "&VLOOKUP(C6,TablaEjercicios,2,FALSE)'
-        '&" - "&VLOOKUP(C6,TablaEjercicios,3,FALSE)&" reps"))'
-    )
-    merge_and_set(ws, 7, 1, 7, 3, "", font_small,
-                  PatternFill("solid", fgColor=AZUL_CLARO))
-    cell_range = ws.cell(row=7, column=1)
-    cell_range.value = range_formula
-    cell_range.font = Font(name="Calibri", size=10, italic=True, color="555555")
-    cell_range.alignment = align_center
+    range_formula = '=IF(J6="","","Rango: "&K6&" - "&L6&" reps")'
+    merge_and_set(ws, 7, 1, 7, 3, range_formula, "rango_objetivo")
 
     # ── Botones de acción (celdas con texto + macro asignada via VBA) ──
     merge_and_set(ws, 8, 2, 8, 3,
-                  "▶ REGISTRAR ENTRADA",
-                  font_btn, fill_verde)
+                  "▶ REGISTRAR ENTRADA", "boton_verde")
     merge_and_set(ws, 8, 5, 8, 6,
-                  "✕ LIMPIAR CAMPOS",
-                  font_btn, fill_naranja)
+                  "✕ LIMPIAR CAMPOS", "boton_naranja")
     merge_and_set(ws, 8, 7, 8, 8,
-                  "⟳ DESHACER ÚLTIMO",
-                  font_btn, fill_rojo)
+                  "⟳ DESHACER ÚLTIMO", "boton_rojo")
 
     # ── Encabezados del historial ─────────────────────────────────
     merge_and_set(ws, 10, 1, 10, 8,
-                  "HISTORIAL DE ENTRENAMIENTOS",
-                  font_subtit, fill_titulo)
+                  "HISTORIAL DE ENTRENAMIENTOS", "subtitulo_oscuro")
 
     headers = ["Fecha", "D\u00eda / Rutina", "Ejercicio", "Serie #",
                "Reps", "Peso (kg)", "Descanso (s)", "Notas"]
     for i, h in enumerate(headers, start=1):
-        set_cell(ws, 11, i, h, font_header, fill_header)
-
-    # Rows 12-200 pre-formatted for data
-    for r in range(12, 201):
-        fill = fill_alt1 if r % 2 == 0 else fill_alt2
-        for c in range(1, 9):
-            cell = set_cell(ws, r, c, "", font_normal, fill)
-            if c == 1:
-                cell.number_format = "DD/MM/YYYY"
+        set_cell(ws, 11, i, h, "encabezado")
+
+    # Filas del historial pre-formateadas para datos
+    if isinstance(ws, HojaStreaming):
+        ws.filas_generadas = (FILA_INICIO_HISTORIAL,
+                              filas_historial(ws.hoja, capacidad, historial))
+    else:
+        datos = iter(historial or ())
+        for r in range(FILA_INICIO_HISTORIAL, fila_fin + 1):
+            valores = next(datos, None) or [""] * 8
+            set_cell(ws, r, 1, valores[0], estilo_banda(r, "fecha"))
+            for c in range(2, 9):
+                set_cell(ws, r, c, valores[c - 1], estilo_banda(r))
+            for c, formula in enumerate(formulas_auxiliares(r), start=10):
+                ws.cell(row=r, column=c, value=formula)
 
     # ── Formato condicional: alertas de rango de reps ─────────────
     # Rojo: reps superan el máximo → hay que subir peso
@@ -384,50 +1000,47 @@ def crear_hoja_registro(wb):
         start_color="FFCCCC", end_color="FFCCCC", fill_type="solid")
     font_alert_high = Font(name="Calibri", size=11, bold=True, color="CC0000")
     rule_high = FormulaRule(
-        formula=['AND(E12<>"",NOT(ISERROR(VLOOKUP($C12,TablaEjercicios,3,FALSE))),'
-                 'E12>VLOOKUP($C12,TablaEjercicios,3,FALSE))'],
+        formula=['$M12=1'],
         fill=fill_alert_high,
         font=font_alert_high,
     )
-    ws.conditional_formatting.add("E12:E200", rule_high)
+    ws.conditional_formatting.add(f"E12:E{fila_fin}", rule_high)
 
     # Amarillo: reps por debajo del mínimo → considerar bajar peso
     fill_alert_low = PatternFill(
         start_color="FFF3CD", end_color="FFF3CD", fill_type="solid")
     font_alert_low = Font(name="Calibri", size=11, bold=True, color="856404")
     rule_low = FormulaRule(
-        formula=['AND(E12<>"",NOT(ISERROR(VLOOKUP($C12,TablaEjercicios,2,FALSE))),'
-                 'E12<VLOOKUP($C12,TablaEjercicios,2,FALSE))'],
+        formula=['$M12=-1'],
         fill=fill_alert_low,
         font=font_alert_low,
     )
-    ws.conditional_formatting.add("E12:E200", rule_low)
+    ws.conditional_formatting.add(f"E12:E{fila_fin}", rule_low)
 
     # Verde: reps dentro del rango óptimo
     fill_ok = PatternFill(
         start_color="D4EDDA", end_color="D4EDDA", fill_type="solid")
     font_ok = Font(name="Calibri", size=11, color="155724")
     rule_ok = FormulaRule(
-        formula=['AND(E12<>"",NOT(ISERROR(VLOOKUP($C12,TablaEjercicios,2,FALSE))),'
-                 'E12>=VLOOKUP($C12,TablaEjercicios,2,FALSE),'
-                 'E12<=VLOOKUP($C12,TablaEjercicios,3,FALSE))'],
+        formula=['$M12=0'],
         fill=fill_ok,
         font=font_ok,
     )
-    ws.conditional_formatting.add("E12:E200", rule_ok)
+    ws.conditional_formatting.add(f"E12:E{fila_fin}", rule_ok)
 
     # ── Freeze panes ──────────────────────────────────────────────
     ws.freeze_panes = "A12"
 
     # ── Auto-filter ───────────────────────────────────────────────
-    ws.auto_filter.ref = "A11:H200"
+    ws.auto_filter.ref = f"A11:H{fila_fin}"
 
     return ws
 
 
-def crear_hoja_rutinas(wb):
+def crear_hoja_rutinas(wb, config=None):
     """Hoja con las rutinas predefinidas por día."""
-    ws = wb.create_sheet("Rutinas")
+    config = config or configuracion()
+    ws = crear_hoja(wb, "Rutinas")
     ws.sheet_properties.tabColor = VERDE
 
     ws.column_dimensions["A"].width = 6
@@ -439,35 +1052,34 @@ def crear_hoja_rutinas(wb):
     ws.column_dimensions["G"].width = 14
 
     merge_and_set(ws, 1, 1, 1, 7,
-                  "RUTINAS SEMANALES - ENTRENAMIENTO EN CASA",
-                  font_titulo, fill_titulo)
+                  "RUTINAS SEMANALES - ENTRENAMIENTO EN CASA", "titulo")
 
     merge_and_set(ws, 2, 1, 2, 7,
                   "Personaliza tus rutinas aqu\u00ed. Ajusta los rangos de reps "
                   "para recibir alertas autom\u00e1ticas.",
-                  font_small, PatternFill("solid", fgColor=VERDE_CLARO))
+                  "nota_verde")
 
     row = 4
-    for dia, ejercicios in RUTINAS.items():
-        merge_and_set(ws, row, 1, row, 7, dia, font_subtit, fill_header)
+    for dia, ejercicios in config["rutinas"].items():
+        merge_and_set(ws, row, 1, row, 7, dia, "subtitulo")
         row += 1
 
         sub_headers = ["#", "Ejercicio", "Grupo Muscular",
                        "Series Obj.", "Reps Min", "Reps Max", "Peso Obj. (kg)"]
         for i, h in enumerate(sub_headers, start=1):
-            set_cell(ws, row, i, h, font_header, fill_verde)
+            set_cell(ws, row, i, h, "encabezado_verde")
         row += 1
 
         for idx, ej in enumerate(ejercicios, start=1):
-            fill = fill_alt1 if idx % 2 == 0 else fill_alt2
-            rmin, rmax = REPS_RANGES.get(ej, (8, 15))
-            set_cell(ws, row, 1, idx, font_normal, fill)
-            set_cell(ws, row, 2, ej, font_normal, fill, align_left)
-            set_cell(ws, row, 3, "", font_normal, fill)       # Grupo muscular
-            set_cell(ws, row, 4, "", font_normal, fill)       # Series obj
-            set_cell(ws, row, 5, rmin, font_normal, fill)     # Reps Min
-            set_cell(ws, row, 6, rmax, font_normal, fill)     # Reps Max
-            set_cell(ws, row, 7, "", font_normal, fill)       # Peso obj
+            estilo = estilo_banda(idx)
+            rmin, rmax = config["reps_ranges"].get(ej, (8, 15))
+            set_cell(ws, row, 1, idx, estilo)
+            set_cell(ws, row, 2, ej, estilo_banda(idx, "izq"))
+            set_cell(ws, row, 3, "", estilo)       # Grupo muscular
+            set_cell(ws, row, 4, "", estilo)       # Series obj
+            set_cell(ws, row, 5, rmin, estilo)     # Reps Min
+            set_cell(ws, row, 6, rmax, estilo)     # Reps Max
+            set_cell(ws, row, 7, "", estilo)       # Peso obj
             row += 1
 
         row += 1  # espacio entre días
@@ -475,10 +1087,148 @@ def crear_hoja_rutinas(wb):
     return ws
 
 
-def crear_hoja_dashboard(wb):
-    """Dashboard visual con KPIs, gráficos e insights de progreso."""
-    ws = wb.create_sheet("Dashboard")
+# ── Subexpresiones compartidas del Dashboard ──────────────────────
+# Una agregación que aparece en varias fórmulas del Dashboard se calcula una
+# sola vez en una celda auxiliar con nombre (columnas R-S ocultas) y las
+# fórmulas visibles leen esa celda: Excel la evalúa una vez por recálculo.
+COLUMNA_AUXILIARES = 18     # R: nombre, S: fórmula
+
+# Funciones cuyo resultado merece una celda propia si se repite (recorren
+# rangos o son volátiles). INDEX/OFFSET no: pueden devolver referencias.
+FUNCIONES_COMPARTIBLES = {
+    "AGGREGATE", "AVERAGE", "AVERAGEIF", "AVERAGEIFS", "COUNT", "COUNTA",
+    "COUNTBLANK", "COUNTIF", "COUNTIFS", "MATCH", "MAX", "MAXIFS", "MIN",
+    "MINIFS", "NOW", "SUM", "SUMIF", "SUMIFS", "SUMPRODUCT", "TODAY",
+}
+
+# Nombres definidos como fórmula (se evalúan en cada uso), no como rango
+NOMBRES_CALCULADOS = ("Ses_N",)
+
+# Nombre de la celda auxiliar de las subexpresiones conocidas; las demás
+# se llaman Aux_1, Aux_2...
+NOMBRES_AUXILIARES = {
+    "Ses_N":                  "N_Sesiones",
+    "COUNTIF(Reg_Estado,1)":  "N_Sobre",
+    "COUNTIF(Reg_Estado,-1)": "N_Bajo",
+    "MAX(Reg_Peso)":          "Peso_Max",
+    "MAX(Ses_Fecha)":         "Ultima_Sesion",
+    "MAX(Ej_Frecuencia)":     "Frecuencia_Max",
+    "TODAY()":                "Hoy",
+}
+
+
+def subexpresiones(formula):
+    """
+    (inicio, fin, texto) de las subexpresiones compartibles de `formula`:
+    llamadas a FUNCIONES_COMPARTIBLES y usos de NOMBRES_CALCULADOS,
+    ordenadas de derecha a izquierda para poder reemplazarlas en el sitio.
+    """
+    encontradas, abiertas, pos = [], [], 1
+    for tok in Tokenizer(formula).items:
+        inicio, pos = pos, pos + len(tok.value)
+        if tok.type == Token.FUNC and tok.subtype == Token.OPEN:
+            abiertas.append((inicio, tok.value[:-1].upper()))
+        elif tok.type == Token.FUNC and tok.subtype == Token.CLOSE:
+            abre, funcion = abiertas.pop()
+            if funcion in FUNCIONES_COMPARTIBLES:
+                encontradas.append((abre, pos, formula[abre:pos]))
+        elif tok.type == Token.OPERAND and tok.value in NOMBRES_CALCULADOS:
+            encontradas.append((inicio, pos, tok.value))
+    return sorted(encontradas, reverse=True)
+
+
+def compartir_subexpresiones(formulas, minimo=2):
+    """
+    Saca a celdas auxiliares las subexpresiones que se repiten en `formulas`.
+
+    `formulas` ({clave: fórmula}) se reescribe en el sitio para que lea las
+    celdas auxiliares. Se comparte primero la subexpresión repetida más
+    larga, así una agregación que contiene a otra se calcula entera una vez;
+    las de las celdas auxiliares también cuentan. Devuelve {nombre: fórmula}
+    de las auxiliares, en el orden en que se crearon.
+    """
+    auxiliares = {}
+    while True:
+        usos = Counter(texto
+                       for formula in (*formulas.values(), *auxiliares.values())
+                       for _, _, texto in subexpresiones(formula))
+        repetidas = [texto for texto, n in usos.items() if n >= minimo]
+        if not repetidas:
+            return auxiliares
+        elegida = max(repetidas, key=lambda texto: (len(texto), usos[texto], texto))
+        nombre = NOMBRES_AUXILIARES.get(elegida, f"Aux_{len(auxiliares) + 1}")
+
+        def reemplazar(formula):
+            for inicio, fin, texto in subexpresiones(formula):
+                if texto == elegida:
+                    formula = formula[:inicio] + nombre + formula[fin:]
+            return formula
+
+        for clave, formula in formulas.items():
+            formulas[clave] = reemplazar(formula)
+        for otro, formula in auxiliares.items():
+            auxiliares[otro] = reemplazar(formula)
+        auxiliares[nombre] = f"={elegida}"
+
+
+def escribir_auxiliar(wb, ws, fila, nombre, formula, number_format=None):
+    """Celda auxiliar del Dashboard: nombre en R, fórmula en S con nombre definido."""
+    ws.cell(row=fila, column=COLUMNA_AUXILIARES, value=nombre)
+    cell = ws.cell(row=fila, column=COLUMNA_AUXILIARES + 1, value=formula)
+    if number_format:
+        cell.number_format = number_format
+    letra = get_column_letter(COLUMNA_AUXILIARES + 1)
+    wb.defined_names.add(DefinedName(
+        nombre, attr_text=f"{ws.title}!${letra}${fila}"))
+
+
+def compartir_formulas_dashboard(wb, ws, fila):
+    """
+    Reescribe las fórmulas ya escritas en `ws` con compartir_subexpresiones
+    y escribe las auxiliares desde `fila`. Devuelve la fila siguiente.
+    """
+    celdas = (ws._celdas.values() if isinstance(ws, HojaStreaming)
+              else ws._cells.values())
+    formulas = {cell.coordinate: cell.value for cell in celdas
+                if isinstance(cell.value, str) and cell.value.startswith("=")}
+    auxiliares = compartir_subexpresiones(formulas)
+    for coordenada, formula in formulas.items():
+        ws[coordenada].value = formula
+    for nombre, formula in auxiliares.items():
+        escribir_auxiliar(wb, ws, fila, nombre, formula)
+        fila += 1
+    return fila
+
+
+def crear_hoja_dashboard(wb, capacidad=CAPACIDAD_HISTORIAL, metricas=None,
+                         config=None):
+    """
+    Dashboard visual con KPIs, gráficos e insights de progreso.
+
+    Con `metricas` (ver analitica.calcular_metricas) el Dashboard se escribe
+    en modo precalculado: valores estáticos con la fecha de cálculo en lugar
+    de fórmulas que Excel recalcula en cada edición.
+
+    Las filas indicadas en los comentarios son las de 5 días; con más días
+    todo lo que está debajo del volumen por día baja `d` filas.
+
+    El gráfico de peso no lee el historial crudo sino la serie agregada de
+    las columnas ocultas N-P: como máximo config["puntos_grafico"] puntos
+    con el peso máximo y medio de cada tramo de fechas.
+
+    Las agregaciones repetidas (COUNTIF(Reg_Estado,1)...) se calculan
+    una vez en las celdas auxiliares con nombre de las columnas ocultas R-S
+    (ver compartir_subexpresiones).
+    """
+    config = config or configuracion()
+    # Nombres de las celdas auxiliares de un Dashboard anterior
+    for nombre, defn in list(wb.defined_names.items()):
+        if defn.attr_text.startswith("Dashboard!"):
+            del wb.defined_names[nombre]
+    ws = crear_hoja(wb, "Dashboard")
     ws.sheet_properties.tabColor = NARANJA
+    n_dias = len(config["dias"])
+    d = max(0, n_dias - 5)
 
     # ── Column widths ──────────────────────────────────────────────
     ws.column_dimensions["A"].width = 2       # spacer
@@ -491,58 +1241,54 @@ def crear_hoja_dashboard(wb):
     for letter in ["H", "I", "J", "K", "L"]:
         ws.column_dimensions[letter].width = 12
 
-    # Fuentes especiales para KPIs
-    font_kpi_label = Font(name="Calibri", size=9, bold=True, color=BLANCO)
-    font_kpi_value = Font(name="Calibri", size=22, bold=True, color=BLANCO)
-    font_section   = Font(name="Calibri", size=12, bold=True, color=BLANCO)
-
     # ══════════════════════════════════════════════════════════════
     # TÍTULO
     # ══════════════════════════════════════════════════════════════
     merge_and_set(ws, 1, 1, 1, 12,
-                  "DASHBOARD DE ENTRENAMIENTO",
-                  font_titulo, fill_titulo)
-    merge_and_set(ws, 2, 1, 2, 12,
-                  "Resumen visual de tu progreso. Los datos se actualizan "
-                  "autom\u00e1ticamente desde la hoja Registro.",
-                  font_small, PatternFill("solid", fgColor=NARANJA_CL))
+                  "DASHBOARD DE ENTRENAMIENTO", "titulo")
+    if metricas is None:
+        nota = ("Resumen visual de tu progreso. Los datos se actualizan "
+                "autom\u00e1ticamente desde la hoja Registro.")
+    else:
+        nota = ("Valores precalculados el "
+                f"{metricas['calculado']:%d/%m/%Y %H:%M}. No se actualizan "
+                "solos: vuelve a precalcular tras registrar nuevas series.")
+    merge_and_set(ws, 2, 1, 2, 12, nota, "nota_naranja")
 
     # ══════════════════════════════════════════════════════════════
     # KPI CARDS  (row 4-7)
     # ══════════════════════════════════════════════════════════════
     merge_and_set(ws, 4, 1, 4, 12,
-                  "M\u00c9TRICAS CLAVE", font_section, fill_header)
+                  "M\u00c9TRICAS CLAVE", "subtitulo")
 
     kpis = [
         ("Total Sesiones",
-         '=COUNTA(Registro!A12:A200)',
-         None, VERDE),
+         '=Ses_N',
+         None, "verde"),
         ("\u00daltimo Entreno",
-         '=IF(COUNTA(Registro!A12:A200)>0,MAX(Registro!A12:A200),"-")',
-         "DD/MM/YYYY", AZUL_MEDIO),
+         '=IF(Ses_N>0,MAX(Ses_Fecha),"-")',
+         "DD/MM/YYYY", "azul"),
         ("Peso M\u00e1x (kg)",
-         '=IF(MAX(Registro!F12:F200)>0,MAX(Registro!F12:F200),"-")',
-         "0.0", NARANJA),
+         '=IF(MAX(Reg_Peso)>0,MAX(Reg_Peso),"-")',
+         "0.0", "naranja"),
         ("Prom. Reps",
-         '=IFERROR(ROUND(AVERAGE(Registro!E12:E200),1),"-")',
-         "0.0", AZUL_OSCURO),
+         '=IFERROR(ROUND(AVERAGE(Reg_Reps),1),"-")',
+         "0.0", "oscuro"),
         ("Total Sets",
-         '=IFERROR(COUNTA(Registro!D12:D200),"-")',
-         "#,##0", ROJO),
+         '=IFERROR(SUM(Ses_Sets),"-")',
+         "#,##0", "rojo"),
     ]
 
     col_starts = [2, 4, 6, 8, 10]
     for idx, (label, formula, num_fmt, color) in enumerate(kpis):
         c = col_starts[idx]
-        fill_kpi = PatternFill("solid", fgColor=color)
+        if metricas is not None:
+            formula = metricas["kpis"][idx]
         # Label row
-        merge_and_set(ws, 5, c, 5, c + 1, label, font_kpi_label, fill_kpi)
+        merge_and_set(ws, 5, c, 5, c + 1, label, f"kpi_etiqueta_{color}")
         # Value row (2 rows tall)
-        merge_and_set(ws, 6, c, 7, c + 1, "", font_kpi_value, fill_kpi)
+        merge_and_set(ws, 6, c, 7, c + 1, formula, f"kpi_valor_{color}")
         cell = ws.cell(row=6, column=c)
-        cell.value = formula
-        cell.font = font_kpi_value
-        cell.alignment = align_center
         if num_fmt:
             cell.number_format = num_fmt
 
@@ -550,34 +1296,34 @@ def crear_hoja_dashboard(wb):
     # VOLUMEN POR DÍA  (rows 9-15)  — left side
     # ══════════════════════════════════════════════════════════════
     merge_and_set(ws, 9, 2, 9, 6,
-                  "VOLUMEN POR D\u00cdA DE RUTINA", font_section, fill_header)
+                  "VOLUMEN POR D\u00cdA DE RUTINA", "subtitulo")
 
-    vol_headers = ["D\u00eda", "Sets", "Total Reps", "Reps Prom.", "Peso Prom."]
+    vol_headers = ["D\u00eda", "Sesiones", "Sets", "Total Reps", "Volumen (kg)"]
     for i, h in enumerate(vol_headers):
-        set_cell(ws, 10, 2 + i, h, font_header, fill_verde)
+        set_cell(ws, 10, 2 + i, h, "encabezado_verde")
 
-    for i, dia in enumerate(DIAS_SEMANA):
+    for i, dia in enumerate(config["dias"]):
         r = 11 + i
-        fill = fill_alt1 if i % 2 == 0 else fill_alt2
+        estilo = estilo_banda(i)
         short = dia.split(" - ")[0]
-        set_cell(ws, r, 2, short, font_bold, fill, align_left)
-        # Sets = count of rows for this day
+        set_cell(ws, r, 2, short, estilo_banda(i, "negrita_izq"))
+        if metricas is not None:
+            for c, valor in enumerate(metricas["por_dia"][dia], start=3):
+                set_cell(ws, r, c, valor, estilo)
+            continue
+        # Todo sale del índice de sesiones, no de las series de Registro
         set_cell(ws, r, 3,
-                 f'=COUNTIF(Registro!B$12:B$200,"{dia}")',
-                 font_normal, fill)
-        # Total reps
+                 f'=COUNTIF(Ses_Rutina,"{dia}")',
+                 estilo)
         set_cell(ws, r, 4,
-                 f'=SUMIF(Registro!B$12:B$200,"{dia}",Registro!E$12:E$200)',
-                 font_normal, fill)
-        # Avg reps per set
+                 f'=SUMIF(Ses_Rutina,"{dia}",Ses_Sets)',
+                 estilo)
         set_cell(ws, r, 5,
-                 f'=IFERROR(AVERAGEIF(Registro!B$12:B$200,"{dia}",'
-                 f'Registro!E$12:E$200),0)',
-                 font_normal, fill)
+                 f'=SUMIF(Ses_Rutina,"{dia}",Ses_Reps)',
+                 estilo)
         set_cell(ws, r, 6,
-                 f'=IFERROR(AVERAGEIF(Registro!B$12:B$200,"{dia}",'
-                 f'Registro!F$12:F$200),0)',
-                 font_normal, fill)
+                 f'=SUMIF(Ses_Rutina,"{dia}",Ses_Volumen)',
+                 estilo)
 
     # ── Gráfico de barras: Sesiones por Día ────────────────────────
     chart_bar = BarChart()
@@ -588,8 +1334,8 @@ def crear_hoja_dashboard(wb):
     chart_bar.x_axis.delete = False
     chart_bar.legend = None
 
-    data_bar = Reference(ws, min_col=3, min_row=10, max_row=15)
-    cats_bar = Reference(ws, min_col=2, min_row=11, max_row=15)
+    data_bar = Reference(ws, min_col=3, min_row=10, max_row=10 + n_dias)
+    cats_bar = Reference(ws, min_col=2, min_row=11, max_row=10 + n_dias)
     chart_bar.add_data(data_bar, titles_from_data=True)
     chart_bar.set_categories(cats_bar)
     chart_bar.width = 20
@@ -603,45 +1349,48 @@ def crear_hoja_dashboard(wb):
     # ══════════════════════════════════════════════════════════════
     # INSIGHTS  (rows 17-24)  — left side
     # ══════════════════════════════════════════════════════════════
-    merge_and_set(ws, 17, 2, 17, 6,
-                  "INSIGHTS", font_section, fill_titulo)
+    merge_and_set(ws, 17 + d, 2, 17 + d, 6,
+                  "INSIGHTS", "subtitulo_oscuro")
 
+    hoy = formula_hoy(config)
     insights = [
         ("D\u00edas sin entrenar",
-         '=IF(COUNTA(Registro!A12:A200)>0,'
-         'TODAY()-MAX(Registro!A12:A200),"-")'),
+         f'=IF(Ses_N>0,{hoy}-MAX(Ses_Fecha),"-")'),
         ("Sesiones esta semana",
-         '=COUNTIFS(Registro!A12:A200,">="&(TODAY()-WEEKDAY(TODAY(),2)+1),'
-         'Registro!A12:A200,"<="&TODAY())'),
+         f'=COUNTIFS(Ses_Fecha,">="&({hoy}-WEEKDAY({hoy},2)+1),'
+         f'Ses_Fecha,"<="&{hoy})'),
         ("Sesiones este mes",
-         '=COUNTIFS(Registro!A12:A200,">="&DATE(YEAR(TODAY()),MONTH(TODAY()),1),'
-         'Registro!A12:A200,"<="&TODAY())'),
+         f'=COUNTIFS(Ses_Fecha,">="&DATE(YEAR({hoy}),MONTH({hoy}),1),'
+         f'Ses_Fecha,"<="&{hoy})'),
         ("Ejercicio m\u00e1s frecuente",
-         '=IFERROR(INDEX(Registro!C12:C200,MATCH(MAX(COUNTIF(Registro!C12:C200,'
-         'Registro!C12:C200)),COUNTIF(Registro!C12:C200,Registro!C12:C200),0)),"-")'),
+         '=IF(MAX(Ej_Frecuencia)>0,INDEX(Ej_Nombres,'
+         'MATCH(MAX(Ej_Frecuencia),Ej_Frecuencia,0)),"-")'),
         ("Total reps acumuladas",
-         '=IFERROR(SUM(Registro!E12:E200),"-")'),
+         '=IFERROR(SUM(Ses_Reps),"-")'),
         ("Reps max en 1 set",
-         '=IFERROR(MAX(Registro!E12:E200),"-")'),
+         '=IFERROR(MAX(Reg_Reps),"-")'),
     ]
 
+    if config["no_volatil"]:
+        # Fila 24: a qué fecha se refieren los insights
+        insights.append(("Fecha de referencia", "=Fecha_Ref"))
+
     for i, (label, formula) in enumerate(insights):
-        r = 18 + i
-        fill = fill_alt1 if i % 2 == 0 else fill_alt2
-        set_cell(ws, r, 2, label, font_bold, fill, align_left)
-        merge_and_set(ws, r, 3, r, 6, "", font_normal, fill)
-        cell = ws.cell(row=r, column=3)
-        cell.value = formula
-        cell.font = font_bold
-        cell.alignment = align_center
+        r = 18 + d + i
+        if metricas is not None:
+            formula = metricas["insights"][i]
+        set_cell(ws, r, 2, label, estilo_banda(i, "negrita_izq"))
+        merge_and_set(ws, r, 3, r, 6, formula, estilo_banda(i, "negrita"))
+        if label == "Fecha de referencia":
+            ws.cell(row=r, column=3).number_format = "DD/MM/YYYY"
 
     # ── Gráfico circular: Distribución ─────────────────────────────
     chart_pie = PieChart()
     chart_pie.title = "Distribuci\u00f3n por Rutina"
     chart_pie.style = 10
 
-    data_pie = Reference(ws, min_col=3, min_row=10, max_row=15)
-    cats_pie = Reference(ws, min_col=2, min_row=11, max_row=15)
+    data_pie = Reference(ws, min_col=3, min_row=10, max_row=10 + n_dias)
+    cats_pie = Reference(ws, min_col=2, min_row=11, max_row=10 + n_dias)
     chart_pie.add_data(data_pie, titles_from_data=True)
     chart_pie.set_categories(cats_pie)
     chart_pie.width = 20
@@ -653,94 +1402,142 @@ def crear_hoja_dashboard(wb):
     chart_pie.dataLabels.showVal = False
 
     colors_pie = [AZUL_MEDIO, VERDE, NARANJA, ROJO, AZUL_OSCURO]
-    for i, color in enumerate(colors_pie):
+    for i in range(n_dias):
         pt = DataPoint(idx=i)
-        pt.graphicalProperties.solidFill = color
+        pt.graphicalProperties.solidFill = colors_pie[i % len(colors_pie)]
         chart_pie.series[0].data_points.append(pt)
 
-    ws.add_chart(chart_pie, "H22")
+    ws.add_chart(chart_pie, f"H{22 + d}")
 
     # ══════════════════════════════════════════════════════════════
     # ALERTAS DE PROGRESO  (rows 26-30)  — left side
     # ══════════════════════════════════════════════════════════════
-    fill_alert_section = PatternFill("solid", fgColor=ROJO)
-    merge_and_set(ws, 26, 2, 26, 6,
-                  "\u26a0 ALERTAS DE PROGRESO", font_section, fill_alert_section)
+    merge_and_set(ws, 26 + d, 2, 26 + d, 6,
+                  "\u26a0 ALERTAS DE PROGRESO", "subtitulo_alerta")
 
     alertas = [
         ("Registros SOBRE rango (subir peso)",
-         '=IFERROR(SUMPRODUCT((Registro!E12:E200<>"")'
-         '*NOT(ISERROR(VLOOKUP(Registro!C12:C200,TablaEjercicios,3,FALSE)))'
-         '*(Registro!E12:E200>VLOOKUP(Registro!C12:C200,TablaEjercicios,3,FALSE))),0)'),
+         '=COUNTIF(Reg_Estado,1)'),
         ("Registros BAJO rango (bajar peso)",
-         '=IFERROR(SUMPRODUCT((Registro!E12:E200<>"")'
-         '*NOT(ISERROR(VLOOKUP(Registro!C12:C200,TablaEjercicios,2,FALSE)))'
-         '*(Registro!E12:E200<VLOOKUP(Registro!C12:C200,TablaEjercicios,2,FALSE))),0)'),
+         '=COUNTIF(Reg_Estado,-1)'),
         ("% en rango \u00f3ptimo",
-         '=IFERROR(TEXT(1-((SUMPRODUCT((Registro!E12:E200<>"")'
-         '*NOT(ISERROR(VLOOKUP(Registro!C12:C200,TablaEjercicios,3,FALSE)))'
-         '*(Registro!E12:E200>VLOOKUP(Registro!C12:C200,TablaEjercicios,3,FALSE)))'
-         '+SUMPRODUCT((Registro!E12:E200<>"")'
-         '*NOT(ISERROR(VLOOKUP(Registro!C12:C200,TablaEjercicios,2,FALSE)))'
-         '*(Registro!E12:E200<VLOOKUP(Registro!C12:C200,TablaEjercicios,2,FALSE))))'
-         '/MAX(COUNTA(Registro!E12:E200),1)),"0%"),"-")'),
+         '=IFERROR(TEXT(1-((COUNTIF(Reg_Estado,1)+COUNTIF(Reg_Estado,-1))'
+         '/MAX(N_Registros,1)),"0%"),"-")'),
     ]
 
     for i, (label, formula) in enumerate(alertas):
-        r = 27 + i
-        fill = fill_alt1 if i % 2 == 0 else fill_alt2
-        set_cell(ws, r, 2, label, font_bold, fill, align_left)
-        merge_and_set(ws, r, 3, r, 6, "", font_normal, fill)
-        cell = ws.cell(row=r, column=3)
-        cell.value = formula
-        cell.font = font_bold
-        cell.alignment = align_center
+        r = 27 + d + i
+        if metricas is not None:
+            formula = metricas["alertas"][i]
+        set_cell(ws, r, 2, label, estilo_banda(i, "negrita_izq"))
+        merge_and_set(ws, r, 3, r, 6, formula, estilo_banda(i, "negrita"))
 
     # ══════════════════════════════════════════════════════════════
     # ÚLTIMOS 10 REGISTROS  (rows 31-42)
     # ══════════════════════════════════════════════════════════════
-    merge_and_set(ws, 31, 2, 31, 6,
-                  "\u00daLTIMOS 10 REGISTROS", font_section, fill_titulo)
+    merge_and_set(ws, 31 + d, 2, 31 + d, 6,
+                  "\u00daLTIMOS 10 REGISTROS", "subtitulo_oscuro")
 
     last_headers = ["Fecha", "Rutina", "Ejercicio", "Reps", "Peso (kg)"]
     for i, h in enumerate(last_headers):
-        set_cell(ws, 32, 2 + i, h, font_header, fill_verde)
+        set_cell(ws, 32 + d, 2 + i, h, "encabezado_verde")
 
+    # INDEX sobre la columna completa: con el rango dinámico (Reg_Fecha...)
+    # cada celda volvería a contar el historial para delimitarlo
+    fila_fin = FILA_INICIO_HISTORIAL + capacidad - 1
     for i in range(10):
-        r = 33 + i
-        fill = fill_alt1 if i % 2 == 0 else fill_alt2
-        for c in range(2, 7):
-            set_cell(ws, r, c, "", font_normal, fill)
-        cols_map = {2: "A", 3: "B", 4: "C", 5: "E", 6: "F"}
-        for c, col_letter in cols_map.items():
-            formula = (f'=IFERROR(INDEX(Registro!{col_letter}$12:'
-                       f'{col_letter}$200,COUNTA(Registro!A$12:A$200)-{i}),"")')
-            ws.cell(row=r, column=c).value = formula
-            if c == 2:
-                ws.cell(row=r, column=c).number_format = "DD/MM/YYYY"
+        r = 33 + d + i
+        cols_map = {2: "Reg_Fecha", 3: "Reg_Rutina", 4: "Reg_Ejercicio",
+                    5: "Reg_Reps", 6: "Reg_Peso"}
+        for c, nombre in cols_map.items():
+            col = COLUMNAS_REGISTRO[nombre]
+            rango = f"Registro!${col}${FILA_INICIO_HISTORIAL}:${col}${fila_fin}"
+            if metricas is not None:
+                formula = metricas["ultimos"][i][c - 2]
+            else:
+                formula = f'=IF(N_Registros>{i},IFERROR(INDEX({rango},N_Registros-{i}),""),"")'
+            set_cell(ws, r, c, formula,
+                     estilo_banda(i, "fecha") if c == 2 else estilo_banda(i))
+
+    # ══════════════════════════════════════════════════════════════
+    # SERIE DEL GRÁFICO DE PESO  (columnas N-P ocultas, filas 10-70)
+    # ══════════════════════════════════════════════════════════════
+    # El rango de fechas registrado se divide en `puntos` tramos iguales y
+    # cada fila resume uno: peso máximo y medio de sus series. Con pocas
+    # fechas cada tramo es una sesión; con muchas, varios días o semanas.
+    puntos = config["puntos_grafico"]
+    wb.defined_names.add(DefinedName("Graf_Puntos", attr_text=str(puntos)))
+
+    for c, h in enumerate(["Fecha", "Peso m\u00e1x.", "Peso prom."], start=14):
+        set_cell(ws, 10, c, h, "encabezado_verde")
+        ws.column_dimensions[get_column_letter(c)].hidden = True
+    for c, h in enumerate(["Auxiliar", "Valor"], start=COLUMNA_AUXILIARES):
+        set_cell(ws, 10, c, h, "encabezado_verde")
+        ws.column_dimensions[get_column_letter(c)].hidden = True
+    if metricas is None:
+        # Inicio y ancho de los tramos en celdas: cada fila de la serie los
+        # lee cinco veces
+        escribir_auxiliar(wb, ws, 11, "Graf_Inicio", "=MIN(Reg_Fecha)",
+                          "DD/MM/YYYY")
+        escribir_auxiliar(wb, ws, 12, "Graf_Ancho",
+                          "=(MAX(Reg_Fecha)-Graf_Inicio+1)/Graf_Puntos")
+
+    for k in range(puntos):
+        r = 11 + k
+        if metricas is not None:
+            valores = metricas["serie_peso"][k]
+        else:
+            desde = f"(Graf_Inicio+{k}*Graf_Ancho)"
+            hasta = f"(Graf_Inicio+{k + 1}*Graf_Ancho)"
+            valores = (
+                f'=IF(N_Registros=0,"",ROUNDUP({desde},0))',
+                f"=IF(N_Registros=0,NA(),IFERROR(AGGREGATE(14,6,Reg_Peso/"
+                f"((Reg_Fecha>={desde})*(Reg_Fecha<{hasta})),1),NA()))",
+                f'=IF(N_Registros=0,NA(),IFERROR(AVERAGEIFS(Reg_Peso,'
+                f'Reg_Fecha,">="&{desde},Reg_Fecha,"<"&{hasta}),NA()))',
+            )
+        set_cell(ws, r, 14, valores[0], estilo_banda(k, "fecha"))
+        for c, valor in enumerate(valores[1:], start=15):
+            set_cell(ws, r, c, valor, estilo_banda(k)).number_format = "0.0"
 
     # ══════════════════════════════════════════════════════════════
-    # GRÁFICO DE LÍNEA: Peso por sesión  (from Registro)
+    # GRÁFICO DE LÍNEA: Peso por sesión  (serie agregada N-P)
     # ══════════════════════════════════════════════════════════════
-    ws_reg = wb["Registro"]
     chart_line = LineChart()
     chart_line.title = "Peso Levantado por Sesi\u00f3n"
     chart_line.y_axis.title = "Peso (kg)"
-    chart_line.x_axis.title = "Entrada"
+    chart_line.x_axis.title = "Fecha"
+    chart_line.x_axis.number_format = "DD/MM"
+    chart_line.x_axis.delete = False
     chart_line.style = 10
-    chart_line.legend = None
+    chart_line.legend.position = "b"
     chart_line.width = 20
     chart_line.height = 12
+    # Tramos sin series (#N/A o vacíos): unir los puntos vecinos
+    chart_line.display_blanks = "span"
+    # La serie está en las columnas ocultas N-P: sin esto Excel la dibuja vacía
+    chart_line.visible_cells_only = False
 
-    data_line = Reference(ws_reg, min_col=6, min_row=11, max_row=200)
+    data_line = Reference(ws, min_col=15, max_col=16, min_row=10, max_row=10 + puntos)
+    cats_line = Reference(ws, min_col=14, min_row=11, max_row=10 + puntos)
     chart_line.add_data(data_line, titles_from_data=True)
+    chart_line.set_categories(cats_line)
 
-    series_line = chart_line.series[0]
-    series_line.graphicalProperties.line.solidFill = VERDE
-    series_line.graphicalProperties.line.width = 22000
-    series_line.smooth = True
+    for series_line, color in zip(chart_line.series, [VERDE, AZUL_MEDIO]):
+        series_line.graphicalProperties.line.solidFill = color
+        series_line.graphicalProperties.line.width = 22000
+        series_line.smooth = True
 
-    ws.add_chart(chart_line, "H41")
+    ws.add_chart(chart_line, f"H{41 + d}")
+
+    # Peso máximo por mes de los meses archivados, si el libro ya rotó
+    grafico_historico(wb, ws, f"H{FILA_GRAFICO_HISTORICO + d}")
+
+    # ══════════════════════════════════════════════════════════════
+    # CELDAS AUXILIARES  (columnas R-S ocultas, desde la fila 13)
+    # ══════════════════════════════════════════════════════════════
+    if metricas is None:
+        compartir_formulas_dashboard(wb, ws, 13)
 
     # ── Freeze panes ───────────────────────────────────────────────
     ws.freeze_panes = "A4"
@@ -748,17 +1545,62 @@ def crear_hoja_dashboard(wb):
     return ws
 
 
-def crear_hoja_instrucciones(wb):
+def _ancla(chart):
+    """Celda de la esquina superior izquierda de un gráfico (nuevo o leído)."""
+    if isinstance(chart.anchor, str):
+        return chart.anchor
+    marcador = chart.anchor._from
+    return f"{get_column_letter(marcador.col + 1)}{marcador.row + 1}"
+
+
+def grafico_historico(wb, ws, ancla):
+    """
+    Gráfico del peso máximo por mes de la hoja Historico, en `ancla` de `ws`.
+
+    Reemplaza el que hubiera en esa celda (un Dashboard leído de un libro ya
+    rotado lo trae). Sin hoja Historico o sin meses archivados no añade nada.
+    """
+    ws._charts = [c for c in ws._charts if _ancla(c) != ancla]
+    if "Historico" not in wb.sheetnames:
+        return None
+    ws_hist = wb["Historico"]
+    meses = 0
+    while ws_hist.cell(row=FILA_INICIO_HISTORICO + meses, column=2).value not in (None, ""):
+        meses += 1
+    if not meses:
+        return None
+    ultima = FILA_INICIO_HISTORICO + meses - 1
+
+    chart = LineChart()
+    chart.title = "Peso Máximo por Mes"
+    chart.y_axis.title = "Peso (kg)"
+    chart.x_axis.title = "Mes"
+    chart.x_axis.delete = False
+    chart.style = 10
+    chart.legend = None
+    chart.width = 20
+    chart.height = 12
+    chart.add_data(Reference(ws_hist, min_col=5, min_row=FILA_INICIO_HISTORICO - 1,
+                             max_row=ultima), titles_from_data=True)
+    chart.set_categories(Reference(ws_hist, min_col=2, min_row=FILA_INICIO_HISTORICO,
+                                   max_row=ultima))
+    chart.series[0].graphicalProperties.line.solidFill = AZUL_MEDIO
+    chart.series[0].graphicalProperties.line.width = 22000
+    ws.add_chart(chart, ancla)
+    return chart
+
+
+def crear_hoja_instrucciones(wb, config=None):
     """Hoja con instrucciones de uso."""
-    ws = wb.create_sheet("Instrucciones")
+    config = config or configuracion()
+    ws = crear_hoja(wb, "Instrucciones")
     ws.sheet_properties.tabColor = "95A5A6"
 
     ws.column_dimensions["A"].width = 5
     ws.column_dimensions["B"].width = 80
 
     merge_and_set(ws, 1, 1, 1, 2,
-                  "INSTRUCCIONES DE USO",
-                  font_titulo, fill_titulo)
+                  "INSTRUCCIONES DE USO", "titulo")
 
     instrucciones = [
         ("HOJA 'REGISTRO'", [
@@ -773,7 +1615,8 @@ def crear_hoja_instrucciones(wb):
             "8. Usa '\u2715 LIMPIAR CAMPOS' o '\u27f3 DESHACER \u00daLTIMO' seg\u00fan necesites.",
         ]),
         ("HOJA 'RUTINAS'", [
-            "Rutinas predefinidas para 5 d\u00edas con rangos de repeticiones \u00f3ptimas.",
+            f"Rutinas predefinidas para {len(config['dias'])} d\u00edas con rangos "
+            "de repeticiones \u00f3ptimas.",
             "Columnas Reps Min y Reps Max definen el rango ideal por ejercicio.",
             "Si superas Reps Max consistentemente, es hora de SUBIR PESO.",
             "Puedes editar los rangos para personalizar tus objetivos.",
@@ -787,6 +1630,11 @@ def crear_hoja_instrucciones(wb):
             "Secci\u00f3n de insights: d\u00edas sin entrenar, sesiones semanales/mensuales.",
             "Los \u00faltimos 10 registros se muestran al final.",
         ]),
+        ("HOJA 'SESIONES'", [
+            "Una fila por sesi\u00f3n (fecha + rutina) con sus sets, reps, volumen y duraci\u00f3n.",
+            "Se actualiza sola al registrar o deshacer con los botones; no la edites a mano.",
+            "La duraci\u00f3n es la suma de los descansos registrados en la sesi\u00f3n.",
+        ]),
         ("SISTEMA DE ALERTAS", [
             "Cada ejercicio tiene un rango \u00f3ptimo de repeticiones (Reps Min - Reps Max).",
             "VERDE en la columna Reps = est\u00e1s dentro del rango \u00f3ptimo.",
@@ -804,17 +1652,50 @@ def crear_hoja_instrucciones(wb):
 
     row = 3
     for titulo, lineas in instrucciones:
-        merge_and_set(ws, row, 1, row, 2, titulo, font_subtit, fill_header)
+        merge_and_set(ws, row, 1, row, 2, titulo, "subtitulo")
         row += 1
         for linea in lineas:
-            set_cell(ws, row, 1, "•", font_normal, fill_alt1)
-            set_cell(ws, row, 2, linea, font_normal, fill_alt1, align_left)
+            set_cell(ws, row, 1, "•", "fila_par")
+            set_cell(ws, row, 2, linea, "fila_par_izq")
             row += 1
         row += 1
 
     return ws
 
 
+def crear_hoja_sesiones(wb, capacidad=CAPACIDAD_HISTORIAL, sesiones=None):
+    """
+    Índice de sesiones: una fila por (fecha, rutina) del historial.
+
+    Los KPIs y gráficos del Dashboard leen esta tabla (Ses_*) en lugar de
+    recorrer todas las series de Registro. `sesiones` tiene la forma de
+    sumar_serie(); en streaming las filas se generan al volcar la hoja, que
+    va después de Registro, así que puede llenarse mientras se escribe el
+    historial. RegistrarEntrada y DeshacerUltimo la mantienen en Excel.
+    """
+    sesiones = {} if sesiones is None else sesiones
+    ws = crear_hoja(wb, "Sesiones")
+    ws.sheet_properties.tabColor = AZUL_OSCURO
+    definir_rangos_sesiones(wb, capacidad)
+
+    col_widths = {1: 14, 2: 30, 3: 10, 4: 12, 5: 14, 6: 16}
+    for c, w in col_widths.items():
+        ws.column_dimensions[get_column_letter(c)].width = w
+
+    headers = ["Fecha", "D\u00eda / Rutina", "Sets", "Total Reps",
+               "Volumen (kg)", "Duraci\u00f3n (min)"]
+    for c, h in enumerate(headers, start=1):
+        set_cell(ws, 1, c, h, "encabezado")
+
+    if isinstance(ws, HojaStreaming):
+        ws.filas_generadas = (FILA_INICIO_SESIONES, filas_sesiones(ws.hoja, sesiones))
+    else:
+        escribir_sesiones(ws, sesiones)
+
+    ws.freeze_panes = "A2"
+    return ws
+
+
 # ── Código VBA para los botones ───────────────────────────────────
 VBA_CODE = '''
 Attribute VB_Name = "ModEntrenamiento"
@@ -827,13 +1708,16 @@ Sub RegistrarEntrada()
     Set wsReg = ThisWorkbook.Sheets("Registro")
 
     ' Buscar la siguiente fila vacía en el historial (desde fila 12)
+    Dim filaFin As Long
+    filaFin = 11 + wsReg.Evaluate("Reg_Capacidad")
+
     Dim nextRow As Long
     nextRow = 12
     Do While wsReg.Cells(nextRow, 1).Value <> ""
         nextRow = nextRow + 1
-        If nextRow > 200 Then
-            MsgBox "El historial esta lleno (200 registros). " & _
-                   "Copia los datos a otro archivo para continuar.", _
+        If nextRow > filaFin Then
+            MsgBox "El historial esta lleno (" & (filaFin - 11) & " registros). " & _
+                   "Archiva los meses anteriores con rotar_historial.py para continuar.", _
                    vbExclamation, "Historial lleno"
             Exit Sub
         End If
@@ -851,10 +1735,15 @@ Sub RegistrarEntrada()
     For col = 1 To 8
         wsReg.Cells(nextRow, col).Value = wsReg.Cells(6, col).Value
     Next col
+    ' Serie nueva: sin id del almacén SQLite (columna I)
+    wsReg.Cells(nextRow, 9).Value = ""
 
     ' Formatear la fecha
     wsReg.Cells(nextRow, 1).NumberFormat = "DD/MM/YYYY"
 
+    ' Sumar la serie a su sesión en la hoja Sesiones
+    ActualizarSesion wsReg, nextRow, 1
+
     ' Auto-incrementar Serie # y limpiar reps/peso (mantener ejercicio y dia)
     Dim serieActual As Variant
     serieActual = wsReg.Cells(6, 4).Value
@@ -925,8 +1814,10 @@ Sub DeshacerUltimo()
                   vbYesNo + vbQuestion, "Confirmar")
 
     If resp = vbYes Then
+        ActualizarSesion wsReg, lastRow, -1
         Dim col As Integer
-        For col = 1 To 8
+        ' Hasta la columna I: el id del almacén no debe pasar a la próxima serie
+        For col = 1 To 9
             wsReg.Cells(lastRow, col).Value = ""
         Next col
         MsgBox "Ultimo registro eliminado.", vbInformation, "Deshecho"
@@ -934,6 +1825,87 @@ Sub DeshacerUltimo()
 End Sub
 
 
+' ============================================================
+' Índice de sesiones: una fila por (fecha, rutina) en la hoja Sesiones
+' ============================================================
+' signo = 1 suma a su sesión la serie de la fila `fila` del historial;
+' signo = -1 la resta y quita la sesión si se queda sin sets.
+Sub ActualizarSesion(wsReg As Worksheet, fila As Long, signo As Integer)
+    Dim wsSes As Worksheet
+    On Error Resume Next  ' libros anteriores sin hoja Sesiones
+    Set wsSes = ThisWorkbook.Sheets("Sesiones")
+    On Error GoTo 0
+    If wsSes Is Nothing Then Exit Sub
+
+    Dim fecha As Variant, rutina As String
+    fecha = wsReg.Cells(fila, 1).Value
+    rutina = wsReg.Cells(fila, 2).Value
+
+    Dim ultima As Long
+    ultima = 1
+    Do While wsSes.Cells(ultima + 1, 1).Value <> ""
+        ultima = ultima + 1
+    Loop
+
+    ' Buscar desde el final: las series nuevas suelen ir a la última sesión
+    Dim r As Long
+    For r = ultima To 2 Step -1
+        If wsSes.Cells(r, 1).Value = fecha And wsSes.Cells(r, 2).Value = rutina Then Exit For
+    Next r
+    If r < 2 Then
+        If signo < 0 Then Exit Sub
+        r = ultima + 1
+        ultima = r
+        wsSes.Cells(r, 1).Value = fecha
+        wsSes.Cells(r, 1).NumberFormat = "DD/MM/YYYY"
+        wsSes.Cells(r, 2).Value = rutina
+    End If
+
+    Dim reps As Double, peso As Double
+    reps = Numero(wsReg.Cells(fila, 5).Value)
+    peso = Numero(wsReg.Cells(fila, 6).Value)
+    wsSes.Cells(r, 3).Value = Numero(wsSes.Cells(r, 3).Value) + signo
+    wsSes.Cells(r, 4).Value = Numero(wsSes.Cells(r, 4).Value) + signo * reps
+    wsSes.Cells(r, 5).Value = Numero(wsSes.Cells(r, 5).Value) + signo * reps * peso
+    wsSes.Cells(r, 6).Value = Round(Numero(wsSes.Cells(r, 6).Value) + _
+                                    signo * Numero(wsReg.Cells(fila, 7).Value) / 60, 2)
+
+    ' Sesión sin sets: subir las siguientes para no dejar huecos
+    If wsSes.Cells(r, 3).Value <= 0 Then
+        Dim k As Long
+        For k = r To ultima - 1
+            wsSes.Range(wsSes.Cells(k, 1), wsSes.Cells(k, 6)).Value = _
+                wsSes.Range(wsSes.Cells(k + 1, 1), wsSes.Cells(k + 1, 6)).Value
+        Next k
+        wsSes.Range(wsSes.Cells(ultima, 1), wsSes.Cells(ultima, 6)).ClearContents
+    End If
+End Sub
+
+Function Numero(valor As Variant) As Double
+    If IsNumeric(valor) And Not IsEmpty(valor) Then Numero = CDbl(valor)
+End Function
+
+
+' ============================================================
+' MACRO: Al abrir el libro, fijar la fecha de referencia
+' ============================================================
+' En los libros generados sin funciones volátiles, las fechas del Dashboard
+' y la fecha por defecto de la entrada se calculan contra Fecha_Ref en
+' lugar de TODAY(). Se actualiza una sola vez al abrir.
+Sub Auto_Open()
+    ActualizarFechaRef
+End Sub
+
+Sub ActualizarFechaRef()
+    Dim rng As Range
+    On Error Resume Next  ' libro generado con TODAY(): no hay Fecha_Ref
+    Set rng = ThisWorkbook.Names("Fecha_Ref").RefersToRange
+    On Error GoTo 0
+    If rng Is Nothing Then Exit Sub
+    If rng.Value <> Date Then rng.Value = Date
+End Sub
+
+
 ' ============================================================
 ' MACRO: Cargar ejercicios de la rutina seleccionada
 ' ============================================================
@@ -988,35 +1960,646 @@ End Sub
 '''
 
 
-def main():
-    wb = openpyxl.Workbook()
+# ── Importación masiva de historiales (CSV / JSONL) ───────────────
+TAMANO_LOTE  = 1000
+TROZO_JSON   = 1 << 16      # caracteres leídos por vez de un array .json
+MAX_ERRORES_REPORTADOS = 50
+
+
+def _registros_json(f, trozo=TROZO_JSON):
+    """
+    Itera los elementos de un array JSON leyendo `f` por trozos.
+
+    Solo se mantiene en memoria el elemento en curso (y lo que quede del
+    trozo). Un elemento que no se puede leer se entrega como ValueError y
+    la lectura termina: tras un error de sintaxis no se puede seguir.
+    """
+    decodificador = json.JSONDecoder()
+    buffer, fin = "", False
+
+    def leer():
+        nonlocal buffer, fin
+        mas = f.read(trozo)
+        fin = not mas
+        buffer += mas
+
+    while not fin and not buffer.lstrip():
+        leer()
+    buffer = buffer.lstrip()
+    if not buffer.startswith("["):
+        yield 1, ValueError("se esperaba un array JSON de registros")
+        return
+    buffer = buffer[1:]
+    num, coma = 0, False
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer:
+            if fin:
+                yield num + 1, ValueError("array JSON sin cerrar")
+                return
+            leer()
+            continue
+        if buffer[0] == "]":
+            return
+        if coma:
+            if buffer[0] != ",":
+                yield num + 1, ValueError("JSON inválido: falta una coma; el resto no se leyó")
+                return
+            buffer, coma = buffer[1:], False
+            continue
+        try:
+            registro, pos = decodificador.raw_decode(buffer)
+        except json.JSONDecodeError as e:
+            if fin:
+                yield num + 1, ValueError(f"JSON inválido: {e.msg}; el resto no se leyó")
+                return
+            leer()
+            continue
+        # Un número al final del trozo puede seguir en el siguiente
+        if pos == len(buffer) and not fin:
+            leer()
+            continue
+        num += 1
+        yield num, registro
+        buffer, coma = buffer[pos:], True
+
+
+def leer_log(ruta):
+    """
+    Itera un export CSV, JSONL o JSON como pares (número de línea, registro).
+
+    Un .json es un array de registros (el número es su posición) y se lee
+    por trozos, como los demás formatos. Un registro que no se puede leer
+    se entrega como la excepción en lugar del registro, para que el
+    llamador lo cuente como rechazado y siga.
+    """
+    with open(ruta, encoding="utf-8", newline="") as f:
+        if ruta.lower().endswith(".json"):
+            yield from _registros_json(f)
+        elif ruta.lower().endswith((".jsonl", ".ndjson")):
+            for num, linea in enumerate(f, start=1):
+                if linea.strip():
+                    try:
+                        yield num, json.loads(linea)
+                    except json.JSONDecodeError as e:
+                        yield num, ValueError(f"JSON inválido: {e.msg}")
+        else:
+            lector = csv.DictReader(f)
+            for registro in lector:
+                yield lector.line_num, registro
+
+
+def _parse_fecha(valor):
+    if isinstance(valor, datetime.datetime):
+        return valor
+    if isinstance(valor, datetime.date):
+        return datetime.datetime.combine(valor, datetime.time())
+    texto = str(valor or "").strip()
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.datetime.strptime(texto, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"fecha inválida: {valor!r}")
+
+
+def _parse_numero(registro, campo, tipo, obligatorio=False):
+    valor = registro.get(campo)
+    if valor is None or str(valor).strip() == "":
+        if obligatorio:
+            raise ValueError(f"falta el campo '{campo}'")
+        return ""
+    try:
+        numero = float(str(valor).strip().replace(",", "."))
+    except ValueError:
+        raise ValueError(f"{campo} inválido: {valor!r}") from None
+    if tipo is int:
+        if not numero.is_integer():
+            raise ValueError(f"{campo} inválido: {valor!r}")
+        return int(numero)
+    return numero
+
+
+def validar_serie(registro, config=None):
+    """
+    Convierte un registro del log en una fila de Registro (columnas A-H).
+
+    La rutina debe existir en las rutinas de `config` (RUTINAS por defecto)
+    y el ejercicio en esa rutina o en sus rangos de reps; si no, lanza
+    ValueError con el motivo.
+    """
+    config = config or configuracion()
+    rutina = str(registro.get("rutina") or "").strip()
+    ejercicio = str(registro.get("ejercicio") or "").strip()
+    if rutina not in config["rutinas"]:
+        raise ValueError(f"rutina desconocida: {rutina!r}")
+    if (ejercicio not in config["rutinas"][rutina]
+            and ejercicio not in config["reps_ranges"]):
+        raise ValueError(f"ejercicio desconocido: {ejercicio!r}")
+
+    return [
+        _parse_fecha(registro.get("fecha")),
+        rutina,
+        ejercicio,
+        _parse_numero(registro, "serie", int),
+        _parse_numero(registro, "reps", int, obligatorio=True),
+        _parse_numero(registro, "peso", float),
+        _parse_numero(registro, "descanso", int),
+        str(registro.get("notas") or ""),
+    ]
+
+
+def _filas_validas(ruta_log, resumen, config=None):
+    """Filas válidas del log; las inválidas solo se cuentan en `resumen`."""
+    config = config or configuracion()
+    for num, registro in leer_log(ruta_log):
+        try:
+            if isinstance(registro, ValueError):
+                raise registro
+            if not isinstance(registro, dict):
+                raise ValueError("el registro no es un objeto")
+            fila = validar_serie(registro, config)
+        except (ValueError, TypeError, AttributeError) as e:
+            resumen["rechazadas"] += 1
+            if len(resumen["errores"]) < MAX_ERRORES_REPORTADOS:
+                resumen["errores"].append(f"línea {num}: {e}")
+            continue
+        resumen["importadas"] += 1
+        yield fila
+
+
+def _en_lotes(iterable, tamano):
+    it = iter(iterable)
+    while True:
+        lote = list(islice(it, tamano))
+        if not lote:
+            return
+        yield lote
+
+
+def cargar_libro(ruta):
+    """
+    Carga un libro existente para modificarlo y volver a guardarlo.
+
+    Un .xlsm se carga con keep_vba: sin él openpyxl lo guarda sin el
+    proyecto VBA y con el tipo de contenido de un .xlsx, y Excel lo rechaza.
+    """
+    return openpyxl.load_workbook(ruta, keep_vba=ruta.lower().endswith(".xlsm"))
+
+
+def capacidad_libro(wb):
+    """Capacidad del historial guardada en el libro (Reg_Capacidad)."""
+    if "Reg_Capacidad" in wb.defined_names:
+        return int(wb.defined_names["Reg_Capacidad"].attr_text)
+    return CAPACIDAD_HISTORIAL
+
+
+def puntos_grafico_libro(wb):
+    """Puntos de la serie del gráfico de peso guardados en el libro (Graf_Puntos)."""
+    if "Graf_Puntos" in wb.defined_names:
+        return int(wb.defined_names["Graf_Puntos"].attr_text)
+    return PUNTOS_GRAFICO
+
+
+def importar_historial(ruta_log, ruta_xlsx, capacidad=CAPACIDAD_HISTORIAL,
+                       tamano_lote=TAMANO_LOTE, config=None):
+    """
+    Vuelca un export CSV/JSONL/JSON de series en el historial de Registro.
+
+    Si `ruta_xlsx` no existe se genera un libro nuevo en modo streaming con
+    el historial ya lleno y `capacidad` filas; las series que no caben se
+    cuentan como rechazadas. Si existe, las filas se agregan tras el último
+    registro, lote a lote. En ambos casos el log se lee una sola vez y solo
+    se mantiene en memoria un lote.
+
+    Las series se validan contra `config`; sin ella, un libro existente usa
+    la configuración de su hoja Datos y uno nuevo la plantilla del módulo.
+
+    Devuelve un resumen con filas importadas, rechazadas y los primeros errores.
+    """
+    resumen = {"importadas": 0, "rechazadas": 0, "errores": []}
+
+    if not os.path.exists(ruta_xlsx):
+        config = config or configuracion()
+        filas = _filas_validas(ruta_log, resumen, config)
+        wb = construir_libro(streaming=True, capacidad=capacidad,
+                             historial=islice(filas, capacidad), config=config)
+        wb.save(ruta_xlsx)
+        # El libro write-only ya consumió lo que cabía: el resto se cuenta
+        sobrantes = sum(1 for _ in filas)
+        if sobrantes:
+            resumen["importadas"] -= sobrantes
+            resumen["rechazadas"] += sobrantes
+            resumen["errores"].append(
+                f"{sobrantes} series no caben en la capacidad ({capacidad}); "
+                "usa --capacidad para un libro más grande")
+        return resumen
+
+    wb = cargar_libro(ruta_xlsx)
+    agregar_series(wb, _filas_validas(ruta_log, resumen,
+                                      config or configuracion_libro(wb)),
+                   tamano_lote)
+    wb.save(ruta_xlsx)
+    return resumen
+
+
+def agregar_series(wb, filas, tamano_lote=TAMANO_LOTE):
+    """
+    Agrega las filas A-H de `filas` tras el último registro del historial.
+
+    Las filas se consumen lote a lote; si un lote no cabe en la capacidad
+    del libro se lanza ValueError sin escribirlo. Las filas escritas quedan
+    sin id del almacén (COLUMNA_ID): son series nuevas. El índice de
+    Sesiones se actualiza solo en las sesiones que reciben series. No guarda
+    el libro. Devuelve el número de filas agregadas.
+    """
+    ws = wb["Registro"]
+    fila_fin = FILA_INICIO_HISTORIAL + capacidad_libro(wb) - 1
+
+    siguiente = FILA_INICIO_HISTORIAL
+    while ws.cell(row=siguiente, column=1).value not in (None, ""):
+        siguiente += 1
+    primera = siguiente
+
+    # Índice de sesiones (libros anteriores pueden no tenerlo): solo se
+    # reescriben las sesiones que reciben series nuevas
+    ws_ses = wb["Sesiones"] if "Sesiones" in wb.sheetnames else None
+    sesiones = leer_sesiones(ws_ses) if ws_ses is not None else {}
+    tocadas = set()
+
+    for lote in _en_lotes(filas, tamano_lote):
+        if siguiente + len(lote) - 1 > fila_fin:
+            raise ValueError(
+                f"El historial está lleno ({fila_fin - FILA_INICIO_HISTORIAL + 1} "
+                "registros). Genera el libro con más capacidad.")
+        for valores in lote:
+            for c, valor in enumerate(valores, start=1):
+                ws.cell(row=siguiente, column=c).value = valor
+            ws.cell(row=siguiente, column=COLUMNA_ID).value = None
+            siguiente += 1
+            sumar_serie(sesiones, valores)
+            tocadas.add((valores[0].date(), valores[1]))
+
+    if ws_ses is not None:
+        for i, (clave, totales) in enumerate(sesiones.items()):
+            if clave in tocadas:
+                escribir_sesion(ws_ses, i, clave, totales)
+    return siguiente - primera
+
+
+# ── Actualización de libros existentes ───────────────────────────
+# Hojas que se generan solo a partir de RUTINAS, REPS_RANGES y el diseño
+# (Sesiones, a partir del historial); Registro guarda los datos del usuario
+# y nunca se regenera.
+HOJAS_DERIVADAS = ("Datos", "Rutinas", "Dashboard", "Instrucciones", "Sesiones")
+
+
+def actualizar_libro(ruta, config=None, capacidad=None, huella=None):
+    """
+    Regenera las hojas derivadas de un libro existente sin tocar el historial.
+
+    Datos, Rutinas, Dashboard e Instrucciones se borran y se vuelven a crear
+    con `config` o la plantilla actual (respetando la capacidad guardada en
+    Reg_Capacidad); Sesiones se recalcula desde el historial. De Registro
+    solo se refrescan las celdas de entrada que dependen de la configuración
+    (listas de B6 y C6, fórmulas de A6 e I6), el conteo de CELDA_N_REGISTROS
+    y los rangos Reg_*; las filas del historial no se modifican. El libro se guarda en un temporal y se reemplaza al final,
+    así que un fallo a mitad de camino no deja el archivo a medias.
+
+    El historial no se redimensiona: con `capacidad` distinta de la del
+    libro se lanza ValueError. `huella` (ver huella_generacion) queda en
+    docProps; sin ella se borra la que tuviera el libro.
+    """
+    wb = cargar_libro(ruta)
+    if "Registro" not in wb.sheetnames:
+        raise ValueError(f"{ruta} no tiene hoja Registro; no es un libro de entrenamiento")
+    # Los ejercicios que ya estaban conservan su id (ver asignar_ids)
+    ids = configuracion_libro(wb)["ids"] if "Datos" in wb.sheetnames else None
+    # Sin config se conserva el modo (con o sin funciones volátiles) del libro
+    if config is None:
+        config = configuracion(no_volatil="Fecha_Ref" in wb.defined_names,
+                               puntos_grafico=puntos_grafico_libro(wb), ids=ids)
+    else:
+        config = {**config, "ids": asignar_ids(config["ejercicios"], ids)}
+    orden = wb.sheetnames
+    if capacidad is not None and capacidad != capacidad_libro(wb):
+        raise ValueError(
+            f"{ruta} tiene capacidad para {capacidad_libro(wb)} registros, no {capacidad}: "
+            "el historial existente no se redimensiona")
+    capacidad = capacidad_libro(wb)
+
+    for titulo in HOJAS_DERIVADAS:
+        if titulo in wb.sheetnames:
+            del wb[titulo]
+    # Rangos de la hoja Datos anterior (un día eliminado deja su Dia_* huérfano)
+    for nombre in [n for n, d in wb.defined_names.items()
+                   if "Datos!" in d.attr_text]:
+        del wb.defined_names[nombre]
+
+    crear_hoja_datos(wb, config)
+    crear_hoja_rutinas(wb, config)
+    crear_hoja_dashboard(wb, capacidad, config=config)
+    crear_hoja_instrucciones(wb, config)
+    ws = wb["Registro"]
+    crear_hoja_sesiones(wb, capacidad, indice_sesiones(filas_registro(ws)))
+
+    for dv in ws.data_validations.dataValidation:
+        if "B6" in dv.sqref:
+            dv.formula1 = lista_dias()
+        elif "C6" in dv.sqref:
+            dv.formula1 = formula_lista_ejercicios(config)
+    ws["I6"].value = formula_clave_dia()
+    # Libros anteriores contaban la columna A en cada uso de Reg_N
+    ws[CELDA_N_REGISTROS] = formula_n_registros(capacidad)
+    definir_rangos_registro(wb, capacidad)
+    if isinstance(ws["A6"].value, str) and ws["A6"].value.startswith("="):
+        ws["A6"].value = f"={formula_hoy(config)}"
+
+    # Mismo orden de hojas que el libro original; las nuevas al final
+    wb._sheets.sort(key=lambda hoja: orden.index(hoja.title)
+                    if hoja.title in orden else len(orden))
+    wb.active = wb.sheetnames.index("Registro")
+    wb.properties.identifier = huella
+
+    temporal = ruta + ".tmp"
+    try:
+        wb.save(temporal)
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return wb.sheetnames
+
+
+# ── Salida determinista y caché de generación ────────────────────
+# Un libro generado depende solo de su configuración, su capacidad, los
+# estilos, VBA_CODE y el código del generador (MODULOS_GENERADORES). Con
+# la misma huella el .xlsx sale byte a byte igual (fechas de docProps
+# fijas, entradas del zip en orden y con fecha fija), y la huella queda en
+# el dc:identifier de docProps/core.xml para saltarse la generación si no
+# cambió nada.
+FECHA_DETERMINISTA = "2000-01-01T00:00:00Z"     # created/modified de docProps
+_FECHA_ZIP = (1980, 1, 1, 0, 0, 0)
+# Partes que van primero en el zip; el resto, por nombre
+_PRIMERAS_PARTES = ("[Content_Types].xml", "_rels/.rels")
+_RE_FECHA_CORE = re.compile(r"(<dcterms:(?:created|modified)[^>]*>)[^<]*")
+_RE_IDENTIFICADOR = re.compile(r"<dc:identifier>[^<]*</dc:identifier>|<dc:identifier/>")
+
+
+# Módulos cuyo código cambia los bytes de un libro generado (están junto a
+# este): plantillas clona el paquete, xlsx_directo escribe el historial y
+# evaluador guarda los valores en caché
+MODULOS_GENERADORES = ("generar_excel.py", "plantillas.py", "xlsx_directo.py",
+                       "evaluador.py")
+
+
+@functools.lru_cache(maxsize=None)
+def version_generador():
+    """Versión del generador: hash del código de MODULOS_GENERADORES."""
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha256()
+    for nombre in MODULOS_GENERADORES:
+        with open(os.path.join(directorio, nombre), "rb") as f:
+            codigo = f.read()
+        h.update(f"{nombre}\0{len(codigo)}\0".encode("utf-8"))
+        h.update(codigo)
+    return h.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _firma_recursos():
+    # Estilos y VBA no cambian dentro de un proceso: se serializan una vez
+    datos = repr(sorted(ESTILOS.items())) + VBA_CODE
+    return hashlib.sha256(datos.encode("utf-8")).hexdigest()
+
+
+def huella_generacion(config, capacidad=CAPACIDAD_HISTORIAL, modo="normal"):
+    """
+    Hash de todo lo que determina el libro de `config` y `capacidad`.
+
+    Entran la configuración efectiva (rutinas, reps, claves de día,
+    catálogo e ids), la capacidad, los estilos, VBA_CODE y la versión del
+    generador (una `fecha_ref` explícita incluida: sin ella la macro
+    Auto_Open pone al día Fecha_Ref, así que la fecha de generación no
+    cambia la huella). `modo` ("normal", "streaming",
+    "plantilla") distingue las vías de generación: dan el mismo contenido
+    pero no los mismos bytes (p. ej. el orden de los estilos). El sufijo
+    "+valores" marca los libros guardados con valores en caché.
+    """
+    datos = json.dumps(
+        {"version": version_generador(), "recursos": _firma_recursos(),
+         "config": config, "capacidad": capacidad, "modo": modo},
+        sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(datos.encode("utf-8")).hexdigest()
+
+
+def core_determinista(xml, huella=None):
+    """docProps/core.xml con fechas fijas y `huella` como dc:identifier."""
+    xml = _RE_FECHA_CORE.sub(lambda m: m.group(1) + FECHA_DETERMINISTA, xml)
+    xml = _RE_IDENTIFICADOR.sub("", xml)
+    if huella:
+        xml = xml.replace("</cp:coreProperties>",
+                          f"<dc:identifier>{huella}</dc:identifier></cp:coreProperties>")
+    return xml
+
+
+def _orden_partes(nombre):
+    if nombre in _PRIMERAS_PARTES:
+        return (0, _PRIMERAS_PARTES.index(nombre), "")
+    return (1, 0, nombre)
+
+
+def escribir_zip_determinista(ruta, partes, huella=None):
+    """
+    Escribe `partes` ({nombre: bytes}) como un .xlsx reproducible.
+
+    Las entradas van en orden estable y con fecha fija; docProps/core.xml
+    se normaliza con core_determinista. Se escribe en un temporal y se
+    reemplaza al final.
+    """
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    try:
+        with zipfile.ZipFile(temporal, "w", zipfile.ZIP_DEFLATED) as z:
+            for nombre in sorted(partes, key=_orden_partes):
+                datos = partes[nombre]
+                if nombre == "docProps/core.xml":
+                    datos = core_determinista(datos.decode("utf-8"), huella).encode("utf-8")
+                info = zipfile.ZipInfo(nombre, _FECHA_ZIP)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0o600 << 16
+                z.writestr(info, datos)
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+
+def guardar_determinista(wb, ruta, huella=None):
+    """Guarda `wb` en `ruta` como .xlsx reproducible con `huella` en docProps."""
+    temporal = f"{ruta}.{os.getpid()}.openpyxl.tmp"
+    try:
+        wb.save(temporal)
+        with zipfile.ZipFile(temporal) as z:
+            partes = {nombre: z.read(nombre) for nombre in z.namelist()}
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    escribir_zip_determinista(ruta, partes, huella)
+
+
+def huella_libro(ruta):
+    """dc:identifier de un .xlsx ya generado, o None si no hay o no se lee."""
+    try:
+        with zipfile.ZipFile(ruta) as z:
+            core = z.read("docProps/core.xml").decode("utf-8")
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return None
+    m = re.search(r"<dc:identifier>([^<]*)</dc:identifier>", core)
+    return m.group(1) if m else None
+
+
+def libro_vigente(ruta, huella):
+    """True si `ruta` ya es la salida de la huella `huella` (no hace falta generar)."""
+    return huella_libro(ruta) == huella
+
+
+def tiene_historial(ruta):
+    """True si el libro `ruta` existe y tiene al menos una serie en Registro."""
+    try:
+        wb = openpyxl.load_workbook(ruta, read_only=True, keep_links=False)
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return False
+    try:
+        if "Registro" not in wb.sheetnames:
+            return False
+        for (fecha,) in wb["Registro"].iter_rows(
+                min_row=FILA_INICIO_HISTORIAL, max_row=FILA_INICIO_HISTORIAL,
+                max_col=1, values_only=True):
+            return fecha not in (None, "")
+        return False
+    finally:
+        wb.close()
+
+
+def conservar_historial(ruta, config, capacidad, huella):
+    """
+    Pone al día en el sitio un libro que ya tiene series, en lugar de generarlo.
+
+    El libro de un miembro es también su historial (lo escriben la ingesta,
+    el almacén SQLite y el propio Excel): si `ruta` tiene series, solo se
+    regeneran sus hojas derivadas (actualizar_libro) y queda con `huella`.
+    Devuelve False si no hay historial que conservar y se puede generar
+    encima. Lanza ValueError si `capacidad` no es la del libro.
+    """
+    if not tiene_historial(ruta):
+        return False
+    actualizar_libro(ruta, config, capacidad, huella)
+    return True
+
+
+def escribir_si_cambia(ruta, texto):
+    """Escribe `texto` en `ruta` salvo que ya tenga ese contenido; True si escribió."""
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            if f.read() == texto:
+                return False
+    except OSError:
+        pass
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(texto)
+    return True
+
+
+def preparar_libro(streaming=False, capacidad=CAPACIDAD_HISTORIAL, historial=None,
+                   config=None):
+    """
+    Crea las cinco hojas y devuelve (wb, hojas) sin volcar las de streaming.
+
+    Permite ajustar las hojas write-only (p. ej. el generador del historial
+    de Registro) antes de escribirlas; construir_libro la usa tal cual.
+    """
+    config = config or configuracion()
+    wb = openpyxl.Workbook(write_only=streaming)
 
     # Eliminar la hoja por defecto
     if "Sheet" in wb.sheetnames:
         del wb["Sheet"]
 
+    # El índice de sesiones se llena a medida que Registro consume el historial
+    sesiones = {}
+    historial = acumular_sesiones(sesiones, historial or ())
+
     # Crear hojas
-    crear_hoja_datos(wb)        # primero: crea rangos con nombre
-    crear_hoja_registro(wb)
-    crear_hoja_rutinas(wb)
-    crear_hoja_dashboard(wb)
-    crear_hoja_instrucciones(wb)
+    hojas = [
+        crear_hoja_datos(wb, config),        # primero: crea rangos con nombre
+        crear_hoja_registro(wb, capacidad, historial, config),
+        crear_hoja_rutinas(wb, config),
+        crear_hoja_dashboard(wb, capacidad, config=config),
+        crear_hoja_instrucciones(wb, config),
+        crear_hoja_sesiones(wb, capacidad, sesiones),   # después de Registro
+    ]
 
     # Mover Instrucciones al principio? No, dejarlo al final.
     # Asegurar que Registro es la hoja activa
     wb.active = wb.sheetnames.index("Registro")
 
+    return wb, hojas
+
+
+def construir_libro(streaming=False, capacidad=CAPACIDAD_HISTORIAL, historial=None,
+                    config=None):
+    """
+    Construye el libro completo en memoria, listo para guardar.
+
+    `config` (ver configuracion()) fija rutinas y rangos de reps; sin ella
+    se usan RUTINAS y REPS_RANGES del módulo.
+
+    Con streaming=True se usa un libro write-only: las hojas se escriben
+    fila a fila y el historial sale de un generador, así que la memoria no
+    crece con la capacidad. El libro resultante solo puede guardarse una vez.
+    `historial` (filas A-H) se consume de forma perezosa al escribir Registro.
+    """
+    wb, hojas = preparar_libro(streaming, capacidad, historial, config)
+    for ws in hojas:
+        if isinstance(ws, HojaStreaming):
+            ws.volcar()
+
+    return wb
+
+
+def main(streaming=False, capacidad=CAPACIDAD_HISTORIAL, no_volatil=False,
+         forzar=False, valores=False):
+    config = configuracion(no_volatil=no_volatil)
+
     # ── Guardar como .xlsm con VBA ───────────────────────────────
     # openpyxl no soporta VBA nativamente en archivos nuevos.
     # Guardamos como .xlsx y creamos un archivo .bas con las macros.
-    output_xlsx = "/home/user/gym/Entrenamiento_Casa.xlsx"
-    output_vba  = "/home/user/gym/macros_entrenamiento.bas"
-
-    wb.save(output_xlsx)
+    output_xlsx = SALIDA_XLSX
+    output_vba  = SALIDA_VBA
 
     # Guardar el código VBA como archivo .bas importable
-    with open(output_vba, "w", encoding="utf-8") as f:
-        f.write(VBA_CODE)
+    escribir_si_cambia(output_vba, VBA_CODE)
+
+    # Misma huella que el libro ya generado: no hay nada que regenerar
+    modo = ("streaming" if streaming else "normal") + ("+valores" if valores else "")
+    huella = huella_generacion(config, capacidad, modo)
+    if not forzar and libro_vigente(output_xlsx, huella):
+        print(f"Sin cambios: {output_xlsx} ya está generado ({huella[:12]})")
+        return
+
+    if valores:
+        import evaluador    # evaluador importa este módulo
+
+    if conservar_historial(output_xlsx, config, capacidad, huella):
+        if valores:
+            evaluador.guardar_con_valores(output_xlsx, hoy=config["fecha_ref"])
+        print(f"{output_xlsx} tiene series en Registro: actualizado sin tocar el historial")
+        return
+    wb = construir_libro(streaming=streaming, capacidad=capacidad, config=config)
+    guardar_determinista(wb, output_xlsx, huella)
+    if valores:
+        # Los visores que no recalculan muestran el Dashboard ya calculado
+        evaluador.guardar_con_valores(output_xlsx, hoy=config["fecha_ref"])
 
     print(f"Archivo Excel creado: {output_xlsx}")
     print(f"Archivo de macros VBA: {output_vba}")
@@ -1043,4 +2626,41 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--streaming", action="store_true",
+                        help="generar con un libro write-only (memoria constante)")
+    parser.add_argument("--capacidad", type=int, default=CAPACIDAD_HISTORIAL,
+                        help="filas pre-formateadas del historial")
+    parser.add_argument("--no-volatil", action="store_true",
+                        help="sin TODAY()/INDIRECT: fechas contra la celda Fecha_Ref")
+    parser.add_argument("--importar", metavar="LOG",
+                        help="importar series desde un CSV/JSONL/JSON al libro --libro")
+    parser.add_argument("--libro", default=SALIDA_XLSX,
+                        help="libro destino de --importar (se crea si no existe)")
+    parser.add_argument("--forzar", action="store_true",
+                        help="generar aunque el libro ya tenga la huella actual")
+    parser.add_argument("--valores", action="store_true",
+                        help="guardar el resultado de cada fórmula (ver evaluador.py)")
+    parser.add_argument("--actualizar", metavar="LIBRO", nargs="+",
+                        help="regenerar las hojas derivadas de libros existentes, "
+                             "conservando el historial de Registro")
+    args = parser.parse_args()
+
+    if args.actualizar:
+        for ruta in args.actualizar:
+            actualizar_libro(ruta)
+            if args.valores:
+                import evaluador
+                evaluador.guardar_con_valores(ruta)
+            print(f"Libro actualizado: {ruta}")
+    elif args.importar:
+        resumen = importar_historial(args.importar, args.libro, args.capacidad)
+        print(f"Series importadas: {resumen['importadas']}")
+        print(f"Series rechazadas: {resumen['rechazadas']}")
+        for error in resumen["errores"]:
+            print(f"  - {error}")
+    else:
+        main(streaming=args.streaming, capacidad=args.capacidad,
+             no_volatil=args.no_volatil, forzar=args.forzar, valores=args.valores)
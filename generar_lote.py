@@ -0,0 +1,206 @@
+"""
+Genera en paralelo un libro de entrenamiento por miembro a partir de un roster.
+
+El roster es un JSON (lista) o JSONL (un miembro por línea) con:
+
+    {"id": "m001", "salida": "libros/m001.xlsx",
+     "rutinas": {"Lunes - Pecho": ["Flexiones", ...], ...},      # opcional
+     "reps_ranges": {"Flexiones": [10, 20], ...},                # opcional
+     "capacidad": 189,                                            # opcional
+     "no_volatil": true}                                          # opcional
+
+Sin "rutinas" o "reps_ranges" se usan RUTINAS y REPS_RANGES de
+generar_excel. Cada libro se genera en un proceso del pool clonando la
+plantilla de su forma (ver plantillas.py) o, con --sin-plantilla,
+construyéndolo entero en modo streaming con su configuración pasada
+explícitamente a los crear_hoja_*.
+
+Los libros salen reproducibles y con la huella de sus entradas en docProps
+(ver generar_excel.huella_generacion): un miembro cuyo libro ya tiene la
+huella actual no se regenera, así que un lote sin cambios solo lee el
+docProps de cada libro. Un libro que ya tiene series en Registro nunca se
+sobrescribe: se actualizan sus hojas derivadas en el sitio. Con --valores
+cada libro se guarda con el resultado de sus fórmulas (ver evaluador.py).
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+import json
+import os
+import time
+
+import evaluador
+import generar_excel
+import plantillas
+from generar_excel import CAPACIDAD_HISTORIAL, VBA_CODE
+
+
+def leer_roster(ruta):
+    """Lista de miembros del roster (JSON o JSONL)."""
+    with open(ruta, encoding="utf-8") as f:
+        if ruta.lower().endswith(".jsonl"):
+            miembros = [json.loads(linea) for linea in f if linea.strip()]
+        else:
+            miembros = json.load(f)
+    for num, miembro in enumerate(miembros, start=1):
+        for campo in ("id", "salida"):
+            if not miembro.get(campo):
+                raise ValueError(f"miembro {num} del roster sin '{campo}'")
+    return miembros
+
+
+def rango_reps(ejercicio, rango):
+    """(mín, máx) de un rango de reps del roster; ValueError si no son enteros 0 < mín <= máx."""
+    if not (isinstance(rango, (list, tuple)) and len(rango) == 2
+            and all(type(v) is int for v in rango) and 0 < rango[0] <= rango[1]):
+        raise ValueError(f"rango de reps de {ejercicio!r} inválido ({rango!r}); "
+                         "se espera [mín, máx] enteros con 0 < mín <= máx")
+    return tuple(rango)
+
+
+def config_miembro(miembro):
+    """Configuración de plantilla de un miembro del roster (ValueError si no es válida)."""
+    reps_ranges = miembro.get("reps_ranges")
+    if reps_ranges is not None:
+        if not isinstance(reps_ranges, dict):
+            raise ValueError(f"miembro {miembro.get('id')!r}: reps_ranges debe ser "
+                             "{ejercicio: [mín, máx]}")
+        try:
+            reps_ranges = {ej: rango_reps(ej, rango) for ej, rango in reps_ranges.items()}
+        except ValueError as e:
+            raise ValueError(f"miembro {miembro.get('id')!r}: {e}") from None
+    return generar_excel.configuracion(miembro.get("rutinas"), reps_ranges,
+                                       no_volatil=miembro.get("no_volatil", False))
+
+
+def huella_miembro(miembro, usar_plantilla=True, valores=False):
+    """Huella de generación del libro de un miembro."""
+    return generar_excel.huella_generacion(
+        config_miembro(miembro), miembro.get("capacidad", CAPACIDAD_HISTORIAL),
+        ("plantilla" if usar_plantilla else "streaming") + ("+valores" if valores else ""))
+
+
+def generar_miembro(miembro, usar_plantilla=True,
+                    dir_plantillas=plantillas.DIR_PLANTILLAS, valores=False):
+    """
+    Genera y guarda el libro de un miembro; devuelve (id, ruta, segundos, actualizado).
+
+    Un libro que ya tiene series no se sobrescribe: se actualiza en el sitio
+    (ver generar_excel.conservar_historial) y `actualizado` es True.
+    """
+    inicio = time.perf_counter()
+    ruta = miembro["salida"]
+    directorio = os.path.dirname(ruta)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    config = config_miembro(miembro)
+    capacidad = miembro.get("capacidad", CAPACIDAD_HISTORIAL)
+    huella = huella_miembro(miembro, usar_plantilla, valores)
+    if generar_excel.conservar_historial(ruta, config, capacidad, huella):
+        if valores:
+            evaluador.guardar_con_valores(ruta, hoy=config["fecha_ref"])
+        return miembro["id"], ruta, time.perf_counter() - inicio, True
+    if usar_plantilla:
+        plantillas.generar_desde_plantilla(ruta, config, capacidad, dir_plantillas,
+                                           huella=huella, valores=valores)
+    else:
+        wb = generar_excel.construir_libro(
+            streaming=True, capacidad=capacidad, config=config)
+        generar_excel.guardar_determinista(wb, ruta, huella)
+        if valores:
+            evaluador.guardar_con_valores(ruta, hoy=config["fecha_ref"])
+    return miembro["id"], ruta, time.perf_counter() - inicio, False
+
+
+def generar_lote(miembros, procesos=None, progreso=print, usar_plantilla=True,
+                 dir_plantillas=plantillas.DIR_PLANTILLAS, forzar=False, valores=False):
+    """
+    Genera los libros de `miembros` en un pool de procesos.
+
+    Los miembros cuyo libro ya tiene la huella actual se saltan (salvo con
+    `forzar`). Un fallo en un miembro no detiene el lote: se informa y se
+    sigue. Devuelve un resumen con generados, actualizados (libros con
+    historial puestos al día en el sitio), sin cambios, errores (id →
+    mensaje) y tiempos.
+    """
+    resumen = {"generados": 0, "actualizados": 0, "sin_cambios": 0, "errores": {},
+               "segundos": {}}
+    inicio = time.perf_counter()
+
+    # El módulo VBA es el mismo para todos: uno por carpeta de salida
+    for directorio in {os.path.dirname(m["salida"]) for m in miembros}:
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        generar_excel.escribir_si_cambia(
+            os.path.join(directorio, "macros_entrenamiento.bas"), VBA_CODE)
+
+    pendientes = []
+    for miembro in miembros:
+        try:
+            vigente = not forzar and generar_excel.libro_vigente(
+                miembro["salida"], huella_miembro(miembro, usar_plantilla, valores))
+        except Exception as e:
+            resumen["errores"][miembro["id"]] = str(e)
+            progreso(f"{miembro['id']}: ERROR {e}")
+            continue
+        if vigente:
+            resumen["sin_cambios"] += 1
+        else:
+            pendientes.append(miembro)
+    if resumen["sin_cambios"]:
+        progreso(f"{resumen['sin_cambios']} libros sin cambios")
+    total = len(pendientes)
+    if pendientes:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            tarea = partial(generar_miembro, usar_plantilla=usar_plantilla,
+                            dir_plantillas=dir_plantillas, valores=valores)
+            futuros = {pool.submit(tarea, m): m["id"] for m in pendientes}
+            for hechos, futuro in enumerate(as_completed(futuros), start=1):
+                id_miembro = futuros[futuro]
+                try:
+                    _, ruta, segundos, actualizado = futuro.result()
+                except Exception as e:
+                    resumen["errores"][id_miembro] = str(e)
+                    progreso(f"[{hechos}/{total}] {id_miembro}: ERROR {e}")
+                    continue
+                resumen["actualizados" if actualizado else "generados"] += 1
+                resumen["segundos"][id_miembro] = segundos
+                progreso(f"[{hechos}/{total}] {id_miembro}: {ruta}"
+                         f"{' (actualizado)' if actualizado else ''} ({segundos:.2f} s)")
+
+    resumen["total_segundos"] = time.perf_counter() - inicio
+    return resumen
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("roster", help="roster JSON/JSONL de miembros")
+    parser.add_argument("--procesos", type=int, default=None,
+                        help="procesos del pool (por defecto, uno por CPU)")
+    parser.add_argument("--sin-plantilla", action="store_true",
+                        help="construir cada libro entero en lugar de clonar plantillas")
+    parser.add_argument("--plantillas", default=plantillas.DIR_PLANTILLAS,
+                        help="carpeta de la caché de plantillas")
+    parser.add_argument("--forzar", action="store_true",
+                        help="regenerar también los libros que ya tienen la huella actual")
+    parser.add_argument("--valores", action="store_true",
+                        help="guardar el resultado de cada fórmula (ver evaluador.py)")
+    args = parser.parse_args()
+
+    resumen = generar_lote(leer_roster(args.roster), args.procesos,
+                           usar_plantilla=not args.sin_plantilla,
+                           dir_plantillas=args.plantillas, forzar=args.forzar,
+                           valores=args.valores)
+    tiempos = sorted(resumen["segundos"].values())
+    print()
+    print(f"Libros generados: {resumen['generados']}")
+    print(f"Actualizados (con historial): {resumen['actualizados']}")
+    print(f"Sin cambios: {resumen['sin_cambios']}")
+    print(f"Errores: {len(resumen['errores'])}")
+    if tiempos:
+        print(f"Tiempo por libro: mediana {tiempos[len(tiempos) // 2]:.2f} s, "
+              f"máximo {tiempos[-1]:.2f} s")
+    print(f"Tiempo total: {resumen['total_segundos']:.1f} s")
@@ -0,0 +1,399 @@
+"""
+Servicio de ingesta: recibe series de los quioscos y las vuelca por lotes.
+
+    POST /series    {"miembro": "m001", "series": [{"fecha": "2026-10-18",
+                     "rutina": "Lunes - Pecho y Tríceps", "ejercicio": "Flexiones",
+                     "serie": 1, "reps": 12, "peso": 0}, ...]}
+    GET  /estado    series pendientes, volcados y errores
+
+Cada serie se valida contra la configuración del miembro en el roster
+(ver generar_lote.leer_roster), se anota en el diario y entra en una cola
+asyncio; la respuesta (202) sale cuando el diario está en disco (fsync).
+Cada VENTANA_VOLCADO segundos, o antes si se juntan MAX_LOTE series, la
+cola se vuelca: por miembro, un load y un save del libro con todas sus
+series (generar_excel.agregar_series), en un pool de procesos.
+
+El diario es un write-ahead log en `--diario`: diario.jsonl recibe las
+series aceptadas; al volcar se cierra como segmento_NNNNNN.jsonl y, a
+medida que cada libro se guarda, su miembro se anota en el .hechos del
+segmento. Al arrancar se vuelcan los segmentos que quedaron (y el diario
+activo) saltando los miembros ya hechos, así que una caída no pierde
+series; a lo sumo repite las de un libro guardado justo antes de caer.
+Las series que no se pueden volcar (libro inexistente, historial lleno)
+van a rechazadas.jsonl, que se puede reimportar con generar_excel
+--importar.
+
+    python ingesta.py roster.jsonl --diario /home/user/gym/.ingesta
+    python ingesta.py roster.jsonl --socket /run/gym/ingesta.sock
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import json
+import multiprocessing
+import os
+import re
+import time
+
+import generar_excel
+import generar_lote
+from servidor import (
+    PeticionInvalida, enviar_respuesta, leer_peticion, respuesta_error,
+    respuesta_json,
+)
+
+PUERTO = 8081
+DIR_DIARIO = "/home/user/gym/.ingesta"
+# Segundos que se acumulan series antes de volcar, y series que fuerzan un
+# volcado antes de tiempo
+VENTANA_VOLCADO = 2.0
+MAX_LOTE = 5000
+# Series pendientes a partir de las que se responde 503 (los quioscos reintentan)
+MAX_PENDIENTES = 50000
+MAX_SERIES_PETICION = 500
+
+DIARIO = "diario.jsonl"
+RECHAZADAS = "rechazadas.jsonl"
+_RE_SEGMENTO = re.compile(r"segmento_(\d+)\.jsonl$")
+
+
+# ── Volcado (en los procesos del pool) ────────────────────────────
+def volcar_miembro(ruta, registros, config):
+    """Agrega `registros` al Registro del libro `ruta` con un load y un save."""
+    if not os.path.exists(ruta):
+        raise ValueError(f"no existe el libro {ruta}")
+    wb = generar_excel.cargar_libro(ruta)
+    if "Registro" not in wb.sheetnames:
+        raise ValueError(f"{ruta} no tiene hoja Registro; no es un libro de entrenamiento")
+    filas = [generar_excel.validar_serie(r, config) for r in registros]
+    agregadas = generar_excel.agregar_series(wb, filas)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    try:
+        wb.save(temporal)
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return agregadas
+
+
+# ── Diario ────────────────────────────────────────────────────────
+def _escribir_sincronizado(ruta, lineas):
+    with open(ruta, "a", encoding="utf-8") as f:
+        f.writelines(lineas)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def leer_segmento(ruta):
+    """Entradas {"miembro", "serie"} de un segmento; ignora una última línea a medias."""
+    entradas = []
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            if not linea.endswith("\n"):
+                break       # escritura cortada por una caída: no se confirmó
+            if linea.strip():
+                entradas.append(json.loads(linea))
+    return entradas
+
+
+def _por_miembro(entradas):
+    grupos = {}
+    for entrada in entradas:
+        grupos.setdefault(entrada["miembro"], []).append(entrada["serie"])
+    return grupos
+
+
+class Ingesta:
+    """Roster, diario, cola y volcador del servicio de ingesta."""
+
+    def __init__(self, miembros, directorio=DIR_DIARIO, procesos=None,
+                 ventana=VENTANA_VOLCADO, max_lote=MAX_LOTE):
+        # Un miembro mal configurado no detiene el servicio: sus series se rechazan
+        self.miembros = {}
+        self.miembros_invalidos = {}
+        for m in miembros:
+            try:
+                self.miembros[m["id"]] = (m["salida"], generar_lote.config_miembro(m))
+            except ValueError as e:
+                self.miembros_invalidos[m["id"]] = str(e)
+        self.directorio = directorio
+        self.ventana = ventana
+        self.max_lote = max_lote
+        os.makedirs(directorio, exist_ok=True)
+        # Sin fork: los procesos no heredan el bucle de eventos ni los sockets
+        self.pool = ProcessPoolExecutor(
+            max_workers=procesos, mp_context=multiprocessing.get_context("spawn"))
+        self.cola = None
+        self._diario = None
+        self._escritas = 0          # líneas anotadas en el diario (total)
+        self._sincronizadas = 0     # líneas con fsync hecho
+        self._sincronizar = None
+        self._hay_lote = None
+        self.contadores = {"aceptadas": 0, "rechazadas_peticion": 0, "volcadas": 0,
+                           "fallidas": 0, "volcados": 0, "libros_guardados": 0}
+        self.ultimo_volcado = None
+
+    def _ruta(self, nombre):
+        return os.path.join(self.directorio, nombre)
+
+    def _segmentos(self):
+        return sorted(glob.glob(self._ruta("segmento_*.jsonl")),
+                      key=lambda r: int(_RE_SEGMENTO.search(r).group(1)))
+
+    def _cerrar_diario(self):
+        """Cierra el diario activo como un segmento nuevo (o nada si está vacío)."""
+        if self._diario is not None:
+            self._diario.flush()
+            os.fsync(self._diario.fileno())
+            self._diario.close()
+            self._diario = None
+            self._sincronizadas = self._escritas
+        activo = self._ruta(DIARIO)
+        if not os.path.exists(activo) or os.path.getsize(activo) == 0:
+            return None
+        segmentos = self._segmentos()
+        n = int(_RE_SEGMENTO.search(segmentos[-1]).group(1)) + 1 if segmentos else 1
+        segmento = self._ruta(f"segmento_{n:06d}.jsonl")
+        os.replace(activo, segmento)
+        return segmento
+
+    def _abrir_diario(self):
+        self._diario = open(self._ruta(DIARIO), "a", encoding="utf-8")
+
+    # ── Recepción ─────────────────────────────────────────────────
+    def validar(self, peticion):
+        """(miembro, series) de una petición; PeticionInvalida si alguna serie no vale."""
+        if not isinstance(peticion, dict):
+            raise PeticionInvalida("el cuerpo debe ser un objeto JSON")
+        miembro = peticion.get("miembro")
+        if miembro in self.miembros_invalidos:
+            raise PeticionInvalida(
+                f"configuración inválida en el roster: {self.miembros_invalidos[miembro]}", 404)
+        if miembro not in self.miembros:
+            raise PeticionInvalida(f"miembro desconocido: {miembro!r}", 404)
+        series = peticion.get("series")
+        if series is None:
+            series = [{k: v for k, v in peticion.items() if k != "miembro"}]
+        if not isinstance(series, list) or not series:
+            raise PeticionInvalida("series debe ser una lista no vacía")
+        if len(series) > MAX_SERIES_PETICION:
+            raise PeticionInvalida(f"más de {MAX_SERIES_PETICION} series por petición", 413)
+        _, config = self.miembros[miembro]
+        errores = []
+        for i, serie in enumerate(series):
+            try:
+                generar_excel.validar_serie(serie, config)
+            except (ValueError, TypeError, AttributeError) as e:
+                errores.append(f"serie {i + 1}: {e}")
+        if errores:
+            raise PeticionInvalida("; ".join(errores[:generar_excel.MAX_ERRORES_REPORTADOS]))
+        return miembro, series
+
+    async def aceptar(self, miembro, series):
+        """Anota las series en el diario, las encola y espera a que estén en disco."""
+        if self.cola.qsize() + len(series) > MAX_PENDIENTES:
+            raise PeticionInvalida("demasiadas series pendientes; reintenta", 503)
+        # Diario y cola avanzan juntos: no hay await entre escribir y encolar
+        for serie in series:
+            self._diario.write(json.dumps({"miembro": miembro, "serie": serie},
+                                          ensure_ascii=False, default=str) + "\n")
+            self.cola.put_nowait((miembro, serie))
+        self._escritas += len(series)
+        objetivo = self._escritas
+        if self.cola.qsize() >= self.max_lote:
+            self._hay_lote.set()
+        # Commit en grupo: un fsync cubre todas las peticiones que llegaron antes
+        while self._sincronizadas < objetivo:
+            if self._sincronizar is None:
+                self._sincronizar = asyncio.ensure_future(self._fsync())
+            await asyncio.shield(self._sincronizar)
+        self.contadores["aceptadas"] += len(series)
+
+    async def _fsync(self):
+        try:
+            hasta = self._escritas
+            self._diario.flush()
+            await asyncio.to_thread(os.fsync, self._diario.fileno())
+            self._sincronizadas = max(self._sincronizadas, hasta)
+        finally:
+            self._sincronizar = None
+
+    # ── Volcado ───────────────────────────────────────────────────
+    async def volcar_segmento(self, segmento):
+        """Vuelca un segmento cerrado: un load/save por miembro y luego lo borra."""
+        hechos_ruta = segmento[:-len(".jsonl")] + ".hechos"
+        hechos = set()
+        if os.path.exists(hechos_ruta):
+            with open(hechos_ruta, encoding="utf-8") as f:
+                hechos = {linea.strip() for linea in f if linea.strip()}
+        grupos = {m: s for m, s in _por_miembro(leer_segmento(segmento)).items()
+                  if m not in hechos}
+
+        bucle = asyncio.get_running_loop()
+        tareas = {}
+        for miembro, series in grupos.items():
+            if miembro not in self.miembros:
+                tareas[miembro] = None
+                continue
+            ruta, config = self.miembros[miembro]
+            tareas[miembro] = bucle.run_in_executor(
+                self.pool, volcar_miembro, ruta, series, config)
+        for miembro, tarea in tareas.items():
+            try:
+                if tarea is None:
+                    raise ValueError(self.miembros_invalidos.get(
+                        miembro, f"miembro {miembro!r} ya no está en el roster"))
+                self.contadores["volcadas"] += await tarea
+                self.contadores["libros_guardados"] += 1
+            except Exception as e:
+                self.rechazar(miembro, grupos[miembro], e)
+            _escribir_sincronizado(hechos_ruta, [miembro + "\n"])
+        os.remove(segmento)
+        if os.path.exists(hechos_ruta):
+            os.remove(hechos_ruta)
+
+    def rechazar(self, miembro, series, error):
+        """Guarda en rechazadas.jsonl las series que no se pudieron volcar."""
+        lineas = [json.dumps({**serie, "miembro": miembro, "error": str(error)},
+                             ensure_ascii=False, default=str) + "\n" for serie in series]
+        _escribir_sincronizado(self._ruta(RECHAZADAS), lineas)
+        self.contadores["fallidas"] += len(series)
+
+    async def recuperar(self):
+        """Vuelca lo que quedó en disco de una ejecución anterior."""
+        self._cerrar_diario()
+        for segmento in self._segmentos():
+            await self.volcar_segmento(segmento)
+
+    async def volcador(self):
+        """Bucle de volcado: espera la ventana (o un lote lleno) y vuelca la cola."""
+        while True:
+            try:
+                await asyncio.wait_for(self._hay_lote.wait(), self.ventana)
+            except asyncio.TimeoutError:
+                pass
+            self._hay_lote.clear()
+            if self.cola.empty():
+                continue
+            inicio = time.perf_counter()
+            # Rotar y vaciar la cola sin await entre medias: el segmento tiene
+            # exactamente las series que salen de la cola
+            while self._sincronizar is not None:
+                await asyncio.shield(self._sincronizar)
+            self._cerrar_diario()
+            self._abrir_diario()
+            series = 0
+            while not self.cola.empty():
+                self.cola.get_nowait()
+                series += 1
+            # También los segmentos que un volcado anterior no pudo terminar
+            for segmento in self._segmentos():
+                try:
+                    await self.volcar_segmento(segmento)
+                except Exception as e:
+                    print(f"No se pudo volcar {segmento}: {e}; se reintenta")
+                    break
+            self.contadores["volcados"] += 1
+            self.ultimo_volcado = {"series": series,
+                                   "segundos": round(time.perf_counter() - inicio, 3)}
+
+    def estado(self):
+        return {**self.contadores, "pendientes": self.cola.qsize(),
+                "ultimo_volcado": self.ultimo_volcado,
+                "miembros_invalidos": self.miembros_invalidos}
+
+    # ── HTTP ──────────────────────────────────────────────────────
+    async def atender(self, lector, escritor):
+        """Una conexión: una petición y su respuesta (Connection: close)."""
+        try:
+            try:
+                respuesta = await self._responder(lector)
+            except PeticionInvalida as e:
+                if e.estado != 503:
+                    self.contadores["rechazadas_peticion"] += 1
+                respuesta = respuesta_error(e.estado, str(e))
+            await enviar_respuesta(escritor, *respuesta)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError):
+            pass
+        finally:
+            escritor.close()
+
+    async def _responder(self, lector):
+        metodo, url, cuerpo = await leer_peticion(lector)
+        if url.path == "/estado" and metodo == "GET":
+            return respuesta_json(200, self.estado())
+        if url.path != "/series":
+            return respuesta_error(404, f"ruta desconocida: {url.path}")
+        if metodo != "POST":
+            return respuesta_error(405, f"método no permitido: {metodo}")
+        try:
+            peticion = json.loads(cuerpo)
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise PeticionInvalida(f"cuerpo JSON inválido: {e}")
+        miembro, series = self.validar(peticion)
+        await self.aceptar(miembro, series)
+        return respuesta_json(202, {"aceptadas": len(series)})
+
+    async def iniciar(self):
+        """Recupera el diario anterior y deja lista la cola; devuelve la tarea del volcador."""
+        self.cola = asyncio.Queue()
+        self._hay_lote = asyncio.Event()
+        await self.recuperar()
+        self._abrir_diario()
+        return asyncio.create_task(self.volcador())
+
+    async def cerrar(self, volcador):
+        """Detiene el volcador y vuelca lo pendiente antes de salir."""
+        volcador.cancel()
+        try:
+            await volcador
+        except asyncio.CancelledError:
+            pass
+        await self.recuperar()
+        self.pool.shutdown()
+
+
+async def servir(ingesta, host="127.0.0.1", puerto=PUERTO, socket=None):
+    """Atiende peticiones (TCP o socket Unix) hasta que se cancele."""
+    volcador = await ingesta.iniciar()
+    if socket:
+        servidor = await asyncio.start_unix_server(ingesta.atender, socket, backlog=1024)
+    else:
+        servidor = await asyncio.start_server(ingesta.atender, host, puerto, backlog=1024)
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    finally:
+        await ingesta.cerrar(volcador)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("roster", help="roster JSON/JSONL de miembros (id → libro)")
+    parser.add_argument("--diario", default=DIR_DIARIO,
+                        help="carpeta del diario y de las series rechazadas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=PUERTO)
+    parser.add_argument("--socket", default=None,
+                        help="escuchar en un socket Unix en lugar de TCP")
+    parser.add_argument("--ventana", type=float, default=VENTANA_VOLCADO,
+                        help="segundos entre volcados")
+    parser.add_argument("--procesos", type=int, default=None,
+                        help="procesos del pool de volcado (por defecto, uno por CPU)")
+    args = parser.parse_args()
+
+    ingesta = Ingesta(generar_lote.leer_roster(args.roster), args.diario,
+                      args.procesos, args.ventana)
+    for miembro, error in ingesta.miembros_invalidos.items():
+        print(f"{miembro}: ignorado ({error})")
+    print(f"Ingesta en {args.socket or f'http://{args.host}:{args.puerto}/series'}")
+    try:
+        asyncio.run(servir(ingesta, args.host, args.puerto, args.socket))
+    except KeyboardInterrupt:
+        pass
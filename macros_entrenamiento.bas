@@ -9,13 +9,16 @@ Sub RegistrarEntrada()
     Set wsReg = ThisWorkbook.Sheets("Registro")
 
     ' Buscar la siguiente fila vacía en el historial (desde fila 12)
+    Dim filaFin As Long
+    filaFin = 11 + wsReg.Evaluate("Reg_Capacidad")
+
     Dim nextRow As Long
     nextRow = 12
     Do While wsReg.Cells(nextRow, 1).Value <> ""
         nextRow = nextRow + 1
-        If nextRow > 200 Then
-            MsgBox "El historial esta lleno (200 registros). " & _
-                   "Copia los datos a otro archivo para continuar.", _
+        If nextRow > filaFin Then
+            MsgBox "El historial esta lleno (" & (filaFin - 11) & " registros). " & _
+                   "Archiva los meses anteriores con rotar_historial.py para continuar.", _
                    vbExclamation, "Historial lleno"
             Exit Sub
         End If
@@ -33,10 +36,15 @@ Sub RegistrarEntrada()
     For col = 1 To 8
         wsReg.Cells(nextRow, col).Value = wsReg.Cells(6, col).Value
     Next col
+    ' Serie nueva: sin id del almacén SQLite (columna I)
+    wsReg.Cells(nextRow, 9).Value = ""
 
     ' Formatear la fecha
     wsReg.Cells(nextRow, 1).NumberFormat = "DD/MM/YYYY"
 
+    ' Sumar la serie a su sesión en la hoja Sesiones
+    ActualizarSesion wsReg, nextRow, 1
+
     ' Auto-incrementar Serie # y limpiar reps/peso (mantener ejercicio y dia)
     Dim serieActual As Variant
     serieActual = wsReg.Cells(6, 4).Value
@@ -107,8 +115,10 @@ Sub DeshacerUltimo()
                   vbYesNo + vbQuestion, "Confirmar")
 
     If resp = vbYes Then
+        ActualizarSesion wsReg, lastRow, -1
         Dim col As Integer
-        For col = 1 To 8
+        ' Hasta la columna I: el id del almacén no debe pasar a la próxima serie
+        For col = 1 To 9
             wsReg.Cells(lastRow, col).Value = ""
         Next col
         MsgBox "Ultimo registro eliminado.", vbInformation, "Deshecho"
@@ -116,6 +126,87 @@ Sub DeshacerUltimo()
 End Sub
 
 
+' ============================================================
+' Índice de sesiones: una fila por (fecha, rutina) en la hoja Sesiones
+' ============================================================
+' signo = 1 suma a su sesión la serie de la fila `fila` del historial;
+' signo = -1 la resta y quita la sesión si se queda sin sets.
+Sub ActualizarSesion(wsReg As Worksheet, fila As Long, signo As Integer)
+    Dim wsSes As Worksheet
+    On Error Resume Next  ' libros anteriores sin hoja Sesiones
+    Set wsSes = ThisWorkbook.Sheets("Sesiones")
+    On Error GoTo 0
+    If wsSes Is Nothing Then Exit Sub
+
+    Dim fecha As Variant, rutina As String
+    fecha = wsReg.Cells(fila, 1).Value
+    rutina = wsReg.Cells(fila, 2).Value
+
+    Dim ultima As Long
+    ultima = 1
+    Do While wsSes.Cells(ultima + 1, 1).Value <> ""
+        ultima = ultima + 1
+    Loop
+
+    ' Buscar desde el final: las series nuevas suelen ir a la última sesión
+    Dim r As Long
+    For r = ultima To 2 Step -1
+        If wsSes.Cells(r, 1).Value = fecha And wsSes.Cells(r, 2).Value = rutina Then Exit For
+    Next r
+    If r < 2 Then
+        If signo < 0 Then Exit Sub
+        r = ultima + 1
+        ultima = r
+        wsSes.Cells(r, 1).Value = fecha
+        wsSes.Cells(r, 1).NumberFormat = "DD/MM/YYYY"
+        wsSes.Cells(r, 2).Value = rutina
+    End If
+
+    Dim reps As Double, peso As Double
+    reps = Numero(wsReg.Cells(fila, 5).Value)
+    peso = Numero(wsReg.Cells(fila, 6).Value)
+    wsSes.Cells(r, 3).Value = Numero(wsSes.Cells(r, 3).Value) + signo
+    wsSes.Cells(r, 4).Value = Numero(wsSes.Cells(r, 4).Value) + signo * reps
+    wsSes.Cells(r, 5).Value = Numero(wsSes.Cells(r, 5).Value) + signo * reps * peso
+    wsSes.Cells(r, 6).Value = Round(Numero(wsSes.Cells(r, 6).Value) + _
+                                    signo * Numero(wsReg.Cells(fila, 7).Value) / 60, 2)
+
+    ' Sesión sin sets: subir las siguientes para no dejar huecos
+    If wsSes.Cells(r, 3).Value <= 0 Then
+        Dim k As Long
+        For k = r To ultima - 1
+            wsSes.Range(wsSes.Cells(k, 1), wsSes.Cells(k, 6)).Value = _
+                wsSes.Range(wsSes.Cells(k + 1, 1), wsSes.Cells(k + 1, 6)).Value
+        Next k
+        wsSes.Range(wsSes.Cells(ultima, 1), wsSes.Cells(ultima, 6)).ClearContents
+    End If
+End Sub
+
+Function Numero(valor As Variant) As Double
+    If IsNumeric(valor) And Not IsEmpty(valor) Then Numero = CDbl(valor)
+End Function
+
+
+' ============================================================
+' MACRO: Al abrir el libro, fijar la fecha de referencia
+' ============================================================
+' En los libros generados sin funciones volátiles, las fechas del Dashboard
+' y la fecha por defecto de la entrada se calculan contra Fecha_Ref en
+' lugar de TODAY(). Se actualiza una sola vez al abrir.
+Sub Auto_Open()
+    ActualizarFechaRef
+End Sub
+
+Sub ActualizarFechaRef()
+    Dim rng As Range
+    On Error Resume Next  ' libro generado con TODAY(): no hay Fecha_Ref
+    Set rng = ThisWorkbook.Names("Fecha_Ref").RefersToRange
+    On Error GoTo 0
+    If rng Is Nothing Then Exit Sub
+    If rng.Value <> Date Then rng.Value = Date
+End Sub
+
+
 ' ============================================================
 ' MACRO: Cargar ejercicios de la rutina seleccionada
 ' ============================================================
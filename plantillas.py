@@ -0,0 +1,186 @@
+"""
+Caché de plantillas: genera libros clonando un .xlsx ya construido.
+
+La mayor parte del libro (estilos, Registro pre-formateado, Dashboard,
+gráficos, Instrucciones) no depende del miembro. La plantilla se construye
+una vez con construir_libro usando marcadores en lugar de nombres de días,
+ejercicios, claves y rangos de reps; cada libro nuevo es una copia del zip
+con esos marcadores reemplazados en el XML.
+
+La plantilla depende de la "forma" de la configuración (número de días,
+qué ejercicio va en cada posición, orden del catálogo e ids, si el día
+tiene " - ", capacidad) y del código del generador (ver
+generar_excel.version_generador): ambas cosas entran en la clave de la caché.
+"""
+
+import datetime
+import hashlib
+import io
+import os
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from openpyxl.compat import safe_string
+from openpyxl.utils.datetime import to_excel
+
+import evaluador
+import generar_excel
+from generar_excel import CAPACIDAD_HISTORIAL
+
+DIR_PLANTILLAS = "/home/user/gym/.plantillas"
+
+# Marcadores de texto: QQTPL_<tipo><n>_QQ
+#   D = día (parte antes de " - "), R = resto del día, K = clave de rango,
+#   E = ejercicio del catálogo
+# Marcadores numéricos: 9876500000 + 2*j (reps min) y +1 (reps max)
+_MARCA = "QQTPL_{}{}_QQ"
+_RE_MARCA = re.compile(r"QQTPL_([DRKE])(\d+)_QQ")
+_BASE_REPS = 9876500000
+_RE_REPS = re.compile(r"<v>(98765\d{5})</v>")
+# Fecha_Ref (modo no volátil): fecha centinela que se cambia por la de hoy
+_FECHA_CENTINELA = datetime.date(2199, 12, 31)
+_V_FECHA_CENTINELA = f"<v>{safe_string(to_excel(_FECHA_CENTINELA))}</v>"
+
+# Plantillas ya leídas en este proceso (clave → bytes del .xlsx)
+_cache = {}
+
+
+def forma(config, capacidad=CAPACIDAD_HISTORIAL):
+    """Parte de la configuración que cambia la estructura del libro."""
+    indice = {ej: j for j, ej in enumerate(config["ejercicios"])}
+    return (
+        tuple(" - " in dia for dia in config["dias"]),
+        tuple(tuple(indice[ej] for ej in config["rutinas"][dia])
+              for dia in config["dias"]),
+        len(config["ejercicios"]),
+        tuple(indice[ej] for ej in config["catalogo"]),
+        tuple(config["ids"][ej] for ej in config["ejercicios"]),
+        capacidad,
+        config["no_volatil"],
+        config["puntos_grafico"],
+    )
+
+
+def clave_plantilla(config, capacidad=CAPACIDAD_HISTORIAL):
+    """Hash de version_generador() y de la forma de la configuración."""
+    datos = f"{generar_excel.version_generador()}|{forma(config, capacidad)!r}"
+    return hashlib.sha256(datos.encode("utf-8")).hexdigest()[:24]
+
+
+def _config_marcadores(config):
+    """Configuración con la misma forma que `config` pero con marcadores."""
+    dias = []
+    for i, dia in enumerate(config["dias"]):
+        nombre = _MARCA.format("D", i)
+        if " - " in dia:
+            nombre += " - " + _MARCA.format("R", i)
+        dias.append(nombre)
+    ejercicios = [_MARCA.format("E", j) for j in range(len(config["ejercicios"]))]
+    indice = {ej: j for j, ej in enumerate(config["ejercicios"])}
+    rutinas = {
+        marca: [ejercicios[indice[ej]] for ej in config["rutinas"][dia]]
+        for marca, dia in zip(dias, config["dias"])
+    }
+    return {
+        "rutinas": rutinas,
+        "dias": dias,
+        "claves_dia": {marca: _MARCA.format("K", i) for i, marca in enumerate(dias)},
+        "reps_ranges": {ej: (_BASE_REPS + 2 * j, _BASE_REPS + 2 * j + 1)
+                        for j, ej in enumerate(ejercicios)},
+        "ejercicios": ejercicios,
+        # Mismo orden de tabla que los nombres reales (no el de los marcadores)
+        "catalogo": [ejercicios[indice[ej]] for ej in config["catalogo"]],
+        "ids": {ejercicios[indice[ej]]: i for ej, i in config["ids"].items()},
+        "no_volatil": config["no_volatil"],
+        "fecha_ref": _FECHA_CENTINELA,
+        "puntos_grafico": config["puntos_grafico"],
+    }
+
+
+def obtener_plantilla(config, capacidad=CAPACIDAD_HISTORIAL,
+                      directorio=DIR_PLANTILLAS):
+    """Bytes de la plantilla para la forma de `config`; la construye si no existe."""
+    clave = clave_plantilla(config, capacidad)
+    if clave in _cache:
+        return _cache[clave]
+
+    ruta = os.path.join(directorio, f"plantilla_{clave}.xlsx")
+    if not os.path.exists(ruta):
+        os.makedirs(directorio, exist_ok=True)
+        wb = generar_excel.construir_libro(
+            streaming=True, capacidad=capacidad, config=_config_marcadores(config))
+        # Temporal + replace: varios procesos pueden construir la misma a la vez
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        wb.save(temporal)
+        os.replace(temporal, ruta)
+
+    with open(ruta, "rb") as f:
+        _cache[clave] = f.read()
+    return _cache[clave]
+
+
+def _entero(valor, ejercicio):
+    # Los números van tal cual al XML de la hoja: solo enteros
+    if (isinstance(valor, bool) or not isinstance(valor, (int, float))
+            or not float(valor).is_integer()):
+        raise ValueError(f"rango de reps de {ejercicio!r} no entero: {valor!r}")
+    return int(valor)
+
+
+def _reemplazos(config):
+    """Texto (XML-escapado) de cada marcador y valor de cada marcador numérico."""
+    textos = {}
+    for i, dia in enumerate(config["dias"]):
+        corto, _, resto = dia.partition(" - ")
+        textos[("D", i)] = escape(corto)
+        textos[("R", i)] = escape(resto)
+        textos[("K", i)] = escape(config["claves_dia"][dia])
+    numeros = {}
+    for j, ej in enumerate(config["ejercicios"]):
+        textos[("E", j)] = escape(ej)
+        rmin, rmax = config["reps_ranges"].get(ej, (8, 15))
+        numeros[_BASE_REPS + 2 * j] = _entero(rmin, ej)
+        numeros[_BASE_REPS + 2 * j + 1] = _entero(rmax, ej)
+    return textos, numeros
+
+
+def generar_desde_plantilla(ruta, config=None, capacidad=CAPACIDAD_HISTORIAL,
+                            directorio=DIR_PLANTILLAS, huella=None, valores=False):
+    """
+    Escribe en `ruta` un libro equivalente a construir_libro(config=...).
+
+    Copia la plantilla de la forma de `config` reemplazando los marcadores
+    en las partes XML; las demás partes se copian tal cual. La salida es
+    reproducible (ver generar_excel.escribir_zip_determinista) y lleva
+    `huella` en docProps. Con `valores` se guarda además el resultado de
+    cada fórmula (ver evaluador.guardar_con_valores): la plantilla es común
+    a todos los miembros, los valores dependen de la configuración de cada uno.
+    """
+    config = config or generar_excel.configuracion()
+    plantilla = obtener_plantilla(config, capacidad, directorio)
+    textos, numeros = _reemplazos(config)
+    fecha_ref = safe_string(to_excel(config["fecha_ref"] or datetime.date.today()))
+
+    def texto(m):
+        return textos[(m.group(1), int(m.group(2)))]
+
+    def numero(m):
+        return f"<v>{numeros[int(m.group(1))]}</v>"
+
+    partes = {}
+    with zipfile.ZipFile(io.BytesIO(plantilla)) as origen:
+        for info in origen.infolist():
+            datos = origen.read(info)
+            if info.filename.endswith(".xml"):
+                xml = datos.decode("utf-8")
+                xml = _RE_MARCA.sub(texto, xml)
+                xml = _RE_REPS.sub(numero, xml)
+                if config["no_volatil"]:
+                    xml = xml.replace(_V_FECHA_CENTINELA, f"<v>{fecha_ref}</v>")
+                datos = xml.encode("utf-8")
+            partes[info.filename] = datos
+    generar_excel.escribir_zip_determinista(ruta, partes, huella)
+    if valores:
+        evaluador.guardar_con_valores(ruta, hoy=config["fecha_ref"])
+    return ruta
@@ -0,0 +1,283 @@
+"""
+Rotación del historial de Registro: archiva los meses cerrados.
+
+Cuando el historial se llena, las series de los meses anteriores a los
+últimos `meses` salen de Registro a libros de archivo (uno por año, una hoja
+por mes, junto al libro) y en la hoja Historico del libro queda un resumen
+por mes y por ejercicio: sets, reps totales y peso máximo, que el Dashboard
+dibuja como peso máximo por mes bajo el gráfico de peso. Registro se
+compacta y vuelve a tener sitio libre; el índice de sesiones se recalcula
+con las series que quedan.
+
+    python rotar_historial.py Entrenamiento_Casa.xlsx --meses 3
+"""
+
+import datetime
+import os
+
+import openpyxl
+
+from generar_excel import (
+    COLUMNA_ID, FILA_GRAFICO_HISTORICO, FILA_INICIO_HISTORIAL, FILA_INICIO_HISTORICO,
+    NARANJA, cargar_libro, configuracion_libro, crear_hoja, escribir_sesiones,
+    estilo_banda, filas_registro, grafico_historico, indice_sesiones, leer_sesiones,
+    merge_and_set, set_cell,
+)
+
+# Meses que se quedan en Registro (el actual incluido)
+MESES_ACTIVOS = 3
+
+COLUMNAS_ARCHIVO = ["Fecha", "Día / Rutina", "Ejercicio", "Serie #",
+                    "Reps", "Peso (kg)", "Descanso (s)", "Notas"]
+
+
+def _numero(valor):
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return valor
+    return None
+
+
+def _fecha(valor):
+    if isinstance(valor, datetime.datetime):
+        return valor.date()
+    if isinstance(valor, datetime.date):
+        return valor
+    return None
+
+
+def inicio_periodo_activo(hoy, meses=MESES_ACTIVOS):
+    """Primer día del mes más antiguo que se queda en Registro."""
+    n = hoy.year * 12 + hoy.month - 1 - (meses - 1)
+    return datetime.date(n // 12, n % 12 + 1, 1)
+
+
+# ── Libros de archivo ─────────────────────────────────────────────
+def ruta_archivo(ruta, anio, directorio=None):
+    """Libro de archivo del año `anio` para el libro `ruta`."""
+    base = os.path.splitext(os.path.basename(ruta))[0]
+    return os.path.join(directorio or os.path.dirname(ruta),
+                        f"{base}_archivo_{anio}.xlsx")
+
+
+def archivar(ruta_archivo_anio, por_mes):
+    """
+    Agrega las filas de cada mes ({"AAAA-MM": filas}) a su hoja del archivo.
+
+    El libro de archivo se crea si no existe; una hoja ya existente (un mes
+    rotado en dos veces) se amplía al final.
+    """
+    if os.path.exists(ruta_archivo_anio):
+        wb = openpyxl.load_workbook(ruta_archivo_anio)
+    else:
+        wb = openpyxl.Workbook()
+        wb.remove(wb.active)
+    for mes in sorted(por_mes):
+        if mes in wb.sheetnames:
+            ws = wb[mes]
+        else:
+            ws = wb.create_sheet(mes)
+            ws.append(COLUMNAS_ARCHIVO)
+            ws.freeze_panes = "A2"
+            ws.column_dimensions["A"].width = 12
+            ws.column_dimensions["B"].width = 26
+            ws.column_dimensions["C"].width = 30
+        for fila in por_mes[mes]:
+            ws.append(fila)
+            ws.cell(row=ws.max_row, column=1).number_format = "DD/MM/YYYY"
+    temporal = f"{ruta_archivo_anio}.tmp"
+    wb.save(temporal)
+    os.replace(temporal, ruta_archivo_anio)
+
+
+# ── Hoja Historico ────────────────────────────────────────────────
+def leer_historico(wb):
+    """
+    Resumen ya guardado en la hoja Historico.
+
+    Devuelve ({(mes, ejercicio): [sets, reps, peso máx.]}, {mes: archivo}).
+    """
+    detalle, archivos = {}, {}
+    if "Historico" not in wb.sheetnames:
+        return detalle, archivos
+    ws = wb["Historico"]
+    for fila in ws.iter_rows(min_row=FILA_INICIO_HISTORICO, min_col=2, max_col=12,
+                             values_only=True):
+        mes, _, _, _, archivo, _, mes_ej, ejercicio, sets, reps, peso = fila
+        if mes not in (None, ""):
+            archivos[mes] = archivo
+        if mes_ej not in (None, ""):
+            detalle[(mes_ej, ejercicio)] = [sets or 0, reps or 0, peso or 0]
+    return detalle, archivos
+
+
+def meses_archivados(ruta):
+    """Meses ("AAAA-MM") que la hoja Historico de `ruta` da por archivados."""
+    wb = openpyxl.load_workbook(ruta, read_only=True)
+    try:
+        return set(leer_historico(wb)[1])
+    finally:
+        wb.close()
+
+
+def resumir(detalle, filas):
+    """Acumula en `detalle` las filas archivadas (sets, reps, peso máx.)."""
+    for fila in filas:
+        fecha, ejercicio, reps, peso = _fecha(fila[0]), fila[2], fila[4], fila[5]
+        clave = (f"{fecha:%Y-%m}", ejercicio or "")
+        acumulado = detalle.setdefault(clave, [0, 0, 0])
+        acumulado[0] += 1
+        acumulado[1] += _numero(reps) or 0
+        acumulado[2] = max(acumulado[2], _numero(peso) or 0)
+    return detalle
+
+
+def crear_hoja_historico(wb, detalle, archivos):
+    """
+    Hoja Historico con el resumen de los meses archivados.
+
+    B-F: un renglón por mes (sets, reps, peso máx. y libro de archivo);
+    H-L: un renglón por mes y ejercicio. El gráfico del Dashboard (ver
+    generar_excel.grafico_historico) usa la tabla por mes.
+    """
+    posicion = None
+    if "Historico" in wb.sheetnames:
+        posicion = wb.sheetnames.index("Historico")
+        del wb["Historico"]
+    ws = crear_hoja(wb, "Historico")
+    if posicion is not None:
+        wb.move_sheet(ws, offset=posicion - wb.sheetnames.index("Historico"))
+    ws.sheet_properties.tabColor = NARANJA
+
+    ws.column_dimensions["A"].width = 2
+    for letra, ancho in zip("BCDEFGHIJKL", (10, 10, 12, 14, 36, 2, 10, 32, 10, 12, 14)):
+        ws.column_dimensions[letra].width = ancho
+
+    merge_and_set(ws, 1, 1, 1, 12, "HISTÓRICO DE ENTRENAMIENTOS", "titulo")
+    merge_and_set(ws, 2, 1, 2, 12,
+                  "Resumen de los meses archivados con rotar_historial.py. Las "
+                  "series completas están en los libros de archivo.",
+                  "nota_naranja")
+
+    merge_and_set(ws, 4, 2, 4, 6, "RESUMEN POR MES", "subtitulo")
+    merge_and_set(ws, 4, 8, 4, 12, "POR EJERCICIO", "subtitulo_oscuro")
+    for c, h in enumerate(["Mes", "Sets", "Total Reps", "Peso Máx (kg)",
+                           "Archivo"], start=2):
+        set_cell(ws, 5, c, h, "encabezado")
+    for c, h in enumerate(["Mes", "Ejercicio", "Sets", "Total Reps",
+                           "Peso Máx (kg)"], start=8):
+        set_cell(ws, 5, c, h, "encabezado_verde")
+
+    por_mes = {}
+    for i, ((mes, ejercicio), (sets, reps, peso)) in enumerate(sorted(detalle.items())):
+        r = FILA_INICIO_HISTORICO + i
+        set_cell(ws, r, 8, mes, estilo_banda(i))
+        set_cell(ws, r, 9, ejercicio, estilo_banda(i, "izq"))
+        set_cell(ws, r, 10, sets, estilo_banda(i))
+        set_cell(ws, r, 11, reps, estilo_banda(i))
+        set_cell(ws, r, 12, peso, estilo_banda(i))
+        total = por_mes.setdefault(mes, [0, 0, 0])
+        total[0] += sets
+        total[1] += reps
+        total[2] = max(total[2], peso)
+
+    for i, (mes, (sets, reps, peso)) in enumerate(sorted(por_mes.items())):
+        r = FILA_INICIO_HISTORICO + i
+        for c, valor in enumerate([mes, sets, reps, peso], start=2):
+            set_cell(ws, r, c, valor, estilo_banda(i))
+        set_cell(ws, r, 6, archivos.get(mes, ""), estilo_banda(i, "izq"))
+
+    ws.freeze_panes = "A6"
+    return ws
+
+
+# ── Rotación ──────────────────────────────────────────────────────
+def rotar_historial(ruta, meses=MESES_ACTIVOS, hoy=None, directorio=None):
+    """
+    Saca de Registro las series anteriores a los últimos `meses` meses.
+
+    Las series salen a los libros de archivo de cada año (en `directorio`,
+    por defecto la carpeta del libro) y se resumen en la hoja Historico;
+    las que quedan se suben al principio del historial. Los archivos se
+    guardan antes que el libro, así que un fallo nunca pierde series (a lo
+    sumo quedan repetidas en el archivo). Devuelve un resumen de la rotación.
+    """
+    hoy = hoy or datetime.date.today()
+    corte = inicio_periodo_activo(hoy, meses)
+    wb = cargar_libro(ruta)
+    if "Registro" not in wb.sheetnames:
+        raise ValueError(f"{ruta} no tiene hoja Registro; no es un libro de entrenamiento")
+    ws = wb["Registro"]
+
+    filas = filas_registro(ws)
+    archivadas, restantes = [], []
+    for i, fila in enumerate(filas):
+        fecha = _fecha(fila[0])
+        if fecha is not None and fecha < corte:
+            archivadas.append(fila)
+        else:
+            id_serie = ws.cell(row=FILA_INICIO_HISTORIAL + i, column=COLUMNA_ID).value
+            restantes.append(fila + [id_serie])
+    resumen = {"archivadas": len(archivadas), "restantes": len(restantes),
+               "meses": [], "archivos": []}
+    if not archivadas:
+        return resumen
+
+    por_anio = {}
+    for fila in archivadas:
+        fecha = _fecha(fila[0])
+        por_anio.setdefault(fecha.year, {}).setdefault(
+            f"{fecha:%Y-%m}", []).append(fila)
+
+    detalle, archivos = leer_historico(wb)
+    for anio, por_mes in sorted(por_anio.items()):
+        destino = ruta_archivo(ruta, anio, directorio)
+        archivar(destino, por_mes)
+        resumen["archivos"].append(destino)
+        for mes in por_mes:
+            archivos[mes] = os.path.basename(destino)
+            resumen["meses"].append(mes)
+    resumir(detalle, archivadas)
+    crear_hoja_historico(wb, detalle, archivos)
+    if "Dashboard" in wb.sheetnames:
+        d = max(0, len(configuracion_libro(wb)["dias"]) - 5)
+        grafico_historico(wb, wb["Dashboard"], f"H{FILA_GRAFICO_HISTORICO + d}")
+
+    # Compactar Registro: solo valores A-I (I es el id del almacén SQLite,
+    # que acompaña a su fila), los estilos y J-M no cambian
+    for i in range(len(filas)):
+        valores = restantes[i] if i < len(restantes) else [""] * 8 + [None]
+        for c, valor in enumerate(valores, start=1):
+            ws.cell(row=FILA_INICIO_HISTORIAL + i, column=c).value = valor
+    if "Sesiones" in wb.sheetnames:
+        ws_ses = wb["Sesiones"]
+        escribir_sesiones(ws_ses, indice_sesiones(restantes),
+                          previas=len(leer_sesiones(ws_ses)))
+
+    temporal = f"{ruta}.tmp"
+    wb.save(temporal)
+    os.replace(temporal, ruta)
+    return resumen
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("libros", nargs="+", help="libros a rotar")
+    parser.add_argument("--meses", type=int, default=MESES_ACTIVOS,
+                        help="meses que se quedan en Registro (el actual incluido)")
+    parser.add_argument("--archivo", default=None,
+                        help="carpeta de los libros de archivo (por defecto, la del libro)")
+    args = parser.parse_args()
+
+    for ruta in args.libros:
+        resumen = rotar_historial(ruta, args.meses, directorio=args.archivo)
+        if not resumen["archivadas"]:
+            print(f"{ruta}: nada que archivar")
+            continue
+        print(f"{ruta}: {resumen['archivadas']} series archivadas "
+              f"({', '.join(sorted(resumen['meses']))}), "
+              f"{resumen['restantes']} quedan en Registro")
+        for destino in resumen["archivos"]:
+            print(f"  archivo: {destino}")
@@ -0,0 +1,347 @@
+"""
+Servicio HTTP local que genera libros personalizados bajo demanda.
+
+    GET  /libro                  libro con RUTINAS y REPS_RANGES del módulo
+    GET  /libro?capacidad=2000&no_volatil=1
+    POST /libro                  cuerpo JSON como un miembro del roster:
+                                 {"rutinas": {...}, "reps_ranges": {...},
+                                  "capacidad": 189, "no_volatil": false}
+    GET  /metricas               peticiones, aciertos de caché y latencias
+
+Los libros se generan desde plantillas (ver plantillas.py) en un pool de
+procesos, para que una generación lenta no bloquee el bucle de eventos, y
+se guardan en una caché LRU en memoria con límite de entradas y de bytes.
+La clave es la huella de generación (generar_excel.huella_generacion):
+dos peticiones con la misma configuración comparten el libro, y si llegan
+a la vez, también la generación en curso.
+
+    python servidor.py --puerto 8080 --procesos 4
+"""
+
+import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import generar_lote
+import plantillas
+from generar_excel import CAPACIDAD_HISTORIAL
+
+PUERTO = 8080
+# Límites de la caché de libros generados
+MAX_LIBROS = 256
+MAX_BYTES_CACHE = 256 * 2**20
+# Capacidad máxima que se acepta en una petición
+MAX_CAPACIDAD = 20000
+MAX_CUERPO = 2**20
+# Latencias que se guardan para los percentiles de /metricas
+VENTANA_LATENCIAS = 2000
+TAMANO_TROZO = 64 * 2**10
+NOMBRE_DESCARGA = "Entrenamiento_Casa.xlsx"
+TIPO_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+ESTADOS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class PeticionInvalida(ValueError):
+    """Petición que no se puede atender; `estado` es el código HTTP (400...)."""
+
+    def __init__(self, mensaje, estado=400):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+# ── Generación (en los procesos del pool) ─────────────────────────
+def construir_bytes(miembro, huella, dir_plantillas=plantillas.DIR_PLANTILLAS):
+    """Bytes del .xlsx de un miembro del roster (sin "salida")."""
+    config = generar_lote.config_miembro(miembro)
+    capacidad = miembro.get("capacidad", CAPACIDAD_HISTORIAL)
+    fd, ruta = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        plantillas.generar_desde_plantilla(ruta, config, capacidad, dir_plantillas,
+                                           huella=huella)
+        with open(ruta, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(ruta)
+
+
+def miembro_peticion(consulta, cuerpo):
+    """Miembro (formato del roster) a partir de la query y el cuerpo JSON."""
+    miembro = {}
+    if cuerpo:
+        try:
+            miembro = json.loads(cuerpo)
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise PeticionInvalida(f"cuerpo JSON inválido: {e}")
+        if not isinstance(miembro, dict):
+            raise PeticionInvalida("el cuerpo debe ser un objeto JSON")
+    for campo in ("rutinas", "reps_ranges"):
+        if campo in consulta:
+            try:
+                miembro[campo] = json.loads(consulta[campo][-1])
+            except json.JSONDecodeError as e:
+                raise PeticionInvalida(f"{campo} no es JSON: {e}")
+    if "capacidad" in consulta:
+        miembro["capacidad"] = consulta["capacidad"][-1]
+    if "no_volatil" in consulta:
+        miembro["no_volatil"] = consulta["no_volatil"][-1].lower() in ("1", "true", "si", "sí")
+
+    capacidad = miembro.get("capacidad", CAPACIDAD_HISTORIAL)
+    try:
+        if isinstance(capacidad, bool):
+            raise TypeError
+        capacidad = int(capacidad)
+    except (TypeError, ValueError):
+        raise PeticionInvalida(f"capacidad no numérica: {capacidad!r}")
+    if not 1 <= capacidad <= MAX_CAPACIDAD:
+        raise PeticionInvalida(f"capacidad fuera de rango (1-{MAX_CAPACIDAD})")
+    miembro["capacidad"] = capacidad
+    rutinas = miembro.get("rutinas")
+    if rutinas is not None and not (
+            isinstance(rutinas, dict) and rutinas
+            and all(isinstance(ejs, list) and ejs and all(isinstance(e, str) for e in ejs)
+                    for ejs in rutinas.values())):
+        raise PeticionInvalida("rutinas debe ser {día: [ejercicios]} sin listas vacías")
+    reps = miembro.get("reps_ranges")
+    if reps is not None:
+        if not isinstance(reps, dict):
+            raise PeticionInvalida("reps_ranges debe ser {ejercicio: [mín, máx]}")
+        try:
+            for ejercicio, rango in reps.items():
+                generar_lote.rango_reps(ejercicio, rango)
+        except ValueError as e:
+            raise PeticionInvalida(str(e))
+    return miembro
+
+
+# ── Caché y métricas ──────────────────────────────────────────────
+class CacheLibros:
+    """LRU de libros generados (huella → bytes) con límite de entradas y bytes."""
+
+    def __init__(self, max_libros=MAX_LIBROS, max_bytes=MAX_BYTES_CACHE):
+        self.max_libros = max_libros
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._libros = OrderedDict()
+
+    def __len__(self):
+        return len(self._libros)
+
+    def obtener(self, clave):
+        datos = self._libros.get(clave)
+        if datos is not None:
+            self._libros.move_to_end(clave)
+        return datos
+
+    def guardar(self, clave, datos):
+        if len(datos) > self.max_bytes:
+            return      # no cabe: se sirve sin guardarlo
+        if clave in self._libros:
+            self.bytes -= len(self._libros.pop(clave))
+        self._libros[clave] = datos
+        self.bytes += len(datos)
+        while len(self._libros) > self.max_libros or self.bytes > self.max_bytes:
+            _, expulsado = self._libros.popitem(last=False)
+            self.bytes -= len(expulsado)
+
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return None
+    return ordenados[min(len(ordenados) - 1, int(p / 100 * len(ordenados)))]
+
+
+# ── Servicio ──────────────────────────────────────────────────────
+class ServicioLibros:
+    """Caché, pool de generación y métricas del servicio HTTP."""
+
+    def __init__(self, procesos=None, max_libros=MAX_LIBROS,
+                 max_bytes=MAX_BYTES_CACHE, dir_plantillas=plantillas.DIR_PLANTILLAS):
+        self.cache = CacheLibros(max_libros, max_bytes)
+        # Sin fork: los procesos no heredan el bucle de eventos ni los sockets
+        self.pool = ProcessPoolExecutor(
+            max_workers=procesos, mp_context=multiprocessing.get_context("spawn"))
+        self.dir_plantillas = dir_plantillas
+        self._en_curso = {}     # huella → Future de la generación compartida
+        self._latencias = deque(maxlen=VENTANA_LATENCIAS)
+        self.contadores = {"peticiones": 0, "aciertos": 0, "fallos": 0,
+                           "compartidas": 0, "generaciones": 0, "errores": 0,
+                           "bytes_enviados": 0}
+        self.inicio = time.time()
+
+    async def libro(self, miembro):
+        """Bytes del libro de `miembro`: de la caché, de una generación en curso o nuevo."""
+        huella = generar_lote.huella_miembro(miembro, usar_plantilla=True)
+        datos = self.cache.obtener(huella)
+        if datos is not None:
+            self.contadores["aciertos"] += 1
+            return datos
+        futuro = self._en_curso.get(huella)
+        if futuro is not None:
+            self.contadores["compartidas"] += 1
+            return await asyncio.shield(futuro)
+
+        self.contadores["fallos"] += 1
+        bucle = asyncio.get_running_loop()
+        futuro = bucle.run_in_executor(self.pool, construir_bytes, miembro, huella,
+                                       self.dir_plantillas)
+        self._en_curso[huella] = futuro
+        try:
+            datos = await asyncio.shield(futuro)
+        finally:
+            del self._en_curso[huella]
+        self.contadores["generaciones"] += 1
+        self.cache.guardar(huella, datos)
+        return datos
+
+    def metricas(self):
+        ordenadas = sorted(self._latencias)
+        # Una petición que se suma a una generación en curso cuenta como acierto
+        aciertos = self.contadores["aciertos"] + self.contadores["compartidas"]
+        consultas = aciertos + self.contadores["fallos"]
+        return {
+            **self.contadores,
+            "tasa_aciertos": round(aciertos / consultas, 4) if consultas else None,
+            "en_curso": len(self._en_curso),
+            "cache_libros": len(self.cache),
+            "cache_bytes": self.cache.bytes,
+            "latencia_ms": {f"p{p}": (None if v is None else round(v * 1000, 2))
+                            for p in (50, 95, 99)
+                            for v in [_percentil(ordenadas, p)]},
+            "segundos_activo": round(time.time() - self.inicio, 1),
+        }
+
+    # ── HTTP ──────────────────────────────────────────────────────
+    async def atender(self, lector, escritor):
+        """Una conexión: una petición y su respuesta (Connection: close)."""
+        inicio = time.perf_counter()
+        try:
+            try:
+                estado, cabeceras, cuerpo = await self._responder(lector)
+            except PeticionInvalida as e:
+                estado, cabeceras, cuerpo = respuesta_error(e.estado, str(e))
+            await enviar_respuesta(escritor, estado, cabeceras, cuerpo)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError):
+            return
+        finally:
+            escritor.close()
+        self.contadores["bytes_enviados"] += len(cuerpo)
+        self._latencias.append(time.perf_counter() - inicio)
+
+    async def _responder(self, lector):
+        metodo, url, cuerpo = await leer_peticion(lector)
+        self.contadores["peticiones"] += 1
+        if url.path == "/metricas" and metodo == "GET":
+            return respuesta_json(200, self.metricas())
+        if url.path != "/libro":
+            return respuesta_error(404, f"ruta desconocida: {url.path}")
+        if metodo not in ("GET", "POST"):
+            return respuesta_error(405, f"método no permitido: {metodo}")
+        try:
+            miembro = miembro_peticion(parse_qs(url.query), cuerpo)
+            datos = await self.libro(miembro)
+        except PeticionInvalida as e:
+            return respuesta_error(e.estado, str(e))
+        except Exception as e:
+            self.contadores["errores"] += 1
+            return respuesta_error(500, f"no se pudo generar el libro: {e}")
+        return 200, {
+            "Content-Type": TIPO_XLSX,
+            "Content-Disposition": f'attachment; filename="{NOMBRE_DESCARGA}"',
+        }, datos
+
+    def cerrar(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+# ── HTTP mínimo (también lo usa ingesta.py) ──────────────────────
+async def leer_peticion(lector, max_cuerpo=MAX_CUERPO):
+    """(método, url, cuerpo) de una petición HTTP/1.1 leída de `lector`."""
+    linea = (await lector.readuntil(b"\r\n")).decode("latin-1").split()
+    cabeceras = {}
+    while True:
+        cabecera = (await lector.readuntil(b"\r\n")).decode("latin-1")
+        if cabecera == "\r\n":
+            break
+        nombre, _, valor = cabecera.partition(":")
+        cabeceras[nombre.strip().lower()] = valor.strip()
+    if len(linea) != 3:
+        raise PeticionInvalida("línea de petición inválida")
+    try:
+        longitud = int(cabeceras.get("content-length") or 0)
+    except ValueError:
+        raise PeticionInvalida("Content-Length inválido")
+    if longitud > max_cuerpo:
+        raise PeticionInvalida(f"cuerpo de más de {max_cuerpo} bytes", 413)
+    cuerpo = await lector.readexactly(longitud) if longitud else b""
+    return linea[0], urlsplit(linea[1]), cuerpo
+
+
+async def enviar_respuesta(escritor, estado, cabeceras, cuerpo):
+    """Escribe la respuesta en trozos respetando la contrapresión del cliente."""
+    cabecera = [f"HTTP/1.1 {estado} {ESTADOS[estado]}",
+                f"Content-Length: {len(cuerpo)}", "Connection: close"]
+    cabecera += [f"{nombre}: {valor}" for nombre, valor in cabeceras.items()]
+    escritor.write(("\r\n".join(cabecera) + "\r\n\r\n").encode("latin-1"))
+    vista = memoryview(cuerpo)
+    for i in range(0, len(cuerpo), TAMANO_TROZO):
+        escritor.write(vista[i:i + TAMANO_TROZO])
+        await escritor.drain()
+    await escritor.drain()
+
+
+def respuesta_json(estado, datos):
+    cuerpo = json.dumps(datos, ensure_ascii=False, indent=2).encode("utf-8")
+    return estado, {"Content-Type": "application/json; charset=utf-8"}, cuerpo
+
+
+def respuesta_error(estado, mensaje):
+    return respuesta_json(estado, {"error": mensaje})
+
+
+async def servir(host="127.0.0.1", puerto=PUERTO, servicio=None):
+    """Atiende peticiones en host:puerto hasta que se cancele."""
+    servicio = servicio or ServicioLibros()
+    # backlog amplio: cientos de descargas concurrentes en una sola máquina
+    servidor = await asyncio.start_server(servicio.atender, host, puerto, backlog=1024)
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    finally:
+        servicio.cerrar()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=PUERTO)
+    parser.add_argument("--procesos", type=int, default=None,
+                        help="procesos del pool de generación (por defecto, uno por CPU)")
+    parser.add_argument("--max-libros", type=int, default=MAX_LIBROS,
+                        help="libros que guarda la caché")
+    parser.add_argument("--max-mib", type=int, default=MAX_BYTES_CACHE // 2**20,
+                        help="memoria máxima de la caché (MiB)")
+    parser.add_argument("--plantillas", default=plantillas.DIR_PLANTILLAS,
+                        help="carpeta de la caché de plantillas")
+    args = parser.parse_args()
+
+    servicio = ServicioLibros(args.procesos, args.max_libros, args.max_mib * 2**20,
+                              args.plantillas)
+    print(f"Sirviendo libros en http://{args.host}:{args.puerto}/libro")
+    try:
+        asyncio.run(servir(args.host, args.puerto, servicio))
+    except KeyboardInterrupt:
+        pass
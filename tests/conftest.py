@@ -0,0 +1,33 @@
+"""Configuración común de las pruebas: módulos del repo y un historial de ejemplo."""
+
+import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generar_excel  # noqa: E402
+
+
+def filas_ejemplo(dias=6, series=3):
+    """Filas A-H de Registro: `series` series por ejercicio en `dias` sesiones."""
+    filas = []
+    rutinas = list(generar_excel.RUTINAS.items())
+    inicio = datetime.datetime(2024, 1, 1)
+    for d in range(dias):
+        rutina, ejercicios = rutinas[d % len(rutinas)]
+        fecha = inicio + datetime.timedelta(days=2 * d)
+        for ejercicio in ejercicios[:2]:
+            minimo, maximo = generar_excel.REPS_RANGES.get(ejercicio, (8, 12))
+            for s in range(1, series + 1):
+                reps = (minimo, maximo, maximo + 2)[s % 3]
+                filas.append([fecha, rutina, ejercicio, s, reps,
+                              5.0 + d, 60, "nota" if s == 1 else ""])
+    return filas
+
+
+@pytest.fixture
+def historial():
+    return filas_ejemplo()
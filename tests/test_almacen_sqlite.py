@@ -0,0 +1,103 @@
+import datetime
+
+import openpyxl
+import pytest
+
+import almacen_sqlite
+import analitica
+import generar_excel
+import rotar_historial
+
+RUTINA = next(iter(generar_excel.RUTINAS))
+EJERCICIO = generar_excel.RUTINAS[RUTINA][0]
+
+
+def _fila(fecha, reps):
+    return [datetime.datetime.combine(fecha, datetime.time()), RUTINA, EJERCICIO,
+            1, reps, 10, 60, ""]
+
+
+def _libro(ruta):
+    """(reps, id) de cada fila de Registro."""
+    return [(fila[4], fila[8]) for fila in analitica.iterar_registro(
+        ruta, generar_excel.COLUMNA_ID)]
+
+
+@pytest.fixture
+def libro(tmp_path):
+    ruta = str(tmp_path / "m1.xlsx")
+    wb = generar_excel.construir_libro(capacidad=30)
+    generar_excel.agregar_series(wb, [_fila(datetime.date(2024, m, d), 10 + d)
+                                      for m in (1, 3) for d in (1, 2, 3)])
+    wb.save(ruta)
+    return ruta
+
+
+@pytest.fixture
+def con(tmp_path):
+    con = almacen_sqlite.abrir(str(tmp_path / "gym.db"))
+    yield con
+    con.close()
+
+
+def _sincronizar(con, ruta):
+    return almacen_sqlite.sincronizar(con, [{"id": "m1", "salida": ruta}])["m1"]
+
+
+def test_ida_y_vuelta(con, libro):
+    cambios, total = _sincronizar(con, libro)
+    assert cambios["nuevas"] == total == 6
+    ids = [id_serie for _, id_serie in _libro(libro)]
+    assert all(isinstance(i, int) for i in ids) and len(set(ids)) == 6
+    # Sin cambios: nada que importar y el libro queda igual
+    assert _sincronizar(con, libro)[0] == {"nuevas": 0, "actualizadas": 0,
+                                           "borradas": 0, "archivadas": 0}
+
+    # Libro → base: una serie editada, una borrada y una nueva sin id
+    wb = openpyxl.load_workbook(libro)
+    ws = wb["Registro"]
+    ws["E12"] = 99
+    ws.delete_rows(13)
+    generar_excel.agregar_series(wb, [_fila(datetime.date(2024, 3, 20), 7)])
+    wb.save(libro)
+    cambios, total = _sincronizar(con, libro)
+    assert (cambios["nuevas"], cambios["actualizadas"], cambios["borradas"]) == (1, 1, 1)
+    assert total == 6
+    assert [f[4] for f in almacen_sqlite.series_rango(con, "m1")] == \
+        [99, 13, 11, 12, 13, 7]
+
+    # Base → libro: cambios de otros programas mandan sobre el libro
+    with con:
+        con.execute("UPDATE series SET reps = 1 WHERE id = ?", (ids[0],))
+        con.execute("DELETE FROM series WHERE id = ?", (ids[-1],))
+    _sincronizar(con, libro)
+    assert [reps for reps, _ in _libro(libro)] == [1, 13, 11, 12, 7]
+
+
+def test_deshacer_no_hereda_el_id(con, libro):
+    _sincronizar(con, libro)
+    wb = openpyxl.load_workbook(libro)
+    ws = wb["Registro"]
+    # Un DeshacerUltimo anterior vaciaba solo A-H: el id queda en la fila
+    for c in range(1, 9):
+        ws.cell(row=17, column=c).value = None
+    generar_excel.agregar_series(wb, [_fila(datetime.date(2024, 3, 4), 5)])
+    wb.save(libro)
+    assert _libro(libro)[-1] == (5, None)
+    cambios, _ = _sincronizar(con, libro)
+    assert (cambios["nuevas"], cambios["actualizadas"], cambios["borradas"]) == (1, 0, 1)
+
+
+def test_rotacion_no_borra_de_la_base(con, libro, tmp_path):
+    _sincronizar(con, libro)
+    resumen = rotar_historial.rotar_historial(libro, meses=1, hoy=datetime.date(2024, 3, 15),
+                                              directorio=str(tmp_path))
+    assert resumen["archivadas"] == 3
+    cambios, total = _sincronizar(con, libro)
+    assert (cambios["borradas"], cambios["archivadas"]) == (0, 3)
+    # El libro se queda con lo que no se archivó y la base lo conserva todo
+    assert total == 3 and len(_libro(libro)) == 3
+    assert len(almacen_sqlite.series_rango(con, "m1")) == 6
+    assert almacen_sqlite.mejor_serie(con, "m1", EJERCICIO,
+                                      hasta=datetime.date(2024, 1, 31))[4] == 13
+    assert _sincronizar(con, libro)[0]["archivadas"] == 0
@@ -0,0 +1,80 @@
+import datetime
+import zipfile
+
+import openpyxl
+from openpyxl.utils.datetime import to_excel
+
+import analitica
+import evaluador
+import generar_excel
+import plantillas
+
+HOY = datetime.date(2024, 1, 20)
+
+
+def _normalizar(valor):
+    if isinstance(valor, (datetime.date, datetime.datetime)):
+        return to_excel(valor)
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+
+def _recalcula_al_abrir(ruta):
+    with zipfile.ZipFile(ruta) as z:
+        return b"fullCalcOnLoad" in z.read("xl/workbook.xml")
+
+
+def _libro_con_valores(tmp_path, historial):
+    ruta = str(tmp_path / "libro.xlsx")
+    generar_excel.construir_libro(capacidad=100, historial=historial).save(ruta)
+    resumen = evaluador.guardar_con_valores(ruta, hoy=HOY)
+    return ruta, resumen
+
+
+def test_valores_en_cache_coinciden_con_analitica(tmp_path, historial):
+    ruta, resumen = _libro_con_valores(tmp_path, historial)
+    assert resumen["sin_calcular"] == 0
+    metricas = analitica.calcular_metricas(analitica.cargar_registro(ruta), hoy=HOY)
+    ws = openpyxl.load_workbook(ruta, data_only=True)["Dashboard"]
+
+    def valores(celdas):
+        return [_normalizar(ws[c].value) for c in celdas]
+
+    assert valores(["B6", "D6", "F6", "H6", "J6"]) == \
+        [_normalizar(v) for v in metricas["kpis"]]
+    for r, fila in enumerate(metricas["por_dia"].values(), start=11):
+        assert valores([f"{c}{r}" for c in "CDEF"]) == list(fila)
+    assert valores([f"C{r}" for r in range(18, 24)]) == \
+        [_normalizar(v) for v in metricas["insights"]]
+    assert valores(["C27", "C28", "C29"]) == metricas["alertas"]
+    for r, fila in enumerate(metricas["ultimos"][:3], start=33):
+        assert valores([f"{c}{r}" for c in "BCDEF"]) == [_normalizar(v) for v in fila]
+
+
+def test_sin_historial_quita_fullcalconload(tmp_path):
+    ruta, resumen = _libro_con_valores(tmp_path, [])
+    assert resumen["sin_calcular"] == 0
+    wb = openpyxl.load_workbook(ruta, data_only=True)
+    assert wb["Dashboard"]["J6"].value == 0
+    assert not _recalcula_al_abrir(ruta)
+
+
+def test_celdas_sin_calcular_conservan_fullcalconload(tmp_path):
+    ruta = str(tmp_path / "libro.xlsx")
+    wb = generar_excel.construir_libro(capacidad=20)
+    wb["Dashboard"]["Z1"] = "=FUNCION_DESCONOCIDA(1)"
+    wb.save(ruta)
+    resumen = evaluador.guardar_con_valores(ruta, hoy=HOY)
+    assert resumen["sin_calcular"] == 1
+    assert _recalcula_al_abrir(ruta)
+
+
+def test_plantilla_con_valores(tmp_path):
+    ruta = str(tmp_path / "miembro.xlsx")
+    config = generar_excel.configuracion(no_volatil=True, fecha_ref=HOY)
+    plantillas.generar_desde_plantilla(ruta, config, 20, str(tmp_path / "plantillas"),
+                                       valores=True)
+    assert not _recalcula_al_abrir(ruta)
+    ws = openpyxl.load_workbook(ruta, data_only=True)["Dashboard"]
+    assert ws["J6"].value == 0
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import os
+
+import openpyxl
+import pytest
+
+import generar_excel
+import ingesta
+from servidor import PeticionInvalida
+
+RUTINA = "Lunes - Pecho y Tríceps"
+
+
+def _serie(n):
+    return {"fecha": "2024-01-15", "rutina": RUTINA, "ejercicio": "Flexiones clásicas",
+            "serie": n, "reps": 12, "peso": 0}
+
+
+def _entrada(miembro, n):
+    return json.dumps({"miembro": miembro, "serie": _serie(n)}) + "\n"
+
+
+def _series(ruta):
+    ws = openpyxl.load_workbook(ruta)["Registro"]
+    return [fila[3] for fila in generar_excel.filas_registro(ws)]
+
+
+@pytest.fixture
+def roster(tmp_path):
+    miembros = [{"id": f"m{i}", "salida": str(tmp_path / f"m{i}.xlsx")} for i in range(3)]
+    for m in miembros:
+        generar_excel.construir_libro(capacidad=20).save(m["salida"])
+    return miembros
+
+
+def _arrancar_y_cerrar(ing):
+    async def ciclo():
+        volcador = await ing.iniciar()
+        await ing.cerrar(volcador)
+    asyncio.run(ciclo())
+
+
+def test_recupera_el_diario_de_una_caida(tmp_path, roster):
+    diario = tmp_path / "diario"
+    diario.mkdir()
+    # Segmento a medio volcar: m0 ya se guardó antes de la caída
+    (diario / "segmento_000003.jsonl").write_text(_entrada("m0", 1) + _entrada("m1", 2))
+    (diario / "segmento_000003.hechos").write_text("m0\n")
+    # Diario activo con la última línea cortada (no se confirmó)
+    (diario / ingesta.DIARIO).write_text(_entrada("m2", 3) + '{"miembro": "m2", "se')
+
+    ing = ingesta.Ingesta(roster, str(diario), procesos=1)
+    _arrancar_y_cerrar(ing)
+
+    assert [_series(m["salida"]) for m in roster] == [[], [2], [3]]
+    assert ing.contadores["volcadas"] == 2
+    assert not [f for f in os.listdir(diario) if f.startswith("segmento_")]
+
+
+def test_rechaza_series_que_no_se_pueden_volcar(tmp_path, roster):
+    roster.append({"id": "sin_libro", "salida": str(tmp_path / "no_existe.xlsx")})
+    diario = tmp_path / "diario"
+    diario.mkdir()
+    (diario / "segmento_000001.jsonl").write_text(
+        _entrada("sin_libro", 1) + _entrada("baja", 2) + _entrada("m0", 3))
+
+    ing = ingesta.Ingesta(roster, str(diario), procesos=1)
+    _arrancar_y_cerrar(ing)
+
+    assert _series(roster[0]["salida"]) == [3]
+    with open(diario / ingesta.RECHAZADAS, encoding="utf-8") as f:
+        rechazadas = {r["miembro"]: r for r in map(json.loads, f)}
+    assert set(rechazadas) == {"sin_libro", "baja"}
+    assert "no existe el libro" in rechazadas["sin_libro"]["error"]
+    assert rechazadas["baja"]["serie"] == 2
+    assert ing.contadores["fallidas"] == 2
+
+
+def test_valida_peticiones(tmp_path, roster):
+    roster.append({"id": "mal", "salida": str(tmp_path / "mal.xlsx"),
+                   "reps_ranges": {"Flexiones clásicas": [20, 10]}})
+    ing = ingesta.Ingesta(roster, str(tmp_path / "diario"), procesos=1)
+    try:
+        assert ing.validar({"miembro": "m0", "series": [_serie(1)]}) == ("m0", [_serie(1)])
+        casos = [
+            ({"miembro": "zz", "series": [_serie(1)]}, 404),
+            ({"miembro": "mal", "series": [_serie(1)]}, 404),
+            ({"miembro": "m0", "series": []}, 400),
+            ({"miembro": "m0", "series": [{**_serie(1), "rutina": "X"}]}, 400),
+            ({"miembro": "m0", "series": [{**_serie(1), "reps": "doce"}]}, 400),
+        ]
+        for peticion, estado in casos:
+            with pytest.raises(PeticionInvalida) as error:
+                ing.validar(peticion)
+            assert error.value.estado == estado
+    finally:
+        ing.pool.shutdown()
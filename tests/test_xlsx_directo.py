@@ -0,0 +1,18 @@
+import xlsx_directo
+
+from conftest import filas_ejemplo
+
+
+def test_verificar_sin_historial():
+    assert xlsx_directo.verificar(capacidad=50) == []
+
+
+def test_verificar_con_historial(historial):
+    assert xlsx_directo.verificar(capacidad=len(historial) + 10,
+                                  historial=historial) == []
+
+
+def test_verificar_historial_lleno():
+    historial = filas_ejemplo(dias=10)
+    assert xlsx_directo.verificar(capacidad=len(historial),
+                                  historial=historial) == []
@@ -0,0 +1,292 @@
+"""
+Escritor directo de SpreadsheetML para libros con historiales grandes.
+
+Con capacidades grandes casi todo el tiempo se va en el historial de
+Registro: crear un WriteOnlyCell por celda y serializarlo con etree. Aquí
+openpyxl solo genera el esqueleto (las hojas, estilos, nombres, gráficos y
+dos filas de muestra del historial y de Sesiones); las filas del historial
+se escriben como texto XML en bloques repartidos entre procesos y se
+insertan en la parte de Registro al armar el zip, y el índice de sesiones
+que se acumula al leerlas se escribe en la parte de Sesiones.
+
+El resultado es idéntico byte a byte al de construir_libro(streaming=True)
+salvo por las fechas de docProps/core.xml; comparar_libros lo comprueba.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import io
+from itertools import islice
+import re
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+from openpyxl.compat import safe_string
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.datetime import to_excel
+
+import generar_excel
+from generar_excel import (
+    CAPACIDAD_HISTORIAL, FILA_INICIO_HISTORIAL, FILA_INICIO_SESIONES, HojaStreaming,
+    acumular_sesiones, formulas_auxiliares,
+)
+
+# Filas del historial por tarea del pool
+TAMANO_BLOQUE = 20000
+
+# Por debajo de esta capacidad no compensa arrancar procesos
+MIN_FILAS_PARALELO = 2 * TAMANO_BLOQUE
+
+COLUMNAS = [get_column_letter(c) for c in range(1, 9)]
+COLUMNAS_AUX = [get_column_letter(c) for c in range(10, 14)]
+COLUMNAS_SESIONES = [get_column_letter(c) for c in range(1, 7)]
+
+# Dos series de sesiones distintas: dan al esqueleto una fila de muestra de
+# cada paridad en Registro y en Sesiones
+_MUESTRA = [
+    [datetime.date(2000, 1, 1), "muestra", "", "", "", "", "", ""],
+    [datetime.date(2000, 1, 2), "muestra", "", "", "", "", "", ""],
+]
+
+
+# ── Serialización de celdas ───────────────────────────────────────
+def _texto(valor):
+    """Contenido de <t>, con xml:space="preserve" si hay espacios en los bordes."""
+    limpio = valor.strip()
+    if limpio and valor != limpio:
+        return f'<t xml:space="preserve">{escape(valor)}</t>'
+    return f"<t>{escape(valor)}</t>"
+
+
+def xml_celda(ref, estilo, valor):
+    """Elemento <c> como lo escribe openpyxl para una celda con estilo `estilo`."""
+    if valor is None or valor == "":
+        return f'<c r="{ref}" s="{estilo}" t="{"n" if valor is None else "inlineStr"}" />'
+    if isinstance(valor, bool):
+        return f'<c r="{ref}" s="{estilo}" t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float)):
+        return f'<c r="{ref}" s="{estilo}" t="n"><v>{safe_string(valor)}</v></c>'
+    if isinstance(valor, (datetime.date, datetime.time)):
+        return f'<c r="{ref}" s="{estilo}" t="n"><v>{safe_string(to_excel(valor))}</v></c>'
+    valor = str(valor)
+    if valor.startswith("=") and len(valor) > 1:
+        return f'<c r="{ref}" s="{estilo}"><f>{escape(valor[1:])}</f><v /></c>'
+    return f'<c r="{ref}" s="{estilo}" t="inlineStr"><is>{_texto(valor)}</is></c>'
+
+
+def renderizar_filas(inicio, fin, estilos, valores=()):
+    """
+    XML de las filas inicio..fin-1 del historial.
+
+    `estilos` es {paridad: [style_id de A-H]}; `valores` son las filas A-H
+    que llenan las primeras filas del bloque.
+    """
+    datos = iter(valores)
+    partes = []
+    for r in range(inicio, fin):
+        fila = next(datos, None) or [""] * 8
+        partes.append(f'<row r="{r}">')
+        for col, estilo, valor in zip(COLUMNAS, estilos[r % 2], fila):
+            partes.append(xml_celda(f"{col}{r}", estilo, valor))
+        for col, formula in zip(COLUMNAS_AUX, formulas_auxiliares(r)):
+            partes.append(f'<c r="{col}{r}"><f>{escape(formula[1:])}</f><v /></c>')
+        partes.append("</row>")
+    return "".join(partes)
+
+
+def _renderizar_bloque(argumentos):
+    return renderizar_filas(*argumentos)
+
+
+def renderizar_sesiones(sesiones, estilos):
+    """
+    XML de las filas de la hoja Sesiones.
+
+    `estilos` es {paridad de la fila: [style_id de A-F]}; la fila 2 (primera
+    sesión) es par, así que coincide con la paridad del número de sesión.
+    """
+    partes = []
+    for i, (clave, totales) in enumerate(sesiones.items()):
+        r = FILA_INICIO_SESIONES + i
+        partes.append(f'<row r="{r}">')
+        for col, estilo, valor in zip(COLUMNAS_SESIONES, estilos[i % 2],
+                                      [clave[0], clave[1], *totales]):
+            partes.append(xml_celda(f"{col}{r}", estilo, valor))
+        partes.append("</row>")
+    return "".join(partes)
+
+
+# ── Esqueleto con openpyxl ────────────────────────────────────────
+def _parte_hoja(z, titulo):
+    """Ruta dentro del zip de la hoja `titulo`."""
+    libro = z.read("xl/workbook.xml").decode("utf-8")
+    rid = re.search(rf'<sheet name={re.escape(quoteattr(titulo))}[^>]*r:id="([^"]+)"',
+                    libro).group(1)
+    rels = z.read("xl/_rels/workbook.xml.rels").decode("utf-8")
+    destino = re.search(rf'Target="([^"]+)" Id="{rid}"', rels).group(1)
+    return destino.lstrip("/")
+
+
+def _filas_muestra(xml, primera, columnas):
+    """Estilos por paridad de las filas `primera` y `primera`+1 de una hoja."""
+    estilos = {}
+    for r in (primera, primera + 1):
+        fila = re.search(rf'<row r="{r}">.*?</row>', xml).group(0)
+        estilos[r % 2] = [re.search(rf'<c r="{col}{r}" s="(\d+)"', fila).group(1)
+                          for col in columnas]
+    return estilos
+
+
+def _recortar(xml, primera):
+    """(antes, después) del XML sin las dos filas de muestra desde `primera`."""
+    ini = xml.index(f'<row r="{primera}">')
+    cierre = f'<row r="{primera + 1}">'
+    corte = xml.index("</row>", xml.index(cierre)) + len("</row>")
+    return xml[:ini], xml[corte:]
+
+
+def _esqueleto(capacidad, config):
+    """
+    Libro completo con solo dos filas del historial (una par y una impar),
+    que a su vez dan dos filas de muestra en Sesiones.
+
+    Devuelve (bytes del .xlsx, {hoja: parte}, {hoja: estilos por paridad}).
+    """
+    wb, hojas = generar_excel.preparar_libro(
+        streaming=True, capacidad=capacidad, historial=_MUESTRA, config=config)
+    for ws in hojas:
+        if isinstance(ws, HojaStreaming) and ws.title == "Registro":
+            fila, filas = ws.filas_generadas
+            ws.filas_generadas = (fila, islice(filas, 2))
+        ws.volcar()
+    buffer = io.BytesIO()
+    wb.save(buffer)
+
+    partes, estilos = {}, {}
+    with zipfile.ZipFile(buffer) as z:
+        for titulo, primera, columnas in (
+                ("Registro", FILA_INICIO_HISTORIAL, COLUMNAS),
+                ("Sesiones", FILA_INICIO_SESIONES, COLUMNAS_SESIONES)):
+            partes[titulo] = _parte_hoja(z, titulo)
+            xml = z.read(partes[titulo]).decode("utf-8")
+            estilos[titulo] = _filas_muestra(xml, primera, columnas)
+    return buffer.getvalue(), partes, estilos
+
+
+# ── Armado del libro ──────────────────────────────────────────────
+def construir_directo(ruta, capacidad=CAPACIDAD_HISTORIAL, historial=None,
+                      config=None, procesos=None):
+    """
+    Escribe en `ruta` el mismo libro que construir_libro(streaming=True).
+
+    Las filas del historial se generan en bloques de TAMANO_BLOQUE; si la
+    capacidad llega a MIN_FILAS_PARALELO los bloques van a un pool de
+    `procesos` procesos. `historial` se consume bloque a bloque.
+    """
+    config = config or generar_excel.configuracion()
+    plantilla, partes, estilos = _esqueleto(capacidad, config)
+    fin = FILA_INICIO_HISTORIAL + capacidad
+    sesiones = {}
+    datos = acumular_sesiones(sesiones, historial or ())
+    bloques = (
+        (inicio, min(inicio + TAMANO_BLOQUE, fin), estilos["Registro"],
+         list(islice(datos, TAMANO_BLOQUE)))
+        for inicio in range(FILA_INICIO_HISTORIAL, fin, TAMANO_BLOQUE)
+    )
+
+    with zipfile.ZipFile(io.BytesIO(plantilla)) as origen, \
+            zipfile.ZipFile(ruta, "w", zipfile.ZIP_DEFLATED) as destino:
+        # Registro va antes que Sesiones en el zip: al llegar a Sesiones el
+        # historial ya se consumió y el índice está completo
+        for info in origen.infolist():
+            if info.filename == partes["Registro"]:
+                xml = origen.read(info).decode("utf-8")
+                antes, despues = _recortar(xml, FILA_INICIO_HISTORIAL)
+                with destino.open(info, "w") as salida:
+                    salida.write(antes.encode("utf-8"))
+                    if capacidad >= MIN_FILAS_PARALELO and procesos != 1:
+                        with ProcessPoolExecutor(max_workers=procesos) as pool:
+                            for texto in pool.map(_renderizar_bloque, bloques):
+                                salida.write(texto.encode("utf-8"))
+                    else:
+                        for bloque in bloques:
+                            salida.write(renderizar_filas(*bloque).encode("utf-8"))
+                    salida.write(despues.encode("utf-8"))
+            elif info.filename == partes["Sesiones"]:
+                xml = origen.read(info).decode("utf-8")
+                antes, despues = _recortar(xml, FILA_INICIO_SESIONES)
+                texto = antes + renderizar_sesiones(sesiones, estilos["Sesiones"]) + despues
+                destino.writestr(info, texto.encode("utf-8"))
+            else:
+                destino.writestr(info, origen.read(info))
+    return ruta
+
+
+# ── Verificación ──────────────────────────────────────────────────
+# Partes que cambian en cada guardado (fechas de creación/modificación)
+PARTES_VOLATILES = {"docProps/core.xml"}
+
+
+def comparar_libros(ruta_a, ruta_b):
+    """
+    Diferencias byte a byte entre dos .xlsx, parte por parte.
+
+    Ignora PARTES_VOLATILES. Devuelve una lista vacía si son equivalentes.
+    """
+    diferencias = []
+    with zipfile.ZipFile(ruta_a) as a, zipfile.ZipFile(ruta_b) as b:
+        nombres_a, nombres_b = a.namelist(), b.namelist()
+        if nombres_a != nombres_b:
+            diferencias.append(f"partes distintas: {nombres_a} != {nombres_b}")
+        for nombre in nombres_a:
+            if nombre in PARTES_VOLATILES or nombre not in nombres_b:
+                continue
+            xml_a, xml_b = a.read(nombre), b.read(nombre)
+            if xml_a != xml_b:
+                pos = next((i for i, (x, y) in enumerate(zip(xml_a, xml_b)) if x != y),
+                           min(len(xml_a), len(xml_b)))
+                diferencias.append(
+                    f"{nombre}: difiere en el byte {pos}: "
+                    f"{xml_a[pos:pos + 60]!r} != {xml_b[pos:pos + 60]!r}")
+    return diferencias
+
+
+def verificar(capacidad=CAPACIDAD_HISTORIAL, historial=None, config=None,
+              procesos=None):
+    """Construye el libro por ambas vías y devuelve comparar_libros de ambos."""
+    historial = list(historial or ())
+    directo, referencia = io.BytesIO(), io.BytesIO()
+    construir_directo(directo, capacidad, historial, config, procesos)
+    generar_excel.construir_libro(
+        streaming=True, capacidad=capacidad, historial=historial,
+        config=config).save(referencia)
+    return comparar_libros(directo, referencia)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("salida", nargs="?", default=generar_excel.SALIDA_XLSX)
+    parser.add_argument("--capacidad", type=int, default=CAPACIDAD_HISTORIAL,
+                        help="filas pre-formateadas del historial")
+    parser.add_argument("--procesos", type=int, default=None,
+                        help="procesos para las filas del historial")
+    parser.add_argument("--verificar", action="store_true",
+                        help="comparar con la salida de openpyxl en lugar de escribir")
+    args = parser.parse_args()
+
+    if args.verificar:
+        diferencias = verificar(args.capacidad, procesos=args.procesos)
+        for diferencia in diferencias:
+            print(diferencia)
+        print("Equivalente a openpyxl" if not diferencias else
+              f"{len(diferencias)} partes distintas")
+        raise SystemExit(1 if diferencias else 0)
+
+    inicio = time.perf_counter()
+    construir_directo(args.salida, args.capacidad, procesos=args.procesos)
+    print(f"Archivo Excel creado: {args.salida} "
+          f"({time.perf_counter() - inicio:.2f} s)")